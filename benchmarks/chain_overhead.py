@@ -0,0 +1,117 @@
+"""
+返信生成の1リクエストあたりのLLM呼び出し以外のオーバーヘッド計測
+
+チェーンの構成要素（PydanticOutputParser・フォーマット指示・ChatPromptTemplate・ChatOpenAI）を
+リクエストごとに組み立てて描画する場合（registryなし）と、起動時に構築したレジストリ
+（build_chain_registry）のチェーンでプロンプトを描画し、トークン数を見積もる場合を比較する。
+LLMは呼び出さないため、OpenAIのAPIキーやネットワークは不要。
+
+    pipenv run python benchmarks/chain_overhead.py --iterations 500
+
+リクエストごとに生成したLLMクライアントが初回の呼び出しで払うTLSハンドシェイクは含まない
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+# DBには接続しないが、モジュールの読み込みでエンジンを作成するため
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from langchain.output_parsers import PydanticOutputParser  # noqa: E402
+from langchain_core.prompts import ChatPromptTemplate  # noqa: E402
+from langchain_openai import ChatOpenAI  # noqa: E402
+from pydantic import SecretStr  # noqa: E402
+
+from service.app.api import langchain_routes  # noqa: E402
+from service.modules.chain_registry import RegisteredChain  # noqa: E402
+
+
+def _percentile(values: List[float], ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+def _report(name: str, seconds: List[float]) -> None:
+    ms = [value * 1000 for value in seconds]
+    print(f"{name:>14}: p50={statistics.median(ms):.2f}ms p95={_percentile(ms, 0.95):.2f}ms "
+          f"mean={statistics.mean(ms):.2f}ms")
+
+
+def _inputs(registered: RegisteredChain) -> Dict[str, str]:
+    """返信生成の典型的な長さに近い入力値"""
+    history = "\n".join(f"彼女: 今日は{i}時まで仕事だったよ\nあなた: お疲れさま！{i}時までは長いね" for i in range(20))
+    values = {
+        "message": "週末は何してたの？",
+        "conversation_history": history,
+        "message_count": "21",
+        "user_profile": "名前: たける\n年齢: 29\n趣味: 登山、料理\n職業: エンジニア",
+        "target_profile": "名前: さき\n年齢: 27\n趣味: カフェ巡り、映画、ヨガ\n職業: 看護師",
+        "user_tone": "丁寧",
+    }
+    return {name: values.get(name, "テスト") for name in registered.prompt.input_variables}
+
+
+async def _per_request(registered: RegisteredChain, inputs: Dict[str, str]) -> None:
+    """チェーンの構成要素をリクエストごとに組み立てて描画する（レジストリ導入前の処理）"""
+    parser = PydanticOutputParser(pydantic_object=langchain_routes.ReplyResponse)
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", langchain_routes.REPLY_SYSTEM_PROMPT),
+        ("system", langchain_routes.PROFILE_CONTEXT_PROMPT),
+        ("system", langchain_routes.CONVERSATION_CONTEXT_PROMPT),
+        ("human", "女性からのメッセージ: {message}"),
+    ])
+    ChatOpenAI(
+        model=registered.model,
+        temperature=registered.temperature,
+        api_key=SecretStr(os.environ["OPENAI_API_KEY"]),
+    )
+    await prompt.ainvoke({**inputs, "format_instructions": parser.get_format_instructions()})
+
+
+async def _registry(registered: RegisteredChain, inputs: Dict[str, str]) -> None:
+    """起動時に構築したチェーンで描画し、レート制限用のトークン数を見積もる（現在の処理）"""
+    registered.llm
+    await registered.prompt.ainvoke(inputs)
+    langchain_routes._estimate_tokens(registered, inputs)
+
+
+async def _measure(run: Callable, registered: RegisteredChain, inputs: Dict[str, str], iterations: int) -> List[float]:
+    # 遅延importや初回のみの計算を計測から外す
+    await run(registered, inputs)
+    seconds = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await run(registered, inputs)
+        seconds.append(time.perf_counter() - started)
+    return seconds
+
+
+async def _run(iterations: int) -> None:
+    registry = langchain_routes.build_chain_registry()
+    try:
+        registered = registry.get("reply")
+        inputs = _inputs(registered)
+        _report("per-request", await _measure(_per_request, registered, inputs, iterations))
+        _report("registry", await _measure(_registry, registered, inputs, iterations))
+    finally:
+        await registry.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=500, help="経路ごとの計測回数")
+    args = parser.parse_args()
+
+    asyncio.run(_run(args.iterations))
+    print(f"iterations={args.iterations}")
+
+
+if __name__ == "__main__":
+    main()
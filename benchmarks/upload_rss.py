@@ -0,0 +1,134 @@
+"""
+Vision解析のアップロード経路ごとのピークRSS計測
+
+base64のJSON（/api/vision/analyze-profile）とmultipart（/api/vision/analyze-profile/upload）で
+同じ画像を送り、1リクエストの間にAPIサーバープロセスのRSSがどれだけ増えたかを比較する。
+OpenAIはテスト用のローカルサーバー（tests/fake_openai.py）で置き換える。
+
+    pipenv run python benchmarks/upload_rss.py --images 3 --size 2000 --repeat 3
+
+APIサーバーは別プロセスのuvicornで起動し、リクエストごとに /proc/<pid>/clear_refs で
+ピークRSS（VmHWM）をリセットして計測する（Linuxのみ）
+"""
+import argparse
+import base64
+import io
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests.fake_openai import FakeOpenAIServer  # noqa: E402
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _status_kb(pid: int, field: str) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise RuntimeError(f"{field} not found")
+
+
+def _reset_peak(pid: int) -> None:
+    with open(f"/proc/{pid}/clear_refs", "w") as f:
+        f.write("5")
+
+
+def _image(size: int) -> bytes:
+    """圧縮の効きにくいノイズ画像のJPEG（毎回異なる内容にしてキャッシュに当たらないようにする）"""
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (size, size), os.urandom(size * size * 3)).save(buffer, "JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def _send_json(http: httpx.Client, images):
+    return http.post("/api/vision/analyze-profile", json={
+        "images": ["data:image/jpeg;base64," + base64.b64encode(image).decode() for image in images],
+    })
+
+
+def _send_multipart(http: httpx.Client, images):
+    files = [("images", (f"{index}.jpg", image, "image/jpeg")) for index, image in enumerate(images)]
+    return http.post("/api/vision/analyze-profile/upload", files=files)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--images", type=int, default=3, help="1リクエストの画像枚数")
+    parser.add_argument("--size", type=int, default=2000, help="画像の一辺のピクセル数")
+    parser.add_argument("--repeat", type=int, default=3, help="経路ごとの計測回数")
+    args = parser.parse_args()
+
+    fake = FakeOpenAIServer()
+    fake.start()
+    port = _free_port()
+    tmp_dir = tempfile.mkdtemp(prefix="motemesse-bench-")
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-bench",
+        OPENAI_BASE_URL=fake.base_url,
+        DATABASE_URL=f"sqlite:///{tmp_dir}/bench.db",
+        VISION_CACHE_BACKEND="memory",
+        GENERATION_CACHE_BACKEND="memory",
+        EMBEDDING_BACKEND="none",
+        UPLOAD_MAX_BYTES=str(200 * 1024 * 1024),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=120) as http:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    http.get("/health")
+                    break
+                except httpx.TransportError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.2)
+
+            senders = {"json(base64)": _send_json, "multipart": _send_multipart}
+            # 遅延importや初回のみの確保を計測から外す
+            for send in senders.values():
+                send(http, [_image(64)]).raise_for_status()
+
+            payload_mb = None
+            results: Dict[str, List[float]] = {name: [] for name in senders}
+            for _ in range(args.repeat):
+                for name, send in senders.items():
+                    images = [_image(args.size) for _ in range(args.images)]
+                    payload_mb = sum(len(image) for image in images) / 1024 / 1024
+                    before = _status_kb(server.pid, "VmRSS")
+                    _reset_peak(server.pid)
+                    send(http, images).raise_for_status()
+                    results[name].append((_status_kb(server.pid, "VmHWM") - before) / 1024)
+
+        print(f"images={args.images} size={args.size}px payload={payload_mb:.1f}MB repeat={args.repeat}")
+        for name, peaks in results.items():
+            print(f"{name:>14}: peak RSS +{statistics.median(peaks):.1f}MB (median, max {max(peaks):.1f}MB)")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+複数画像のプロフィール解析の single / parallel モードごとの所要時間とトークン量の計測
+
+/api/vision/analyze-profile に画像1〜8枚を mode=single（全画像を1回で抽出）と
+mode=parallel（画像ごとに並列で抽出して統合）で送り、リクエスト全体の所要時間と、
+OpenAIへの呼び出し回数・入力トークン（画像＋テキストの推定）・出力トークンの上限を出力する。
+OpenAIはテスト用のローカルサーバー（tests/fake_openai.py）で置き換え、応答までの秒数は
+「--base-delay ＋ 画像1枚あたり --per-image-delay」とする（1回の呼び出しが画像枚数に比例して遅くなる想定）。
+
+    pipenv run python benchmarks/vision_modes.py --images 1 2 4 8 --repeat 3
+
+画像は毎回異なる内容にして、Vision結果のキャッシュに当たらないようにする
+"""
+import argparse
+import base64
+import io
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from service.modules.conversation_history import count_tokens  # noqa: E402
+from service.modules.image_preprocess import decode_image_payload, estimate_image_tokens  # noqa: E402
+from tests.fake_openai import FakeOpenAIServer, _text  # noqa: E402
+
+VISION_MODEL = "gpt-4o-mini"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _image_url(width: int, height: int) -> str:
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(buffer, "JPEG", quality=85)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def _image_parts(body: dict) -> List[dict]:
+    return [
+        part["image_url"]
+        for message in body["messages"] if isinstance(message["content"], list)
+        for part in message["content"] if part.get("type") == "image_url"
+    ]
+
+
+def _call_tokens(body: dict) -> Tuple[int, int]:
+    """1回の呼び出しの (入力トークンの推定, 出力トークンの上限)"""
+    tokens = sum(count_tokens(_text(message["content"]), VISION_MODEL) for message in body["messages"])
+    for image_url in _image_parts(body):
+        with Image.open(io.BytesIO(decode_image_payload(image_url["url"]))) as image:
+            tokens += estimate_image_tokens(image.width, image.height, image_url.get("detail", "high"))
+    return tokens, body.get("max_tokens") or 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--images", type=int, nargs="+", default=[1, 2, 4, 8], help="1リクエストの画像枚数")
+    parser.add_argument("--repeat", type=int, default=3, help="枚数・モードごとの計測回数")
+    parser.add_argument("--base-delay", type=float, default=1.0, help="OpenAIの1回の応答にかかる基本の秒数")
+    parser.add_argument("--per-image-delay", type=float, default=0.8, help="1回の呼び出しに含む画像1枚あたりに加算する秒数")
+    parser.add_argument("--width", type=int, default=1170, help="画像の幅（スマートフォンのスクリーンショット相当）")
+    parser.add_argument("--height", type=int, default=2532, help="画像の高さ")
+    args = parser.parse_args()
+
+    fake = FakeOpenAIServer()
+    fake.start()
+    fake.state.delay = lambda body: args.base_delay + args.per_image_delay * len(_image_parts(body))
+    port = _free_port()
+    tmp_dir = tempfile.mkdtemp(prefix="motemesse-bench-")
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-bench",
+        OPENAI_BASE_URL=fake.base_url,
+        DATABASE_URL=f"sqlite:///{tmp_dir}/bench.db",
+        VISION_CACHE_BACKEND="memory",
+        GENERATION_CACHE_BACKEND="memory",
+        EMBEDDING_BACKEND="none",
+        LOG_LEVEL="WARNING",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=300) as http:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    http.get("/health")
+                    break
+                except httpx.TransportError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.2)
+
+            # 遅延importや初回のみの確保を計測から外す
+            http.post("/api/vision/analyze-profile", json={"images": [_image_url(64, 64)]}).raise_for_status()
+
+            print(f"delay={args.base_delay}s+{args.per_image_delay}s/image size={args.width}x{args.height} "
+                  f"repeat={args.repeat}")
+            for count in args.images:
+                for mode in ("single", "parallel"):
+                    seconds: List[float] = []
+                    totals: Dict[str, int] = {"calls": 0, "input": 0, "max_output": 0}
+                    for _ in range(args.repeat):
+                        payload = {"images": [_image_url(args.width, args.height) for _ in range(count)], "mode": mode}
+                        fake.state.requests.clear()
+                        started = time.perf_counter()
+                        http.post("/api/vision/analyze-profile", json=payload).raise_for_status()
+                        seconds.append(time.perf_counter() - started)
+                        for body in fake.state.requests:
+                            input_tokens, max_output = _call_tokens(body)
+                            totals["calls"] += 1
+                            totals["input"] += input_tokens
+                            totals["max_output"] += max_output
+                    print(f"images={count} {mode:>8}: wall p50={statistics.median(seconds):.2f}s "
+                          f"max={max(seconds):.2f}s calls={totals['calls'] // args.repeat} "
+                          f"input≈{totals['input'] // args.repeat} tokens "
+                          f"max_output={totals['max_output'] // args.repeat} tokens (per request)")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
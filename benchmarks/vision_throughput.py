@@ -0,0 +1,138 @@
+"""
+Vision解析の1ワーカーあたりのスループット計測
+
+APIサーバー（uvicorn 1ワーカー）に /api/vision/analyze-profile を同時に --concurrency 件送り、
+OpenAIの応答に --delay 秒かかる状態で、1秒あたりに捌けたリクエスト数とレイテンシを出力する。
+OpenAIはテスト用のローカルサーバー（tests/fake_openai.py）で置き換え、同時に処理中だった
+呼び出し数の最大値も出力する（ワーカーが呼び出しの間ブロックしていれば1になる）。
+
+    pipenv run python benchmarks/vision_throughput.py --concurrency 40 --delay 0.5 --rounds 3
+
+画像は毎回異なる内容にして、Vision結果のキャッシュに当たらないようにする
+"""
+import argparse
+import asyncio
+import base64
+import io
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+import httpx
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests.fake_openai import FakeOpenAIServer  # noqa: E402
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _image_url(size: int) -> str:
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (size, size), os.urandom(size * size * 3)).save(buffer, "JPEG", quality=90)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def _percentile(values: List[float], ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+async def _round(http: httpx.AsyncClient, concurrency: int, size: int) -> Tuple[float, List[float]]:
+    payloads = [{"images": [_image_url(size)]} for _ in range(concurrency)]
+    latencies: List[float] = []
+
+    async def send(payload: dict) -> None:
+        started = time.perf_counter()
+        response = await http.post("/api/vision/analyze-profile", json=payload)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(payload) for payload in payloads))
+    return time.perf_counter() - started, latencies
+
+
+async def _run(base_url: str, args: argparse.Namespace) -> None:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as http:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                await http.get("/health")
+                break
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+        # 遅延importや接続の確立を計測から外す
+        await _round(http, 1, args.size)
+
+        throughputs: List[float] = []
+        latencies: List[float] = []
+        for _ in range(args.rounds):
+            elapsed, round_latencies = await _round(http, args.concurrency, args.size)
+            throughputs.append(args.concurrency / elapsed)
+            latencies.extend(seconds * 1000 for seconds in round_latencies)
+
+    print(f"concurrency={args.concurrency} delay={args.delay}s rounds={args.rounds} size={args.size}px")
+    print(f"throughput: {statistics.median(throughputs):.1f} req/s per worker (median, min {min(throughputs):.1f})")
+    print(f"   latency: p50={statistics.median(latencies):.0f}ms p95={_percentile(latencies, 0.95):.0f}ms "
+          f"max={max(latencies):.0f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=40, help="同時に送るリクエスト数")
+    parser.add_argument("--delay", type=float, default=0.5, help="OpenAIの応答にかかる秒数")
+    parser.add_argument("--rounds", type=int, default=3, help="同時リクエストを送る回数")
+    parser.add_argument("--size", type=int, default=512, help="画像の一辺のピクセル数")
+    args = parser.parse_args()
+
+    fake = FakeOpenAIServer()
+    fake.start()
+    fake.state.delay = args.delay
+    port = _free_port()
+    tmp_dir = tempfile.mkdtemp(prefix="motemesse-bench-")
+    # スケジューラーの上限で頭打ちにならないようにし、ワーカー自体の並行性を計測する
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-bench",
+        OPENAI_BASE_URL=fake.base_url,
+        DATABASE_URL=f"sqlite:///{tmp_dir}/bench.db",
+        VISION_CACHE_BACKEND="memory",
+        GENERATION_CACHE_BACKEND="memory",
+        EMBEDDING_BACKEND="none",
+        LOG_LEVEL="WARNING",
+        UPSTREAM_MAX_CONCURRENCY=str(args.concurrency),
+        UPSTREAM_MODEL_CONCURRENCY=str(args.concurrency),
+        UPSTREAM_MAX_QUEUE=str(args.concurrency),
+        UPSTREAM_TOKENS_PER_MINUTE=str(10 ** 9),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        asyncio.run(_run(f"http://127.0.0.1:{port}", args))
+        print(f"max in-flight OpenAI calls: {fake.state.max_inflight}")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
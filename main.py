@@ -1,13 +1,62 @@
+from contextlib import asynccontextmanager
+import os
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from service.app.api.general_routes import router as general_router
+from service.app.api.conversation_routes import router as conversation_router
+from service.app.api.user_routes import router as user_router
 from service.app.api.langchain_routes import router as langchain_router
+from service.app.api.langchain_routes import get_chain_registry, close_chain_registry, warm_up_token_counting
+from service.app.api.langchain_routes import generation_cache, generation_flight, summary_flight
 from service.app.api.vision_routes import router as vision_router
+from service.app.api.vision_routes import client as vision_client
+from service.app.api.vision_routes import vision_cache, vision_flight
+from service.modules import async_crud
+from service.modules.database import AsyncSessionLocal, async_engine, get_pool_stats
+from service.modules.embeddings import close_embedder
+from service.modules.logging_config import setup_logging
+from service.modules.metrics import PROMETHEUS_CONTENT_TYPE, register_collector, render_metrics, render_stats
+from service.modules.profile_render import profile_render_cache
+from service.modules.upload_limit import RequestSizeLimitMiddleware
+from service.modules.upstream import upstream
 
 load_dotenv()
+setup_logging()
 
-app = FastAPI(title='モテメッセ API', version='0.1.0')
+# /metrics にDBプール・キャッシュ・single-flight・上流スケジューラの統計も含める
+register_collector(lambda: render_stats(
+    "motemesse_db_pool", "Database connection pool stats", "engine", get_pool_stats()
+))
+register_collector(lambda: render_stats(
+    "motemesse_cache", "Result cache stats", "cache",
+    {stats["name"]: stats for stats in (generation_cache.stats(), vision_cache.stats(), profile_render_cache.stats())}
+))
+register_collector(lambda: render_stats(
+    "motemesse_singleflight", "Coalesced upstream call stats", "name",
+    {flight.name: flight.stats() for flight in (generation_flight, summary_flight, vision_flight)}
+))
+register_collector(lambda: render_stats(
+    "motemesse_upstream", "Shared OpenAI call scheduler stats", "scheduler", {"openai": upstream.stats()}
+))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # LLMチェーンは起動時に一度だけ構築して使い回す
+    await warm_up_token_counting(get_chain_registry())
+    # 会話要約のテーブルがないDB（front側のマイグレーション前）では要約なしで動かす
+    async with AsyncSessionLocal() as db:
+        await async_crud.detect_summary_table(db)
+    yield
+    await close_chain_registry()
+    await vision_client.close()
+    await close_embedder()
+    await async_engine.dispose()
+
+
+app = FastAPI(title='モテメッセ API', version='0.1.0', lifespan=lifespan)
 
 # CORS設定
 origins = [
@@ -27,10 +76,18 @@ app.add_middleware(
     allow_headers=['*'],
 )
 
+# 画像アップロード（/upload で終わるパス）のリクエストサイズ上限
+app.add_middleware(
+    RequestSizeLimitMiddleware,
+    max_bytes=int(os.getenv('UPLOAD_MAX_BYTES', str(20 * 1024 * 1024))),
+)
+
 # ルーターを追加
 app.include_router(general_router)
 app.include_router(langchain_router)
 app.include_router(vision_router)
+app.include_router(conversation_router)
+app.include_router(user_router)
 
 @app.get('/')
 def read_root():
@@ -43,6 +100,13 @@ def health_check():
     """
     return {"status": "healthy", "service": "motemesse-api"}
 
+@app.get('/metrics', response_class=PlainTextResponse)
+def metrics():
+    """
+    Prometheus形式のメトリクス（フェーズ別レイテンシ・トークン数・DBプール・キャッシュ）
+    """
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 if __name__ == '__main__':
     import uvicorn
     uvicorn.run(app, host='0.0.0.0', port=8000)
\ No newline at end of file
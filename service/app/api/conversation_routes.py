@@ -0,0 +1,124 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Tuple
+from datetime import datetime
+import base64
+import os
+
+from ...modules.database import get_async_db
+from ...modules import async_crud
+from ...modules.crud import ImportTurn
+
+router = APIRouter(prefix="/api/conversations", tags=["conversations"])
+
+# 一括取り込みで1リクエストに含められる会話の件数
+CONVERSATION_IMPORT_MAX_TURNS = int(os.getenv("CONVERSATION_IMPORT_MAX_TURNS", "2000"))
+
+
+class ConversationItem(BaseModel):
+    id: int
+    femaleMessage: str
+    maleReply: str
+    createdAt: Optional[datetime]
+
+
+class ConversationPageResponse(BaseModel):
+    status: str
+    conversations: List[ConversationItem]
+    nextCursor: Optional[str]
+
+
+class ImportTurnItem(BaseModel):
+    femaleMessage: str
+    maleReply: str
+    createdAt: Optional[datetime] = None  # 未指定の場合は取り込み時刻（リクエスト内の順序を保つ）
+
+
+class ConversationImportRequest(BaseModel):
+    userId: int
+    targetId: int
+    turns: List[ImportTurnItem] = Field(min_length=1, max_length=CONVERSATION_IMPORT_MAX_TURNS)
+    dedup: bool = True  # Trueの場合は既存の会話・リクエスト内で重複する会話を取り込まない
+
+
+class ConversationImportResponse(BaseModel):
+    status: str
+    imported: int
+    skipped: int  # 重複として取り込まなかった件数
+
+
+def encode_cursor(created_at: Optional[datetime], conversation_id: int) -> str:
+    """(created_at, id) をページングカーソル文字列に変換（created_at が NULL の場合は空文字）"""
+    raw = f"{created_at.isoformat() if created_at is not None else ''}|{conversation_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """ページングカーソル文字列を (created_at, id) に変換"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, conversation_id = raw.rsplit("|", 1)
+        return (datetime.fromisoformat(created_at) if created_at else None), int(conversation_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("", response_model=ConversationPageResponse)
+async def get_conversation_history(
+    userId: int,
+    targetId: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    会話履歴を新しい順にページングして取得
+    
+    - **limit**: 1ページの件数 (1-100)
+    - **cursor**: 前のレスポンスの nextCursor。省略時は最新から取得
+    """
+    before = decode_cursor(cursor) if cursor else None
+    conversations, has_more = await async_crud.get_conversation_page(
+        db, user_id=userId, target_id=targetId, limit=limit, before=before
+    )
+    next_cursor = None
+    if has_more and conversations:
+        last = conversations[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return ConversationPageResponse(
+        status="success",
+        conversations=[
+            ConversationItem(
+                id=c.id,
+                femaleMessage=c.female_message,
+                maleReply=c.male_reply,
+                createdAt=c.created_at
+            )
+            for c in conversations
+        ],
+        nextCursor=next_cursor
+    )
+
+
+@router.post("/import", response_model=ConversationImportResponse)
+async def import_conversations(
+    request: ConversationImportRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    会話履歴をまとめて取り込む（スクリーンショットからの移行など）
+
+    全件を1トランザクションでまとめてINSERTする
+    """
+    target = await async_crud.get_target_by_id(db, target_id=request.targetId)
+    if not target or target.user_id != request.userId:
+        raise HTTPException(status_code=404, detail="Target not found")
+    plan = await async_crud.import_conversations(
+        db,
+        user_id=request.userId,
+        target_id=request.targetId,
+        turns=[ImportTurn(turn.femaleMessage, turn.maleReply, turn.createdAt) for turn in request.turns],
+        dedup=request.dedup,
+    )
+    return ConversationImportResponse(status="success", imported=len(plan.rows), skipped=plan.skipped)
@@ -1,5 +1,7 @@
 from fastapi import APIRouter
 
+from ...modules.database import get_pool_stats
+
 router = APIRouter(prefix="/api", tags=["general"])
 
 
@@ -16,4 +18,12 @@ def health_check():
     """
     ヘルスチェックエンドポイント
     """
-    return {"status": "healthy", "service": "motemesse-api"}
\ No newline at end of file
+    return {"status": "healthy", "service": "motemesse-api"}
+
+
+@router.get("/metrics/db-pool")
+def db_pool_metrics():
+    """
+    DBコネクションプールの利用状況（使用中・オーバーフロー・取得待ち時間）
+    """
+    return get_pool_stats()
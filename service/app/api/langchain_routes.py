@@ -1,61 +1,51 @@
 from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
-from typing import List, Optional
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import AsyncIterator, Dict, List, Literal, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import json
+import logging
 import os
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
+from langchain_core.messages import AIMessage, AIMessageChunk
 from pydantic import Field
 
-from ...modules.database import get_db
-from ...modules import crud
+from ...modules.database import AsyncSessionLocal, get_async_db
+from ...modules import async_crud
+from ...modules.crud import ReplyContext, summary_table
+from ...modules.cache import create_cache_from_env, make_cache_key
+from ...modules.chain_registry import ChainRegistry, RegisteredChain
+from ...modules.conversation_history import (
+    build_history_window,
+    chunk_turns,
+    count_tokens,
+    format_conversation_history,
+    format_turns,
+    warm_up_encodings,
+)
+from ...modules.embeddings import embedder, embedding_text
+from ...modules.json_stream import IncrementalJsonArrayParser
+from ...modules.metrics import (
+    FirstTokenTimer,
+    RequestSpans,
+    activate_spans,
+    error_status,
+    llm_usage_metrics,
+    output_parse_total,
+    phase,
+    request_spans,
+)
+from ...modules.profile_render import RenderedProfile, profile_render_cache, render_target_profile, render_user_profile
+from ...modules.output_repair import PARSE_STRICT, OutputRepairError, parse_with_repair
+from ...modules.singleflight import SingleFlight
+from ...modules.upstream import UpstreamUnavailableError, upstream, upstream_http_exception
 
 load_dotenv()
 
-
-def format_user_profile(user) -> str:
-    """ユーザープロフィール情報を整形"""
-    return f"""- 名前: {user.name or "ユーザー"}
-- 年齢: {f"{user.age}歳" if user.age else "不明"}
-- 職業: {user.job or "不明"}
-- 趣味: {user.hobby or "不明"}
-- 居住地: {user.residence or "不明"}
-- 勤務地: {user.work_place or "不明"}
-- 血液型: {user.blood_type or "不明"}
-- 学歴: {user.education or "不明"}
-- 仕事の種類: {user.work_type or "不明"}
-- 休日: {user.holiday or "不明"}
-- 結婚歴: {user.marriage_history or "不明"}
-- 子供の有無: {user.has_children or "不明"}
-- 煙草: {user.smoking or "不明"}
-- お酒: {user.drinking or "不明"}
-- 一緒に住んでいる人: {user.living_with or "不明"}
-- 結婚に対する意思: {user.marriage_intention or "不明"}
-- 自己紹介: {getattr(user, 'self_introduction', None) or "情報なし"}"""
-
-
-def format_target_profile(target) -> str:
-    """ターゲットプロフィール情報を整形"""
-    return f"""- 名前: {target.name}
-- 年齢: {f"{target.age}歳" if target.age else "不明"}
-- 職業: {target.job or "不明"}
-- 趣味: {target.hobby or "不明"}
-- 居住地: {target.residence or "不明"}
-- 勤務地: {target.work_place or "不明"}
-- 血液型: {target.blood_type or "不明"}
-- 学歴: {target.education or "不明"}
-- 仕事の種類: {target.work_type or "不明"}
-- 休日: {target.holiday or "不明"}
-- 結婚歴: {target.marriage_history or "不明"}
-- 子供の有無: {target.has_children or "不明"}
-- 煙草: {target.smoking or "不明"}
-- お酒: {target.drinking or "不明"}
-- 一緒に住んでいる人: {target.living_with or "不明"}
-- 結婚に対する意思: {target.marriage_intention or "不明"}
-- 自己紹介: {getattr(target, 'self_introduction', None) or "情報なし"}"""
+logger = logging.getLogger(__name__)
 
 
 def get_tone_text(tone_value) -> str:
@@ -66,99 +56,13 @@ def get_tone_text(tone_value) -> str:
     }
     return tone_mapping.get(tone_value, "敬語")
 
-router = APIRouter(prefix="/api/langchain", tags=["langchain"])
-
-
-class ReplyRequest(BaseModel):
-    userId: int
-    selectedTargetId: int
-    message: str
-    intent: Optional[str] = None  # 'continue' or 'appointment'
-
-
-class InitialGreetingRequest(BaseModel):
-    userId: int
-    selectedTargetId: int
-
-
-class Reply(BaseModel):
-    id: int
-    text: str
-
-
-class ReplyResponse(BaseModel):
-    replies: List[Reply] = Field(description="3つの返信候補")
-
-
-class GenerateReplyResponse(BaseModel):
-    status: str
-    replies: List[Reply]
-    context: dict
-
+# プロンプトはプロバイダ側のプロンプトキャッシュが効くよう、
+# 全リクエスト共通の静的な戦略ブロック → ユーザー×相手ごとのプロフィール → 会話履歴・最新メッセージ
+# の順に並べる（静的ブロックにはリクエストごとに変わる値を含めない）
 
-class GenerateInitialGreetingResponse(BaseModel):
-    status: str
-    replies: List[Reply]
-    context: dict
-
-
-@router.post("/generate-reply", response_model=GenerateReplyResponse)
-async def generate_reply(request: ReplyRequest, db: Session = Depends(get_db)):
-    """
-    女性からのメッセージに対する返信候補を生成
-    """
-    try:
-        # リクエストパラメータを使用
-        user_id = request.userId
-        target_id = request.selectedTargetId
-        message = request.message
-        print(f"リクエストパラメータ: userId={user_id}, selectedTargetId={target_id}, message={message}")
-        # データベースからユーザー情報を取得
-        user = crud.get_user_by_id(db, user_id=user_id)
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        # データベースからターゲット情報を取得
-        target = crud.get_target_by_id(db, target_id=target_id)
-        if not target:
-            raise HTTPException(status_code=404, detail="Target not found")
-        # データベースから会話履歴を取得（ない場合は空リスト）
-        conversation = crud.get_conversation(db, user_id=user_id, target_id=target_id)
-        if not conversation:
-            conversation = []  # 会話履歴がない場合は空リストを使用
-        
-        # maleの返信件数を取得
-        message_count = len(conversation)
-        
-        print(user.tone, 'user.tone')
-        # user.toneを文字列に変換
-        user_tone_text = get_tone_text(user.tone)
-        print(user_tone_text, 'user_tone_text')
-        # 2. LangChainでプロンプトを構築
-        output_parser = PydanticOutputParser(pydantic_object=ReplyResponse)
-        # メッセージの文字数を計算
-        message_length = len(message)
-        # 会話履歴の整形（直近10件）
-        if conversation:
-            history_items = conversation[-20:] if len(conversation) > 20 else conversation
-            conversation_history_text = "\n".join([
-                f"彼女: {c.female_message}\nあなた: {c.male_reply}" for c in history_items
-            ])
-        else:
-            conversation_history_text = "（これが最初のメッセージです）"
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """あなたは男性ユーザーがマッチングアプリでデートアポイントメントを獲得するための返信候補を生成するAIです。実戦で検証された恋愛戦略に基づき、相手のタイプと会話段階に応じて最適なアプローチを選択します。
-ユーザー情報:
-{user_profile}
-相手の女性情報:
-{target_profile}
-
-## 入力情報
-- ユーザー情報: {user_profile}
-- 相手の女性情報: {target_profile}
-- 相手の最新メッセージ: {message}
-- 返信通数: {message_count}通目
-- 会話履歴: {conversation_history}
-- 希望する口調: {user_tone}
+# 返信候補生成用のシステムプロンプト（全リクエスト共通）
+REPLY_SYSTEM_PROMPT = """あなたは男性ユーザーがマッチングアプリでデートアポイントメントを獲得するための返信候補を生成するAIです。実戦で検証された恋愛戦略に基づき、相手のタイプと会話段階に応じて最適なアプローチを選択します。
+ユーザー情報・相手の女性情報・希望する口調・返信通数・会話履歴・相手の最新メッセージは、この後のメッセージで入力情報として与えられます。
 
 ## 統合戦略: 適応型4段階アプローチ
 ### **Stage 1: 初回接触（1-2通目）**
@@ -228,84 +132,25 @@ async def generate_reply(request: ReplyRequest, db: Session = Depends(get_db)):
 - 初回デートは公共の場所、60-90分以内
 - 相手の境界線と意向を最優先
 - 差別的表現や過度な身体的言及の禁止
-{format_instructions}"""),
-            ("system", "これまでの会話履歴:\n{conversation_history}"),
-            ("human", "女性からのメッセージ: {message}")
-        ])
-        # 3. OpenAI GPT-4oで返信生成
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="OpenAI API key not configured")
-        llm = ChatOpenAI(
-            model="gpt-4.1-mini",
-            temperature=1.0,
-            api_key=api_key
-        )
-        # 4. チェーンを実行
-        chain = prompt | llm | output_parser
-        result = chain.invoke({
-            "user_profile": format_user_profile(user),
-            "target_profile": format_target_profile(target),
-            "user_tone": user_tone_text,
-            "message": message,
-            "message_length": message_length,
-            "message_count": message_count,
-            "conversation_history": conversation_history_text,
-            "format_instructions": output_parser.get_format_instructions()
-        })
-        print(user.smoking, 'user')
-        # 5. レスポンスを返す
-        return GenerateReplyResponse(
-            status="success",
-            replies=result.replies,
-            context={
-                "userName": user.name or "ユーザー",
-                "targetName": target.name,
-                "userAge": user.age,
-                "targetAge": target.age
-            }
-        )
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to generate replies: {str(e)}")
+{format_instructions}"""
 
+# ユーザー×相手ごとの入力情報（返信生成・初回挨拶生成で共通）
+PROFILE_CONTEXT_PROMPT = """## 入力情報
+### ユーザー情報
+{user_profile}
+### 相手の女性情報
+{target_profile}
+### 希望する口調
+{user_tone}"""
 
-@router.post("/generate-initial-greeting", response_model=GenerateInitialGreetingResponse)
-async def generate_initial_greeting(request: InitialGreetingRequest, db: Session = Depends(get_db)):
-    """
-    初回挨拶メッセージを生成
-    """
-    try:
-        # リクエストパラメータを使用
-        user_id = request.userId
-        target_id = request.selectedTargetId
-        
-        print(f"リクエストパラメータ: userId={user_id}, selectedTargetId={target_id}")
-        
-        # データベースからユーザー情報を取得
-        user = crud.get_user_by_id(db, user_id=user_id)
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # データベースからターゲット情報を取得
-        target = crud.get_target_by_id(db, target_id=target_id)
-        if not target:
-            raise HTTPException(status_code=404, detail="Target not found")
-        
-        # user.toneを文字列に変換
-        user_tone_text = get_tone_text(user.tone)
-        
-        # 2. LangChainでプロンプトを構築（初回挨拶専用）
-        output_parser = PydanticOutputParser(pydantic_object=ReplyResponse)
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """あなたは初回メッセージで魅力的な第一印象を与え、相手が返信したくなる挨拶を作成する専門AIです。やました式（負担軽減）とヘルガ式（具体性重視）を統合し、相手のタイプに応じて最適なアプローチを選択します。
-            
-## 入力情報
-- ユーザー情報: {user_profile}
-- 相手の女性情報: {target_profile}
-- 希望する口調: {user_tone}
+# 会話ごとに変わる入力情報（返信生成）
+CONVERSATION_CONTEXT_PROMPT = """- 返信通数: {message_count}通目
+これまでの会話履歴:
+{conversation_history}"""
+
+# 初回挨拶生成用のシステムプロンプト（全リクエスト共通）
+INITIAL_GREETING_SYSTEM_PROMPT = """あなたは初回メッセージで魅力的な第一印象を与え、相手が返信したくなる挨拶を作成する専門AIです。やました式（負担軽減）とヘルガ式（具体性重視）を統合し、相手のタイプに応じて最適なアプローチを選択します。
+ユーザー情報・相手の女性情報・希望する口調は、この後のメッセージで入力情報として与えられます。
 
 ## 戦略判定基準
 **慎重派アプローチ（やました式）を選択する条件:**
@@ -318,7 +163,7 @@ async def generate_initial_greeting(request: InitialGreetingRequest, db: Session
 - 明確で話しやすい話題が存在
 ## 生成手順
 **Step 1: タイプ判定**
-{target_profile}を分析し、上記基準で慎重派・積極派を判定
+相手の女性情報を分析し、上記基準で慎重派・積極派を判定
 **Step 2: メッセージ構成**
 ### **慎重派パターン（質問なし・負担軽減重視）:**
 1. **冒頭:** 「マッチングありがとうございます！[ユーザー名]と申します。」
@@ -357,54 +202,868 @@ async def generate_initial_greeting(request: InitialGreetingRequest, db: Session
 - 文字数が50-120文字に収まっているか
 - 質問数制限を守っているか（慎重派0個、積極派1個）
 - 記号・絵文字が2個以下か
-- {user_tone}に口調が合っているか
+- 希望する口調に合っているか
 - 押し付け感がないか
 ## 出力要件
 3種類のメッセージ（カジュアル・丁寧・ユーモア）を生成し、それぞれ上記制約をすべて満たすこと。
 
-{format_instructions}"""),
+{format_instructions}"""
+
+
+router = APIRouter(prefix="/api/langchain", tags=["langchain"])
+
+
+# 会話要約用のシステムプロンプト（全リクエスト共通）
+CONVERSATION_SUMMARY_SYSTEM_PROMPT = """あなたはマッチングアプリでの男性（あなた）と女性（彼女）の会話履歴を要約するAIです。
+これまでの要約に新しい会話の内容を取り込み、更新した要約を1つ作成してください。
+
+## 要約のルール
+- 相手の女性について分かったこと（趣味・仕事・予定・好み・価値観）を優先して残す
+- 約束・次に話す予定の話題・未回答の質問を残す
+- 会話の雰囲気や距離感（口調、盛り上がった話題）を簡潔に残す
+- 挨拶や相づちなど情報のないやり取りは省く
+- 箇条書きで400文字以内
+{format_instructions}"""
+
+# 修復・部分回収できなかった返信候補の出力を、形式の修正だけ再依頼するためのシステムプロンプト
+# （プロフィールや会話履歴を含めず、壊れた出力のみを渡すため再生成より安価）
+REPLY_REPAIR_SYSTEM_PROMPT = """あなたはJSONの形式を修正するAIです。
+入力は返信候補を出力しようとして形式が崩れたテキストです。
+内容（返信候補の文面）は変えずに、次の形式の正しいJSONだけを出力してください。
+{format_instructions}"""
+
+
+class ReplyRequest(BaseModel):
+    userId: int
+    selectedTargetId: int
+    message: str
+    intent: Optional[str] = None  # 'continue' or 'appointment'
+    regenerate: bool = False  # Trueの場合はキャッシュを使わずに再生成
+
+
+class InitialGreetingRequest(BaseModel):
+    userId: int
+    selectedTargetId: int
+    regenerate: bool = False  # Trueの場合はキャッシュを使わずに再生成
+
+
+class Reply(BaseModel):
+    id: int
+    text: str
+
+
+class ReplyResponse(BaseModel):
+    replies: List[Reply] = Field(description="3つの返信候補")
+
+
+class ConversationSummaryResponse(BaseModel):
+    summary: str = Field(description="更新後の会話要約")
+
+
+class GenerateReplyResponse(BaseModel):
+    status: str
+    replies: List[Reply]
+    context: dict
+
+
+class GenerateInitialGreetingResponse(BaseModel):
+    status: str
+    replies: List[Reply]
+    context: dict
+
+
+# 一括生成で1リクエストに含められる件数と、同時に実行するLLM呼び出しの上限
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+
+class BatchGenerateItem(BaseModel):
+    selectedTargetId: int
+    message: Optional[str] = None  # 指定時は返信候補、未指定時は初回挨拶を生成
+
+
+class BatchGenerateRequest(BaseModel):
+    userId: int
+    items: List[BatchGenerateItem] = Field(min_length=1, max_length=BATCH_MAX_ITEMS)
+    regenerate: bool = False  # Trueの場合はキャッシュを使わずに再生成
+
+
+BatchMessageType = Literal["reply", "initial_greeting"]
+
+
+class BatchItemResult(BaseModel):
+    index: int  # リクエストのitems内の位置
+    selectedTargetId: int
+    messageType: BatchMessageType
+    status: str  # success / error
+    replies: Optional[List[Reply]] = None
+    context: Optional[dict] = None
+    statusCode: Optional[int] = None  # エラー時のステータスコード
+    detail: Optional[str] = None  # エラー内容
+    retryAfter: Optional[float] = None  # 上流の混雑・レート制限時の再試行までの目安（秒）
+
+
+class BatchGenerateResponse(BaseModel):
+    status: str
+    results: List[BatchItemResult]  # リクエストのitemsと同じ順
+    succeeded: int
+    failed: int
+
+
+LLM_MODEL = "gpt-4.1-mini"
+LLM_TEMPERATURE = 1.0
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+# レート制限用の出力トークン数の見積もり（返信候補3件のJSON程度）
+LLM_OUTPUT_TOKEN_ESTIMATE = 600
+# 要約に未取り込みの会話履歴を直近何件まで読み込むか（逐語で含める量はトークン予算で決める）
+REPLY_HISTORY_LIMIT = int(os.getenv("REPLY_HISTORY_LIMIT", "50"))
+# 直近N件より前の未要約の会話を、1リクエストで何件まで要約に取り込むか（残りは次回以降に取り込む）
+REPLY_SUMMARY_CATCHUP_LIMIT = int(os.getenv("REPLY_SUMMARY_CATCHUP_LIMIT", "200"))
+# 直近の会話より前から、最新メッセージに関連する会話を何件含めるか（0で無効。EMBEDDING_BACKENDの設定も必要）
+REPLY_RETRIEVAL_TOP_K = int(os.getenv("REPLY_RETRIEVAL_TOP_K", "0"))
+# 関連会話の検索時に1リクエストで補完する、埋め込み未計算の会話の件数
+EMBEDDING_BACKFILL_LIMIT = int(os.getenv("EMBEDDING_BACKFILL_LIMIT", "32"))
+
+_chain_registry: Optional[ChainRegistry] = None
+
+# 同一入力（プロフィール・口調・メッセージ・会話履歴）に対する生成結果のキャッシュ
+generation_cache = create_cache_from_env(
+    "generation_cache", "GENERATION_CACHE", default_ttl_seconds=600, default_max_entries=1000
+)
+
+# 二重送信された同一リクエストのLLM呼び出しを1回にまとめる
+generation_flight = SingleFlight("generation")
+# 同じ会話範囲の要約更新を1回にまとめる
+summary_flight = SingleFlight("conversation_summary")
+
+
+def build_chain_registry() -> ChainRegistry:
+    """返信生成・初回挨拶生成のチェーンを組み立てたレジストリを構築"""
+    registry = ChainRegistry(api_key=os.getenv("OPENAI_API_KEY"), timeout=LLM_TIMEOUT_SECONDS)
+    registry.register(
+        "reply",
+        [
+            ("system", REPLY_SYSTEM_PROMPT),
+            ("system", PROFILE_CONTEXT_PROMPT),
+            ("system", CONVERSATION_CONTEXT_PROMPT),
+            ("human", "女性からのメッセージ: {message}")
+        ],
+        parser=PydanticOutputParser(pydantic_object=ReplyResponse),
+        model=LLM_MODEL,
+        temperature=LLM_TEMPERATURE,
+    )
+    registry.register(
+        "initial_greeting",
+        [
+            ("system", INITIAL_GREETING_SYSTEM_PROMPT),
+            ("system", PROFILE_CONTEXT_PROMPT),
             ("human", "初回挨拶メッセージを生成してください。")
-        ])
-        
-        # 3. OpenAI GPT-4.1-miniで初回挨拶生成
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="OpenAI API key not configured")
-        
-        llm = ChatOpenAI(
-            model="gpt-4.1-mini",
-            temperature=1.0,
-            api_key=api_key
+        ],
+        parser=PydanticOutputParser(pydantic_object=ReplyResponse),
+        model=LLM_MODEL,
+        temperature=LLM_TEMPERATURE,
+    )
+    registry.register(
+        "reply_repair",
+        [
+            ("system", REPLY_REPAIR_SYSTEM_PROMPT),
+            ("human", "{output}")
+        ],
+        parser=PydanticOutputParser(pydantic_object=ReplyResponse),
+        model=LLM_MODEL,
+        temperature=0,
+    )
+    registry.register(
+        "conversation_summary",
+        [
+            ("system", CONVERSATION_SUMMARY_SYSTEM_PROMPT),
+            ("human", "これまでの要約:\n{summary}\n\n新しい会話:\n{conversation_history}")
+        ],
+        parser=PydanticOutputParser(pydantic_object=ConversationSummaryResponse),
+        model=LLM_MODEL,
+        temperature=0,
+    )
+    registry.warm_up()
+    return registry
+
+
+def get_chain_registry() -> ChainRegistry:
+    """アプリ起動時に構築したレジストリを返す（未構築の場合はここで構築）"""
+    global _chain_registry
+    if _chain_registry is None:
+        _chain_registry = build_chain_registry()
+    return _chain_registry
+
+
+async def warm_up_token_counting(registry: ChainRegistry) -> None:
+    """
+    トークン数の見積もりに使うトークナイザーを起動時に別スレッドで読み込む
+
+    語彙ファイルの読み込み（初回はダウンロード）で最初のリクエストのイベントループを止めない
+    """
+    def warm_up():
+        registry.warm_up_tokens()
+        if embedder is not None:
+            warm_up_encodings([embedder.model])
+
+    await asyncio.to_thread(warm_up)
+
+
+async def close_chain_registry() -> None:
+    global _chain_registry
+    if _chain_registry is not None:
+        await _chain_registry.aclose()
+        _chain_registry = None
+
+
+async def _load_reply_inputs(request: ReplyRequest, db: AsyncSession):
+    """
+    返信生成に必要なユーザー・ターゲット情報をDBから取得し、プロンプト入力を組み立てる
+    """
+    # リクエストパラメータを使用
+    user_id = request.userId
+    target_id = request.selectedTargetId
+    message = request.message
+    logger.debug("generate_reply userId=%s selectedTargetId=%s messageLength=%d", user_id, target_id, len(message))
+    # ユーザー・ターゲット・直近の会話履歴を1往復で取得
+    with phase("db_load"):
+        reply_context = await async_crud.get_reply_context(
+            db, user_id=user_id, target_id=target_id, limit=REPLY_HISTORY_LIMIT
         )
-        
-        # 4. チェーンを実行
-        chain = prompt | llm | output_parser
-        
-        result = chain.invoke({
-            "user_profile": format_user_profile(user),
-            "target_profile": format_target_profile(target),
+    return await _build_reply_inputs(db, reply_context, message)
+
+
+async def _build_reply_inputs(db: AsyncSession, reply_context: ReplyContext, message: str):
+    """
+    取得済みのユーザー・ターゲット・会話履歴からプロンプト入力を組み立てる
+
+    逐語の会話履歴がトークン予算を超えた場合や、直近N件より前に未要約の会話がある場合は、
+    古い会話を要約に取り込んでDBに保存する
+    """
+    user = reply_context.user
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    target = reply_context.target
+    if not target:
+        raise HTTPException(status_code=404, detail="Target not found")
+    # 要約に未取り込みの直近の会話履歴（古い順、ない場合は空リスト）
+    conversation = reply_context.conversations
+    summary_text = reply_context.summary.summary if reply_context.summary else None
+    
+    # maleの返信件数を取得
+    message_count = reply_context.conversation_count
+    
+    # user.toneを文字列に変換
+    user_tone_text = get_tone_text(user.tone)
+    logger.debug("tone=%s toneText=%s", user.tone, user_tone_text)
+    # 会話履歴の整形（トークン予算内の直近の会話は逐語、それより前は要約）
+    with phase("prompt_build"):
+        window = build_history_window(conversation, LLM_MODEL)
+    # 要約のテーブルがないDBでは、トークン予算を超えた古い会話はプロンプトに含めない
+    to_summarize = window.to_summarize if summary_table.enabled else []
+    oldest_created_at = conversation[0].created_at if conversation else None
+    if summary_table.enabled and len(conversation) >= REPLY_HISTORY_LIMIT and oldest_created_at is not None:
+        # 直近N件の読み込みから漏れた未要約の会話も、古い順に要約へ取り込む
+        with phase("db_load"):
+            older = await async_crud.get_older_unsummarized_conversations(
+                db, user.id, target.id, (oldest_created_at, conversation[0].id),
+                REPLY_SUMMARY_CATCHUP_LIMIT + 1,
+            )
+        if len(older) > REPLY_SUMMARY_CATCHUP_LIMIT:
+            # 取り込み位置は古い順にしか進められないため、残りがある間は直近の会話を要約しない
+            logger.info("未要約の古い会話が多いため %d 件ずつ要約に取り込みます", REPLY_SUMMARY_CATCHUP_LIMIT)
+            to_summarize = older[:REPLY_SUMMARY_CATCHUP_LIMIT]
+        else:
+            to_summarize = older + to_summarize
+    if to_summarize:
+        try:
+            with phase("history_summary"):
+                for chunk in chunk_turns(to_summarize, LLM_MODEL):
+                    summary_text = await _update_conversation_summary(
+                        db, user.id, target.id, summary_text, chunk
+                    )
+        except Exception as e:
+            # 要約に失敗した場合は今回のみ未取り込みの会話をすべて逐語で含める
+            logger.warning("会話要約の更新に失敗: %s", str(e))
+            window.recent = list(conversation)
+    related = []
+    try:
+        with phase("retrieval"):
+            related = await _retrieve_related_turns(
+                db, user.id, target.id, message, window.recent, message_count
+            )
+    except Exception as e:
+        # 関連会話は補助的な情報のため、取得に失敗しても生成は続ける
+        logger.warning("関連する過去の会話の検索に失敗: %s", str(e))
+    with phase("prompt_build"):
+        conversation_history_text = format_conversation_history(window.recent, summary_text, related)
+        inputs = {
+            "user_profile": render_user_profile(user, LLM_MODEL),
+            "target_profile": render_target_profile(target, LLM_MODEL),
             "user_tone": user_tone_text,
-            "format_instructions": output_parser.get_format_instructions()
-        })
-        
-        # 5. レスポンスを返す
-        return GenerateInitialGreetingResponse(
-            status="success",
-            replies=result.replies,
-            context={
-                "userName": user.name or "ユーザー",
-                "targetName": target.name,
-                "userAge": user.age,
-                "targetAge": target.age,
-                "messageType": "initial_greeting",
-                "toneStyle": user_tone_text
-            }
+            "message": message,
+            "message_count": message_count,
+            "conversation_history": conversation_history_text
+        }
+    context = {
+        "userName": user.name or "ユーザー",
+        "targetName": target.name,
+        "userAge": user.age,
+        "targetAge": target.age
+    }
+    return inputs, context
+
+
+async def _retrieve_related_turns(
+    db: AsyncSession,
+    user_id: int,
+    target_id: int,
+    message: str,
+    recent: list,
+    conversation_count: int,
+) -> list:
+    """
+    逐語で含める直近の会話より前から、最新メッセージに埋め込みが近い会話を取得する（古い順）
+
+    埋め込み未計算の会話は、最新メッセージと同じ1回の埋め込み計算で少しずつ補完する
+    """
+    if embedder is None or REPLY_RETRIEVAL_TOP_K <= 0 or conversation_count <= len(recent):
+        return []
+    missing = await async_crud.get_conversations_missing_embedding(
+        db, user_id, target_id, EMBEDDING_BACKFILL_LIMIT
+    )
+    vectors = await embedder.embed(
+        [message] + [embedding_text(c.female_message, c.male_reply) for c in missing]
+    )
+    await async_crud.update_conversation_embeddings(
+        db, {c.id: vector for c, vector in zip(missing, vectors[1:])}
+    )
+    before = (recent[0].created_at, recent[0].id) if recent else None
+    related = await async_crud.get_related_conversations(
+        db, user_id, target_id, vectors[0], REPLY_RETRIEVAL_TOP_K, before
+    )
+    return sorted(related, key=lambda c: (c.created_at, c.id))
+
+
+def _build_greeting_inputs(user, target):
+    """初回挨拶生成のプロンプト入力とレスポンス用のコンテキストを組み立てる"""
+    # user.toneを文字列に変換
+    user_tone_text = get_tone_text(user.tone)
+    with phase("prompt_build"):
+        inputs = {
+            "user_profile": render_user_profile(user, LLM_MODEL),
+            "target_profile": render_target_profile(target, LLM_MODEL),
+            "user_tone": user_tone_text
+        }
+    context = {
+        "userName": user.name or "ユーザー",
+        "targetName": target.name,
+        "userAge": user.age,
+        "targetAge": target.age,
+        "messageType": "initial_greeting",
+        "toneStyle": user_tone_text
+    }
+    return inputs, context
+
+
+async def _update_conversation_summary(
+    db: AsyncSession,
+    user_id: int,
+    target_id: int,
+    summary_text: Optional[str],
+    conversations: list,
+) -> str:
+    """
+    既存の要約に古い会話を取り込んだ要約を生成して保存し、更新後の要約を返す
+
+    要約は逐語の履歴がトークン予算を超えたときか、直近N件より前に未要約の会話があるときだけ更新される
+    """
+    registered = get_chain_registry().get("conversation_summary")
+    last_conversation = conversations[-1]
+
+    async def run_chain() -> str:
+        inputs = {
+            "summary": summary_text or "（なし）",
+            "conversation_history": format_turns(conversations),
+        }
+        prompt_value = await registered.prompt.ainvoke(inputs)
+        message = await upstream.run(
+            registered.model,
+            _estimate_tokens(registered, inputs),
+            lambda: registered.llm.ainvoke(prompt_value)
         )
-        
-    except HTTPException:
+        llm_usage_metrics.record(
+            registered.name, registered.model, message.usage_metadata if isinstance(message, AIMessage) else None
+        )
+        result = registered.parser.parse(message.text())
+        await async_crud.upsert_conversation_summary(
+            db, user_id, target_id, result.summary, last_conversation
+        )
+        return result.summary
+
+    flight_key = f"{user_id}:{target_id}:{last_conversation.id}"
+    return await summary_flight.do(flight_key, run_chain)
+
+
+def _generation_cache_key(registered: RegisteredChain, inputs: dict) -> str:
+    """描画済みのプロンプト入力とモデル設定から生成キャッシュのキーを作成"""
+    return make_cache_key(registered.name, registered.model, registered.temperature, inputs)
+
+
+async def _get_cached_replies(cache_key: str, regenerate: bool) -> Optional[List[Reply]]:
+    """キャッシュ済みの返信候補を取得（再生成指定時はキャッシュを参照しない）"""
+    if regenerate:
+        generation_cache.record_bypass()
+        return None
+    cached = await generation_cache.aget(cache_key)
+    if cached is None:
+        return None
+    return [Reply.model_validate(item) for item in cached]
+
+
+async def _store_replies(cache_key: str, replies: List[Reply]) -> None:
+    await generation_cache.aset(cache_key, [reply.model_dump() for reply in replies])
+
+
+def _estimate_tokens(registered: RegisteredChain, inputs: dict) -> int:
+    """
+    レート制限用に、プロンプトと出力の合計トークン数を見積もる
+
+    固定部分はチェーンごとに計算済みの値を、描画済みプロフィールは保持しているトークン数を使う
+    """
+    tokens = registered.static_tokens + LLM_OUTPUT_TOKEN_ESTIMATE
+    for value in inputs.values():
+        if isinstance(value, RenderedProfile) and value.model == registered.model:
+            tokens += value.tokens
+        else:
+            tokens += count_tokens(str(value), registered.model)
+    return tokens
+
+
+async def _stream_llm(registered: RegisteredChain, inputs: dict) -> AsyncIterator:
+    """
+    プロンプトを描画し、共有スケジューラの実行枠内でLLMをストリーミングで呼び出す
+
+    描画時間・TTFT（実行待ちを含む）・LLM全体の時間を実行中のリクエストに、トークン使用量をモデルごとに記録する
+    """
+    with phase("prompt_build"):
+        prompt_value = await registered.prompt.ainvoke(inputs)
+        estimated_tokens = _estimate_tokens(registered, inputs)
+    timer = FirstTokenTimer()
+    usage_metadata = None
+    chunks = upstream.stream(registered.model, estimated_tokens, lambda: registered.llm.astream(prompt_value))
+    async for chunk in chunks:
+        timer.chunk()
+        if isinstance(chunk, AIMessageChunk) and chunk.usage_metadata:
+            usage_metadata = chunk.usage_metadata
+        yield chunk
+    timer.done()
+    llm_usage_metrics.record(registered.name, registered.model, usage_metadata)
+
+
+async def _invoke_llm(registered: RegisteredChain, inputs: dict) -> str:
+    """_stream_llm の出力を連結した応答テキストを返す"""
+    chunks = [chunk.content async for chunk in _stream_llm(registered, inputs)]
+    return "".join(chunks)
+
+
+async def _parse_replies(registered: RegisteredChain, content: str) -> Tuple[List[Reply], str]:
+    """
+    LLM出力から (返信候補, 取り出した経路) を返す
+
+    崩れたJSONは修復・部分回収し、それでも取り出せない場合だけ形式の修正を再依頼する。
+    どの経路で取り出したかをチェーンごとに記録する
+    """
+    with phase("parse"):
+        try:
+            result, path = parse_with_repair(content, ReplyResponse, Reply, "replies")
+        except OutputRepairError:
+            result = None
+    if result is None:
+        logger.warning("返信候補の出力を修復できないため形式の修正を再依頼: chain=%s", registered.name)
+        fixed = await _invoke_llm(get_chain_registry().get("reply_repair"), {"output": content})
+        with phase("parse"):
+            try:
+                result, _ = parse_with_repair(fixed, ReplyResponse, Reply, "replies")
+            except OutputRepairError:
+                output_parse_total.inc(chain=registered.name, path="failed")
+                raise
+        path = "reask"
+    output_parse_total.inc(chain=registered.name, path=path)
+    return result.replies, path
+
+
+def _is_strict_output(content: str) -> bool:
+    """LLM出力の全文が修復なしでパースできるか（途中で切れた出力・部分回収した候補はキャッシュしない）"""
+    try:
+        _, path = parse_with_repair(content, ReplyResponse, Reply, "replies")
+    except OutputRepairError:
+        return False
+    return path == PARSE_STRICT
+
+
+async def _generate_replies(registered: RegisteredChain, inputs: dict, cache_key: str, regenerate: bool) -> List[Reply]:
+    """
+    キャッシュ済みの結果があれば返し、なければチェーンを実行して結果をキャッシュする
+    
+    同一キーの同時リクエストは1回のLLM呼び出しを共有する
+    """
+    replies = await _get_cached_replies(cache_key, regenerate)
+    if replies is not None:
+        return replies
+
+    async def run_chain() -> List[Reply]:
+        # イベントループをブロックしないよう非同期で呼び出す
+        content = await _invoke_llm(registered, inputs)
+        replies, path = await _parse_replies(registered, content)
+        # 修復・部分回収した結果はキャッシュせず、次のリクエストでは生成し直す
+        if path == PARSE_STRICT:
+            await _store_replies(cache_key, replies)
+        return replies
+
+    flight_key = f"{cache_key}:regenerate" if regenerate else cache_key
+    return await generation_flight.do(flight_key, run_chain)
+
+
+def _sse_event(event: str, data: str) -> str:
+    """Server-Sent Events形式の1イベントを組み立てる"""
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+@router.post("/generate-reply", response_model=GenerateReplyResponse)
+async def generate_reply(request: ReplyRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    女性からのメッセージに対する返信候補を生成
+    """
+    with request_spans("generate_reply"):
+        try:
+            # 1. DBから情報を取得してプロンプト入力を組み立てる
+            inputs, context = await _load_reply_inputs(request, db)
+            # 2. 起動時に構築済みのチェーンを取得
+            registry = get_chain_registry()
+            if not registry.api_key:
+                raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+            reply_chain = registry.get("reply")
+            # 3. 同一入力の生成結果があれば再利用し、なければチェーンを実行
+            cache_key = _generation_cache_key(reply_chain, inputs)
+            replies = await _generate_replies(reply_chain, inputs, cache_key, request.regenerate)
+            # 4. レスポンスを返す
+            return GenerateReplyResponse(
+                status="success",
+                replies=replies,
+                context=context
+            )
+        except HTTPException:
+            raise
+        except UpstreamUnavailableError as e:
+            raise upstream_http_exception(e)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to generate replies: {str(e)}")
+
+
+@router.post("/generate-reply/stream")
+async def generate_reply_stream(request: ReplyRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    返信候補をServer-Sent Eventsでストリーミング生成
+    
+    - **reply**: 返信候補1件（Reply）。LLM出力のJSONから候補が1件パースできた時点で送信
+    - **done**: 全候補の送信完了（status, context）
+    - **error**: 生成失敗（detail）
+    """
+    # 計測はレスポンスの送信完了まで続けるため、event_stream内で終了させる
+    spans = RequestSpans("generate_reply_stream")
+    try:
+        with activate_spans(spans):
+            inputs, context = await _load_reply_inputs(request, db)
+        registry = get_chain_registry()
+        if not registry.api_key:
+            raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+        reply_chain = registry.get("reply")
+    except HTTPException as e:
+        spans.finish(error_status(e))
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to generate initial greeting: {str(e)}")
+        spans.finish("500")
+        raise HTTPException(status_code=500, detail=f"Failed to generate replies: {str(e)}")
+
+    cache_key = _generation_cache_key(reply_chain, inputs)
+    cached_replies = await _get_cached_replies(cache_key, request.regenerate)
+
+    async def event_stream():
+        parser = IncrementalJsonArrayParser()
+        replies: List[Reply] = []
+        status = "success"
+        try:
+            with activate_spans(spans):
+                if cached_replies is not None:
+                    for reply in cached_replies:
+                        yield _sse_event("reply", reply.model_dump_json())
+                    yield _sse_event("done", json.dumps({"status": "success", "context": context}, ensure_ascii=False))
+                    return
+                async for chunk in _stream_llm(reply_chain, inputs):
+                    with phase("parse"):
+                        items = parser.feed(chunk.content)
+                    for item in items:
+                        try:
+                            reply = Reply.model_validate(item)
+                        except ValidationError:
+                            continue
+                        replies.append(reply)
+                        yield _sse_event("reply", reply.model_dump_json())
+                if not replies:
+                    # 逐次パースで候補が取れなかった場合は全文を修復・再依頼も含めてパースして送信
+                    parsed, path = await _parse_replies(reply_chain, parser.text)
+                    for reply in parsed:
+                        replies.append(reply)
+                        yield _sse_event("reply", reply.model_dump_json())
+                    cacheable = path == PARSE_STRICT
+                else:
+                    output_parse_total.inc(chain=reply_chain.name, path="streamed")
+                    cacheable = _is_strict_output(parser.text)
+                # 最後まで受信して全文がそのままパースできた場合だけキャッシュする
+                # （クライアントの切断で中断した場合はここに到達しない）
+                if cacheable:
+                    await _store_replies(cache_key, replies)
+                yield _sse_event("done", json.dumps({"status": "success", "context": context}, ensure_ascii=False))
+        except UpstreamUnavailableError as e:
+            # ストリーム開始後はHTTPステータスを変えられないため、再試行の目安をイベントで返す
+            status = str(e.status_code)
+            yield _sse_event("error", json.dumps(
+                {"detail": e.detail, "statusCode": e.status_code, "retryAfter": e.retry_after}, ensure_ascii=False
+            ))
+        except Exception as e:
+            status = "error"
+            logger.warning("返信候補のストリーミング生成に失敗: %s", str(e))
+            yield _sse_event("error", json.dumps({"detail": f"Failed to generate replies: {str(e)}"}, ensure_ascii=False))
+        finally:
+            spans.finish(status)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/generate-initial-greeting", response_model=GenerateInitialGreetingResponse)
+async def generate_initial_greeting(request: InitialGreetingRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    初回挨拶メッセージを生成
+    """
+    with request_spans("generate_initial_greeting"):
+        try:
+            # リクエストパラメータを使用
+            user_id = request.userId
+            target_id = request.selectedTargetId
+            
+            logger.debug("generate_initial_greeting userId=%s selectedTargetId=%s", user_id, target_id)
+            
+            with phase("db_load"):
+                # データベースからユーザー情報を取得
+                user = await async_crud.get_user_by_id(db, user_id=user_id)
+                if not user:
+                    raise HTTPException(status_code=404, detail="User not found")
+                
+                # データベースからターゲット情報を取得
+                target = await async_crud.get_target_by_id(db, target_id=target_id)
+                if not target:
+                    raise HTTPException(status_code=404, detail="Target not found")
+            
+            # 2. 起動時に構築済みの初回挨拶専用チェーンを取得
+            registry = get_chain_registry()
+            if not registry.api_key:
+                raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+            greeting_chain = registry.get("initial_greeting")
+            inputs, context = _build_greeting_inputs(user, target)
+            
+            # 3. 同一入力の生成結果があれば再利用し、なければチェーンを実行
+            cache_key = _generation_cache_key(greeting_chain, inputs)
+            replies = await _generate_replies(greeting_chain, inputs, cache_key, request.regenerate)
+            
+            # 4. レスポンスを返す
+            return GenerateInitialGreetingResponse(
+                status="success",
+                replies=replies,
+                context=context
+            )
+            
+        except HTTPException:
+            raise
+        except UpstreamUnavailableError as e:
+            raise upstream_http_exception(e)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to generate initial greeting: {str(e)}")
+
+
+async def _load_batch_contexts(request: BatchGenerateRequest, db: AsyncSession) -> Dict[int, ReplyContext]:
+    """全ターゲットのプロフィール・会話要約をまとめて1回、会話履歴をまとめて1回で取得"""
+    target_ids = list(dict.fromkeys(item.selectedTargetId for item in request.items))
+    with phase("db_load"):
+        user, contexts = await async_crud.get_batch_reply_contexts(
+            db, user_id=request.userId, target_ids=target_ids, limit=REPLY_HISTORY_LIMIT
+        )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return contexts
+
+
+async def _generate_batch_item(
+    index: int,
+    item: BatchGenerateItem,
+    contexts: Dict[int, ReplyContext],
+    registry: ChainRegistry,
+    regenerate: bool,
+    semaphore: asyncio.Semaphore,
+) -> BatchItemResult:
+    """一括生成の1件分を生成（失敗しても例外にせずエラー結果として返す）"""
+    message_type: BatchMessageType = "reply" if item.message is not None else "initial_greeting"
+    try:
+        reply_context = contexts.get(item.selectedTargetId)
+        if reply_context is None:
+            raise HTTPException(status_code=404, detail="Target not found")
+        async with semaphore:
+            if item.message is not None:
+                # 会話要約の更新はDBに書き込むため、項目ごとに別のセッションを使う（AsyncSessionは並行利用できない）
+                async with AsyncSessionLocal() as item_db:
+                    inputs, context = await _build_reply_inputs(item_db, reply_context, item.message)
+            else:
+                inputs, context = _build_greeting_inputs(reply_context.user, reply_context.target)
+            registered = registry.get(message_type)
+            cache_key = _generation_cache_key(registered, inputs)
+            replies = await _generate_replies(registered, inputs, cache_key, regenerate)
+        return BatchItemResult(
+            index=index,
+            selectedTargetId=item.selectedTargetId,
+            messageType=message_type,
+            status="success",
+            replies=replies,
+            context=context
+        )
+    except HTTPException as e:
+        status_code, detail, retry_after = e.status_code, e.detail, None
+    except UpstreamUnavailableError as e:
+        status_code, detail, retry_after = e.status_code, e.detail, e.retry_after
+    except Exception as e:
+        logger.warning("一括生成の項目%dの生成に失敗: %s", index, str(e))
+        status_code, detail, retry_after = 500, f"Failed to generate replies: {str(e)}", None
+    return BatchItemResult(
+        index=index,
+        selectedTargetId=item.selectedTargetId,
+        messageType=message_type,
+        status="error",
+        statusCode=status_code,
+        detail=detail,
+        retryAfter=retry_after
+    )
+
+
+def _get_configured_registry() -> ChainRegistry:
+    registry = get_chain_registry()
+    if not registry.api_key:
+        raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+    return registry
+
+
+def _start_batch(
+    request: BatchGenerateRequest,
+    contexts: Dict[int, ReplyContext],
+    registry: ChainRegistry,
+) -> List["asyncio.Task[BatchItemResult]"]:
+    """全項目の生成タスクを開始（同時実行数はセマフォで制限）"""
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    return [
+        asyncio.create_task(
+            _generate_batch_item(index, item, contexts, registry, request.regenerate, semaphore)
+        )
+        for index, item in enumerate(request.items)
+    ]
+
+
+@router.post("/generate-batch", response_model=BatchGenerateResponse)
+async def generate_batch(request: BatchGenerateRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    複数ターゲットの返信候補・初回挨拶を一括生成
+    
+    - **items**: messageを指定した項目は返信候補、未指定の項目は初回挨拶を生成
+    - 同時に実行するLLM呼び出しはBATCH_CONCURRENCY件まで
+    - 失敗した項目はstatus=errorとして返し、他の項目の生成は続ける
+    """
+    with request_spans("generate_batch"):
+        registry = _get_configured_registry()
+        contexts = await _load_batch_contexts(request, db)
+        results = await asyncio.gather(*_start_batch(request, contexts, registry))
+        failed = sum(1 for result in results if result.status != "success")
+        return BatchGenerateResponse(
+            status="success",
+            results=results,
+            succeeded=len(results) - failed,
+            failed=failed
+        )
+
+
+@router.post("/generate-batch/stream")
+async def generate_batch_stream(request: BatchGenerateRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    複数ターゲットの返信候補・初回挨拶をServer-Sent Eventsで一括生成
+    
+    - **result**: 1項目分の結果（BatchItemResult）。完了した順に送信
+    - **done**: 全項目の完了（status, succeeded, failed）
+    """
+    spans = RequestSpans("generate_batch_stream")
+    try:
+        registry = _get_configured_registry()
+        with activate_spans(spans):
+            contexts = await _load_batch_contexts(request, db)
+    except HTTPException as e:
+        spans.finish(error_status(e))
+        raise
+
+    async def event_stream():
+        succeeded = failed = 0
+        # 全項目を送信し終える前にクライアントが切断した場合は cancelled
+        status = "cancelled"
+        with activate_spans(spans):
+            tasks = _start_batch(request, contexts, registry)
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                if result.status == "success":
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield _sse_event("result", result.model_dump_json())
+            status = "success"
+            yield _sse_event("done", json.dumps({"status": "success", "succeeded": succeeded, "failed": failed}))
+        except Exception as e:
+            status = error_status(e)
+            raise
+        finally:
+            # クライアントが切断した場合は未完了の生成を中止する
+            for task in tasks:
+                task.cancel()
+            spans.finish(status)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/cache/stats")
+def get_generation_cache_stats():
+    """
+    生成キャッシュのヒット/ミス数、同時リクエストの集約数、
+    プロバイダ側プロンプトキャッシュに載ったトークン数などの統計を取得
+    """
+    return {
+        "generation": generation_cache.stats(),
+        "singleflight": generation_flight.stats(),
+        "summarySingleflight": summary_flight.stats(),
+        "llmUsage": llm_usage_metrics.stats(),
+        "upstream": upstream.stats(),
+        "profileRender": profile_render_cache.stats(),
+    }
 
 
 @router.post("/chat")
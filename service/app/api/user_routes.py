@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Response
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from typing import Optional
@@ -41,6 +41,10 @@ class UserResponse(BaseModel):
         from_attributes = True
 
 
+# GET /api/users/{user_id} で読み込む列（UserResponseの項目）
+USER_RESPONSE_COLUMNS = tuple(UserResponse.model_fields)
+
+
 @router.put("/tone")
 def update_user_tone(
     request: UpdateToneRequest,
@@ -59,27 +63,18 @@ def update_user_tone(
             detail="Tone must be between 0 and 3"
         )
     
-    # ユーザー存在確認
-    user = crud.get_user_by_id(db, request.user_id)
-    if not user:
-        raise HTTPException(
-            status_code=404,
-            detail="User not found"
-        )
-    
-    # トーン更新
+    # トーン更新（UPDATE ... RETURNING の1文で存在確認と更新後の値の取得を兼ねる）
     updated_user = crud.update_user(db, request.user_id, tone=request.tone)
-    
     if not updated_user:
         raise HTTPException(
-            status_code=500,
-            detail="Failed to update user tone"
+            status_code=404,
+            detail="User not found"
         )
     
     return UserResponse.from_orm(updated_user)
 
 
-@router.get("/{user_id}")
+@router.get("/{user_id}", response_model=UserResponse)
 def get_user(
     user_id: int,
     db: Session = Depends(get_db)
@@ -87,11 +82,16 @@ def get_user(
     """
     ユーザー情報を取得
     """
-    user = crud.get_user_by_id(db, user_id)
-    if not user:
+    # 頻繁にポーリングされるため、ORMオブジェクトを作らずレスポンスの列だけを行で読み、
+    # UserResponseの構築済みバリデーター・シリアライザーで直接JSONにする
+    row = crud.get_user_row(db, user_id, USER_RESPONSE_COLUMNS)
+    if row is None:
         raise HTTPException(
             status_code=404,
             detail="User not found"
         )
     
-    return UserResponse.from_orm(user) 
\ No newline at end of file
+    return Response(
+        content=UserResponse.model_validate(dict(row)).model_dump_json(),
+        media_type="application/json",
+    )
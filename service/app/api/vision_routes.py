@@ -1,24 +1,115 @@
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, File, Form, UploadFile
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List, Literal, Awaitable, Callable, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
 import base64
+import io
 import os
 import json
+import logging
 from dotenv import load_dotenv
-from openai import OpenAI
-
-from ...modules.database import get_db
-from ...modules import crud
+from openai import AsyncOpenAI
+
+from ...modules.database import get_async_db
+from ...modules import async_crud
+from ...modules.cache import content_hash, create_cache_from_env, make_cache_key
+from ...modules.image_preprocess import PreprocessedImage, preprocess_images, preprocess_uploads, summarize
+from ...modules.metrics import FirstTokenTimer, llm_usage_metrics, phase, request_spans
+from ...modules.openai_client import create_async_http_client
+from ...modules.profile_merge import merge_extractions
+from ...modules.singleflight import SingleFlight
+from ...modules.upstream import UpstreamUnavailableError, upstream, upstream_http_exception
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/api/vision", tags=["vision"])
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Vision呼び出し用の非同期クライアント（ワーカー内で共有するコネクションプール）
+VISION_TIMEOUT_SECONDS = float(os.getenv("VISION_TIMEOUT_SECONDS", "60"))
+
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=create_async_http_client(VISION_TIMEOUT_SECONDS),
+    # 再試行は共有スケジューラ（upstream.py）で行う
+    max_retries=0,
+)
+
+VISION_MODEL = "gpt-4o-mini"
+# parallelモードで画像1枚ごとに許容する出力トークン数
+VISION_PER_IMAGE_MAX_TOKENS = int(os.getenv("VISION_PER_IMAGE_MAX_TOKENS", "800"))
+# レート制限用の、画像以外の入力（システムプロンプトなど）のトークン数の見積もり
+VISION_PROMPT_TOKEN_ESTIMATE = 1000
+
+# 二重送信された同一画像の解析を1回のVision呼び出しにまとめる
+vision_flight = SingleFlight("vision")
+
+# 同一画像（元データまたは前処理後の正規化画像のハッシュ）に対する解析結果のキャッシュ
+vision_cache = create_cache_from_env(
+    "vision_cache", "VISION_CACHE", default_ttl_seconds=7 * 24 * 3600, default_max_entries=500,
+    default_backend="sqlite"
+)
+
+# プロフィール抽出用のシステムプロンプト
+PROFILE_SYSTEM_PROMPT = """あなたはマッチングアプリのプロフィール画面から情報を正確に抽出する専門家です。
+複数の画像が提供される場合は、全ての画像から情報を統合して抽出してください。
+画像から以下の情報を日本語で抽出してJSON形式で返してください：
+
+{
+  "name": "名前",
+  "age": 年齢（数値）,
+  "job": "職業",
+  "hobby": "趣味",
+  "residence": "居住地",
+  "workplace": "勤務地",
+  "bloodType": "血液型",
+  "education": "学歴",
+  "workType": "仕事の種類",
+  "holiday": "休日",
+  "marriageHistory": "結婚歴",
+  "hasChildren": "子供の有無",
+  "smoking": "煙草",
+  "drinking": "お酒",
+  "livingWith": "同居人",
+  "marriageIntention": "結婚に対する意思",
+  "selfIntroduction": "自己紹介文"
+}
+
+注意事項：
+- 複数の画像から情報を統合してください
+- 画像に表示されていない項目はnullとして返してください
+- 年齢は数値型で返してください
+- 各項目は日本語の文字列で返してください
+- 自己紹介文は改行を含む場合があります
+- マッチングアプリによって項目名が異なる場合は、最も近い項目にマッピングしてください
+- 複数の画像で同じ情報が異なる場合は、最も詳細または最新と思われる情報を採用してください
+"""
+
+# チャット画面からの最新メッセージ抽出用のシステムプロンプト
+CHAT_SYSTEM_PROMPT = """あなたはマッチングアプリのチャット画面から最新の女性メッセージを抽出する専門家です。
+
+以下のJSON形式で返してください：
+{
+  "latestFemaleMessage": "最新の女性メッセージ内容" または null
+}
+
+重要な判定ルール：
+- 左側の吹き出しが女性（相手）のメッセージです
+- 右側の吹き出しは男性（自分）のメッセージです
+- 画面に表示されている最も下にある左側の吹き出し（女性メッセージ）のテキストのみを抽出してください
+- 女性のメッセージが画面に存在しない場合はnullを返してください
+
+注意事項：
+- 改行も保持
+- 絵文字も正確に抽出
+- タイムスタンプは無視
+- メッセージのみ抽出（プロフィール情報などは無視）"""
 
 class ProfileImageRequest(BaseModel):
-    images: list[str]  # List of Base64 encoded images
+    images: list[str] = Field(min_length=1)  # List of Base64 encoded images
+    mode: Literal["single", "parallel"] = "single"  # parallel: 画像ごとに並列抽出して統合
 
 class ProfileData(BaseModel):
     name: Optional[str] = None
@@ -43,6 +134,7 @@ class ProfileAnalysisResponse(BaseModel):
     status: str
     profile: ProfileData
     confidence: float
+    fieldConfidence: Optional[Dict[str, float]] = None  # parallelモード時の項目ごとの信頼度
 
 
 class ChatScreenshotRequest(BaseModel):
@@ -56,197 +148,444 @@ class ChatScreenshotResponse(BaseModel):
     message: Optional[str]  # The extracted latest female message
 
 
-@router.post("/analyze-profile", response_model=ProfileAnalysisResponse)
-async def analyze_profile_image(request: ProfileImageRequest):
+async def _create_completion(chain: str, images: List[PreprocessedImage], **kwargs) -> str:
     """
-    マッチングアプリのスクリーンショットからプロフィール情報を抽出
-    複数画像対応版
-    """
-    try:
-        # プロンプトの準備
-        system_prompt = """あなたはマッチングアプリのプロフィール画面から情報を正確に抽出する専門家です。
-複数の画像が提供される場合は、全ての画像から情報を統合して抽出してください。
-画像から以下の情報を日本語で抽出してJSON形式で返してください：
+    共有スケジューラの実行枠内でVision APIをストリーミングで呼び出して応答テキストを返す
 
-{
-  "name": "名前",
-  "age": 年齢（数値）,
-  "job": "職業",
-  "hobby": "趣味",
-  "residence": "居住地",
-  "workplace": "勤務地",
-  "bloodType": "血液型",
-  "education": "学歴",
-  "workType": "仕事の種類",
-  "holiday": "休日",
-  "marriageHistory": "結婚歴",
-  "hasChildren": "子供の有無",
-  "smoking": "煙草",
-  "drinking": "お酒",
-  "livingWith": "同居人",
-  "marriageIntention": "結婚に対する意思",
-  "selfIntroduction": "自己紹介文"
-}
-
-注意事項：
-- 複数の画像から情報を統合してください
-- 画像に表示されていない項目はnullとして返してください
-- 年齢は数値型で返してください
-- 各項目は日本語の文字列で返してください
-- 自己紹介文は改行を含む場合があります
-- マッチングアプリによって項目名が異なる場合は、最も近い項目にマッピングしてください
-- 複数の画像で同じ情報が異なる場合は、最も詳細または最新と思われる情報を採用してください
-"""
+    TTFT・全体の所要時間を実行中のリクエストに、トークン使用量をモデルごとに記録する
+    """
+    estimated_tokens = (
+        sum(image.processed_tokens for image in images)
+        + VISION_PROMPT_TOKEN_ESTIMATE
+        + kwargs.get("max_tokens", 0)
+    )
+
+    async def create() -> str:
+        # 再試行時は計測をやり直す
+        timer = FirstTokenTimer()
+        stream = await client.chat.completions.create(
+            model=VISION_MODEL,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=VISION_TIMEOUT_SECONDS,
+            **kwargs
+        )
+        parts = []
+        usage = None
+        async for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                timer.chunk()
+                parts.append(chunk.choices[0].delta.content)
+        timer.done()
+        llm_usage_metrics.record_openai_usage(chain, VISION_MODEL, usage)
+        return "".join(parts)
+
+    return await upstream.run(VISION_MODEL, estimated_tokens, create)
+
+
+def _normalized_cache_key(endpoint: str, processed_images: List[PreprocessedImage]) -> str:
+    """前処理（正規化）後の画像セットの内容ハッシュからキャッシュキーを作成"""
+    return make_cache_key(endpoint, VISION_MODEL, [content_hash(image.data_url) for image in processed_images])
+
+
+def _profile_response(extracted_data: Dict[str, Any], field_confidence: Optional[Dict[str, float]] = None) -> ProfileAnalysisResponse:
+    """抽出結果をProfileAnalysisResponseに変換"""
+    # ProfileDataモデルに変換
+    profile_data = ProfileData(**extracted_data)
+    
+    # 抽出された項目数から信頼度を計算
+    total_fields = 17
+    extracted_fields = sum(1 for field in extracted_data.values() if field is not None)
+    confidence = extracted_fields / total_fields
+
+    return ProfileAnalysisResponse(
+        status="success",
+        profile=profile_data,
+        confidence=confidence,
+        fieldConfidence=field_confidence
+    )
+
+
+async def _extract_profile_single(processed_images: List[PreprocessedImage]) -> ProfileAnalysisResponse:
+    """全画像を1回のVision呼び出しにまとめてプロフィール情報を抽出"""
+    # 複数画像用のコンテンツを構築
+    user_content: List[Dict[str, Any]] = [
+        {
+            "type": "text",
+            "text": f"これら{len(processed_images)}枚の画像からプロフィール情報を抽出して統合してください。"
+        }
+    ]
+    
+    # 各画像をコンテンツに追加
+    for processed in processed_images:
+        user_content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": processed.data_url,
+                "detail": processed.detail
+            }
+        })
 
-        # 複数画像用のコンテンツを構築
-        user_content = [
+    # Vision APIを呼び出し
+    content = await _create_completion(
+        "vision_profile",
+        processed_images,
+        messages=[
             {
-                "type": "text",
-                "text": f"これら{len(request.images)}枚の画像からプロフィール情報を抽出して統合してください。"
+                "role": "system",
+                "content": PROFILE_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": user_content
             }
-        ]
-        
-        # 各画像をコンテンツに追加
-        for i, image_data in enumerate(request.images, 1):
-            user_content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": image_data,
-                    "detail": "high"
-                }
-            })
-
-        # Vision APIを呼び出し
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": user_content
-                }
-            ],
-            max_tokens=1500,  # 複数画像の場合、より多くのトークンが必要になる可能性
-            response_format={"type": "json_object"}
-        )
+        ],
+        max_tokens=1500,  # 複数画像の場合、より多くのトークンが必要になる可能性
+        response_format={"type": "json_object"}
+    )
+
+    # レスポンスの解析
+    with phase("parse"):
+        extracted_data = json.loads(content)
+        return _profile_response(extracted_data)
+
+
+async def _extract_profile_from_image(processed: PreprocessedImage) -> Dict[str, Any]:
+    """画像1枚からプロフィール情報を抽出（画像単位でキャッシュ）"""
+    cache_key = _normalized_cache_key("analyze-profile-image", [processed])
+    cached = await vision_cache.aget(cache_key)
+    if cached is not None:
+        return cached
+
+    content = await _create_completion(
+        "vision_profile_image",
+        [processed],
+        messages=[
+            {
+                "role": "system",
+                "content": PROFILE_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "この画像からプロフィール情報を抽出してください。"
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": processed.data_url,
+                            "detail": processed.detail
+                        }
+                    }
+                ]
+            }
+        ],
+        max_tokens=VISION_PER_IMAGE_MAX_TOKENS,
+        response_format={"type": "json_object"}
+    )
+    with phase("parse"):
+        extracted_data = json.loads(content)
+    await vision_cache.aset(cache_key, extracted_data)
+    return extracted_data
 
-        # レスポンスの解析
-        extracted_data = json.loads(response.choices[0].message.content)
-        
-        # ProfileDataモデルに変換
-        profile_data = ProfileData(**extracted_data)
-        
-        # 抽出された項目数から信頼度を計算
-        total_fields = 17
-        extracted_fields = sum(1 for field in extracted_data.values() if field is not None)
-        confidence = extracted_fields / total_fields
-
-        return ProfileAnalysisResponse(
-            status="success",
-            profile=profile_data,
-            confidence=confidence
-        )
 
-    except Exception as e:
-        print(f"Error analyzing profile image: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"画像の解析中にエラーが発生しました: {str(e)}"
+async def _extract_profile_parallel(processed_images: List[PreprocessedImage]) -> ProfileAnalysisResponse:
+    """
+    画像ごとに並列で抽出し、項目単位で統合する
+
+    一部の画像の抽出に失敗しても、成功した画像の結果で統合する
+    """
+    results = await asyncio.gather(
+        *(_extract_profile_from_image(processed) for processed in processed_images),
+        return_exceptions=True
+    )
+    extractions = [result for result in results if not isinstance(result, BaseException)]
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if not extractions:
+        raise failures[0]
+    for failure in failures:
+        logger.warning("画像単位のプロフィール抽出に失敗しました: %s", str(failure))
+
+    with phase("parse"):
+        merged, field_confidence = merge_extractions(
+            extractions, list(ProfileData.model_fields), numeric_fields=("age",)
         )
+        return _profile_response(merged, field_confidence)
 
 
-@router.post("/analyze-chat")
-async def analyze_chat_screenshot(
-    request: ChatScreenshotRequest,
-    db: Session = Depends(get_db)
-):
+async def _extract_profile(
+    raw_key: str,
+    load_images: Callable[[], Awaitable[List[PreprocessedImage]]],
+    mode: str = "single"
+) -> ProfileAnalysisResponse:
     """
-    チャット画面のスクリーンショットから最新の女性メッセージを抽出
+    Vision APIで複数画像からプロフィール情報を抽出
+    
+    元データのハッシュ（raw_key）と正規化画像のハッシュの両方で解析結果をキャッシュする。
+    load_imagesはキャッシュミス時のみ呼び出され、画像の前処理（縮小・再圧縮）結果を返す
     """
-    try:
-        print(request.image, 'request.image')
-        # ユーザーとターゲットの確認（認証目的のみ）
-        user = crud.get_user_by_id(db, user_id=request.userId)
+    cached = await vision_cache.aget(raw_key)
+    if cached is not None:
+        return ProfileAnalysisResponse.model_validate(cached)
+
+    # 画像を縮小・再圧縮してトークンコストを抑える
+    with phase("prompt_build"):
+        processed_images = await load_images()
+    logger.info("プロフィール画像の前処理: %s", summarize(processed_images))
+    normalized_key = _normalized_cache_key(f"analyze-profile:{mode}", processed_images)
+    cached = await vision_cache.aget(normalized_key)
+    if cached is not None:
+        await vision_cache.aset(raw_key, cached)
+        return ProfileAnalysisResponse.model_validate(cached)
+
+    if mode == "parallel":
+        result = await _extract_profile_parallel(processed_images)
+    else:
+        result = await _extract_profile_single(processed_images)
+    for key in (raw_key, normalized_key):
+        await vision_cache.aset(key, result.model_dump())
+    return result
+
+
+async def _extract_latest_female_message(
+    raw_key: str,
+    load_images: Callable[[], Awaitable[List[PreprocessedImage]]]
+) -> Optional[str]:
+    """
+    Vision APIでチャット画面から最新の女性メッセージを抽出
+    
+    元データのハッシュ（raw_key）と正規化画像のハッシュの両方で抽出結果をキャッシュする
+    """
+    cached = await vision_cache.aget(raw_key)
+    if cached is not None:
+        return cached["message"]
+
+    # 画像を縮小・再圧縮してトークンコストを抑える
+    with phase("prompt_build"):
+        processed_images = await load_images()
+    processed = processed_images[0]
+    logger.info("チャット画像の前処理: %s", summarize(processed_images))
+    normalized_key = _normalized_cache_key("analyze-chat", processed_images)
+    cached = await vision_cache.aget(normalized_key)
+    if cached is not None:
+        await vision_cache.aset(raw_key, cached)
+        return cached["message"]
+
+    # 単一画像用のコンテンツを構築
+    user_content = [
+        {
+            "type": "text",
+            "text": "この画像から最新（最も下にある）の女性メッセージ（左側の吹き出し）を抽出してください。"
+        },
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": processed.data_url,
+                "detail": processed.detail
+            }
+        }
+    ]
+
+    # Vision APIを呼び出し
+    content = await _create_completion(
+        "vision_chat",
+        [processed],
+        messages=[
+            {
+                "role": "system",
+                "content": CHAT_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": user_content
+            }
+        ],
+        temperature=0.3,
+        max_tokens=500,
+        response_format={"type": "json_object"}
+    )
+
+    # レスポンスの解析
+    with phase("parse"):
+        extracted_data = json.loads(content)
+        latest_female_message = extracted_data.get('latestFemaleMessage')
+    for key in (raw_key, normalized_key):
+        await vision_cache.aset(key, {"message": latest_female_message})
+    return latest_female_message
+
+
+async def _ensure_user_and_target(db: AsyncSession, user_id: int, target_id: int) -> None:
+    """ユーザーとターゲットの存在確認"""
+    with phase("db_load"):
+        user = await async_crud.get_user_by_id(db, user_id=user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        target = crud.get_target_by_id(db, target_id=request.targetId)
+        target = await async_crud.get_target_by_id(db, target_id=target_id)
         if not target:
             raise HTTPException(status_code=404, detail="Target not found")
 
-        # プロンプトの準備
-        system_prompt = """あなたはマッチングアプリのチャット画面から最新の女性メッセージを抽出する専門家です。
 
-以下のJSON形式で返してください：
-{
-  "latestFemaleMessage": "最新の女性メッセージ内容" または null
-}
+async def _read_uploads(files: List[UploadFile]) -> List[Tuple[bytes, Optional[str]]]:
+    """
+    アップロードファイルを (内容, Content-Type) として読み込む
 
-重要な判定ルール：
-- 左側の吹き出しが女性（相手）のメッセージです
-- 右側の吹き出しは男性（自分）のメッセージです
-- 画面に表示されている最も下にある左側の吹き出し（女性メッセージ）のテキストのみを抽出してください
-- 女性のメッセージが画面に存在しない場合はnullを返してください
+    同一画像の同時リクエストで解析を共有するため、single-flightに入る前に読み込む
+    （先行リクエストのクライアントが切断してファイルが閉じられても、後続リクエストの解析は続く）
+    """
+    return [(await file.read(), file.content_type) for file in files]
 
-注意事項：
-- 改行も保持
-- 絵文字も正確に抽出
-- タイムスタンプは無視
-- メッセージのみ抽出（プロフィール情報などは無視）"""
 
-        # 単一画像用のコンテンツを構築
-        user_content = [
-            {
-                "type": "text",
-                "text": "この画像から最新（最も下にある）の女性メッセージ（左側の吹き出し）を抽出してください。"
-            },
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": request.image,
-                    "detail": "high"
-                }
-            }
-        ]
-
-        # Vision APIを呼び出し
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": user_content
-                }
-            ],
-            temperature=0.3,
-            max_tokens=500,
-            response_format={"type": "json_object"}
-        )
+async def _upload_hashes(uploads: List[Tuple[bytes, Optional[str]]]) -> List[str]:
+    """読み込んだアップロード画像の内容ハッシュ"""
+    return await asyncio.to_thread(lambda: [content_hash(data) for data, _ in uploads])
 
-        # レスポンスの解析
-        extracted_data = json.loads(response.choices[0].message.content)
-        latest_female_message = extracted_data.get('latestFemaleMessage')
-        print(latest_female_message, 'latest_female_message')
-        return ChatScreenshotResponse(
-            status="success",
-            message=latest_female_message
-        )
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Error analyzing chat screenshot: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"チャット画像の解析中にエラーが発生しました: {str(e)}"
-        )
+def _preprocess_read_uploads(uploads: List[Tuple[bytes, Optional[str]]]) -> Awaitable[List[PreprocessedImage]]:
+    """読み込んだアップロード画像を前処理する"""
+    return preprocess_uploads([(io.BytesIO(data), content_type) for data, content_type in uploads])
+
+
+@router.post("/analyze-profile", response_model=ProfileAnalysisResponse)
+async def analyze_profile_image(request: ProfileImageRequest):
+    """
+    マッチングアプリのスクリーンショットからプロフィール情報を抽出
+    複数画像対応版
+    
+    - **mode**: single（全画像を1回で抽出, デフォルト）または parallel（画像ごとに並列抽出して統合）
+    """
+    with request_spans("analyze_profile_image"):
+        try:
+            # 同一画像セットの同時リクエストは1回の解析結果を共有
+            raw_key = make_cache_key(
+                f"analyze-profile:{request.mode}", VISION_MODEL, [content_hash(image) for image in request.images]
+            )
+            return await vision_flight.do(
+                raw_key,
+                lambda: _extract_profile(raw_key, lambda: preprocess_images(request.images), request.mode)
+            )
+
+        except UpstreamUnavailableError as e:
+            raise upstream_http_exception(e)
+        except Exception as e:
+            logger.warning("Error analyzing profile image: %s", str(e))
+            raise HTTPException(
+                status_code=500,
+                detail=f"画像の解析中にエラーが発生しました: {str(e)}"
+            )
+
+
+@router.post("/analyze-chat")
+async def analyze_chat_screenshot(
+    request: ChatScreenshotRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    チャット画面のスクリーンショットから最新の女性メッセージを抽出
+    """
+    with request_spans("analyze_chat_screenshot"):
+        try:
+            # ユーザーとターゲットの確認（認証目的のみ）
+            await _ensure_user_and_target(db, request.userId, request.targetId)
+
+            # 同一画像の同時リクエストは1回の解析結果を共有
+            raw_key = make_cache_key("analyze-chat", VISION_MODEL, content_hash(request.image))
+            latest_female_message = await vision_flight.do(
+                raw_key, lambda: _extract_latest_female_message(raw_key, lambda: preprocess_images([request.image]))
+            )
+            return ChatScreenshotResponse(
+                status="success",
+                message=latest_female_message
+            )
+
+        except HTTPException:
+            raise
+        except UpstreamUnavailableError as e:
+            raise upstream_http_exception(e)
+        except Exception as e:
+            logger.warning("Error analyzing chat screenshot: %s", str(e))
+            raise HTTPException(
+                status_code=500,
+                detail=f"チャット画像の解析中にエラーが発生しました: {str(e)}"
+            )
+
+
+@router.post("/analyze-profile/upload", response_model=ProfileAnalysisResponse)
+async def analyze_profile_upload(
+    images: List[UploadFile] = File(..., min_length=1),
+    mode: Literal["single", "parallel"] = Form("single")
+):
+    """
+    プロフィール画像をmultipart/form-dataで受け取り、プロフィール情報を抽出
+    
+    Base64・JSONを経由せず、画像のバイト列をそのまま前処理に渡す
+    """
+    with request_spans("analyze_profile_upload"):
+        try:
+            uploads = await _read_uploads(images)
+            raw_key = make_cache_key(f"analyze-profile-upload:{mode}", VISION_MODEL, await _upload_hashes(uploads))
+            return await vision_flight.do(
+                raw_key,
+                lambda: _extract_profile(raw_key, lambda: _preprocess_read_uploads(uploads), mode)
+            )
+
+        except UpstreamUnavailableError as e:
+            raise upstream_http_exception(e)
+        except Exception as e:
+            logger.warning("Error analyzing profile image: %s", str(e))
+            raise HTTPException(
+                status_code=500,
+                detail=f"画像の解析中にエラーが発生しました: {str(e)}"
+            )
+
+
+@router.post("/analyze-chat/upload", response_model=ChatScreenshotResponse)
+async def analyze_chat_upload(
+    image: UploadFile = File(...),
+    userId: int = Form(...),
+    targetId: int = Form(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    チャット画面のスクリーンショットをmultipart/form-dataで受け取り、最新の女性メッセージを抽出
+    """
+    with request_spans("analyze_chat_upload"):
+        try:
+            # ユーザーとターゲットの確認（認証目的のみ）
+            await _ensure_user_and_target(db, userId, targetId)
+
+            uploads = await _read_uploads([image])
+            raw_key = make_cache_key("analyze-chat-upload", VISION_MODEL, await _upload_hashes(uploads))
+            latest_female_message = await vision_flight.do(
+                raw_key, lambda: _extract_latest_female_message(raw_key, lambda: _preprocess_read_uploads(uploads))
+            )
+            return ChatScreenshotResponse(
+                status="success",
+                message=latest_female_message
+            )
+
+        except HTTPException:
+            raise
+        except UpstreamUnavailableError as e:
+            raise upstream_http_exception(e)
+        except Exception as e:
+            logger.warning("Error analyzing chat screenshot: %s", str(e))
+            raise HTTPException(
+                status_code=500,
+                detail=f"チャット画像の解析中にエラーが発生しました: {str(e)}"
+            )
+
+
+@router.get("/cache/stats")
+def get_vision_cache_stats():
+    """
+    Vision解析結果キャッシュのヒット/ミス数、同時リクエストの集約数などの統計を取得
+    """
+    return {"vision": vision_cache.stats(), "singleflight": vision_flight.stats()}
 
 
 @router.get("/health")
@@ -0,0 +1,297 @@
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .embeddings import embed_conversation, embed_conversations
+from .profile_render import profile_render_cache
+from .crud import (
+    ConversationImportPlan,
+    ImportTurn,
+    ReplyContext,
+    apply_conversation_summary,
+    batch_recent_conversations_statement,
+    batch_targets_statement,
+    build_batch_reply_contexts,
+    build_reply_context,
+    column_values,
+    conversation_page_statements,
+    conversation_summary_statement,
+    embedding_candidates_statement,
+    existing_turns_statement,
+    insert_returning_statement,
+    missing_embeddings_statement,
+    older_unsummarized_statement,
+    plan_conversation_import,
+    rank_by_cosine_distance,
+    related_conversations_statement,
+    reply_context_statement,
+    row_by_id_statement,
+    summary_outdated,
+    summary_table,
+    update_returning_statement,
+)
+
+# crud.py の非同期版（非同期ルートハンドラからAsyncSessionで利用する）
+
+logger = logging.getLogger(__name__)
+
+
+async def detect_summary_table(db: AsyncSession) -> bool:
+    """
+    会話要約のテーブルの有無を確認する（起動時に呼ぶ）
+
+    テーブルがない場合は要約なしで返信を生成する。確認できなかった場合は有効のままにする
+    """
+    try:
+        enabled = await db.run_sync(lambda session: summary_table.detect(session.connection()))
+    except Exception as e:
+        logger.warning("会話要約のテーブルの確認に失敗: %s", str(e))
+        return summary_table.enabled
+    if not enabled:
+        logger.warning("conversation_summaries テーブルがないため、会話要約を無効化して起動します")
+    return enabled
+
+
+async def get_user_by_id(db: AsyncSession, user_id: int):
+    """ユーザーIDからユーザー情報を取得"""
+    return await db.scalar(select(models.User).where(models.User.id == user_id))
+
+
+async def get_user_row(db: AsyncSession, user_id: int, columns: Sequence[str]):
+    """ユーザーの指定した列だけを列名→値のマッピングで取得（存在しない場合は None）"""
+    result = await db.execute(row_by_id_statement(models.User, user_id, columns))
+    return result.mappings().first()
+
+
+async def get_user_by_auth0_id(db: AsyncSession, auth0_id: str):
+    """Auth0 IDからユーザー情報を取得"""
+    return await db.scalar(select(models.User).where(models.User.auth0_id == auth0_id))
+
+
+async def get_target_by_id(db: AsyncSession, target_id: int):
+    """ターゲットIDから相手の女性情報を取得"""
+    return await db.scalar(select(models.Target).where(models.Target.id == target_id))
+
+
+async def get_user_targets(db: AsyncSession, user_id: int):
+    """ユーザーIDから全てのターゲット情報を取得"""
+    result = await db.scalars(select(models.Target).where(models.Target.user_id == user_id))
+    return result.all()
+
+
+async def get_conversation(db: AsyncSession, user_id: int, target_id: int):
+    """ユーザーIDとターゲットIDから会話履歴を取得"""
+    result = await db.scalars(
+        select(models.Conversation).where(
+            models.Conversation.user_id == user_id,
+            models.Conversation.target_id == target_id
+        ).order_by(models.Conversation.created_at.asc())
+    )
+    return result.all()
+
+
+async def get_reply_context(db: AsyncSession, user_id: int, target_id: int, limit: int = 20) -> ReplyContext:
+    """ユーザー・ターゲット・会話要約・直近N件の会話履歴を1往復で取得"""
+    result = await db.execute(reply_context_statement(user_id, target_id, limit))
+    return build_reply_context(result.all())
+
+
+async def get_older_unsummarized_conversations(
+    db: AsyncSession,
+    user_id: int,
+    target_id: int,
+    before: Tuple[datetime, int],
+    limit: int,
+) -> List[models.Conversation]:
+    """要約に未取り込みで before より前の会話を古い順にN件取得"""
+    result = await db.scalars(older_unsummarized_statement(user_id, target_id, before, limit))
+    return list(result.all())
+
+
+async def get_batch_reply_contexts(
+    db: AsyncSession,
+    user_id: int,
+    target_ids: Sequence[int],
+    limit: int = 20,
+) -> Tuple[Optional[models.User], Dict[int, ReplyContext]]:
+    """
+    ユーザーと複数ターゲットの返信生成用コンテキストを2往復（プロフィール・会話履歴）で取得
+
+    ユーザーが所有していない・存在しないターゲットは結果のdictに含まれない
+    """
+    target_rows = (await db.execute(batch_targets_statement(user_id, target_ids))).all()
+    if not target_rows:
+        return None, {}
+    conversations = (await db.scalars(batch_recent_conversations_statement(user_id, target_ids, limit))).all()
+    return target_rows[0][0], build_batch_reply_contexts(target_rows, conversations)
+
+
+async def get_conversation_page(
+    db: AsyncSession,
+    user_id: int,
+    target_id: int,
+    limit: int = 20,
+    before: Optional[Tuple[Optional[datetime], int]] = None,
+) -> Tuple[List[models.Conversation], bool]:
+    """会話履歴を新しい順に1ページ分取得し、(会話リスト, 次ページ有無) を返す"""
+    rows: List[models.Conversation] = []
+    for statement in conversation_page_statements(user_id, target_id, limit, before):
+        rows.extend((await db.scalars(statement)).all())
+        if len(rows) > limit:
+            break
+    return rows[:limit], len(rows) > limit
+
+
+async def create_user(db: AsyncSession, auth0_id: str, name: str, email: str, **kwargs):
+    """新規ユーザーを作成"""
+    db_user = await db.scalar(insert_returning_statement(
+        models.User, dict(kwargs, auth0_id=auth0_id, name=name, email=email)
+    ))
+    await db.commit()
+    return db_user
+
+
+async def create_target(db: AsyncSession, user_id: int, name: str, **kwargs):
+    """新規ターゲットを作成"""
+    db_target = await db.scalar(insert_returning_statement(
+        models.Target, dict(kwargs, user_id=user_id, name=name)
+    ))
+    await db.commit()
+    return db_target
+
+
+async def update_user(db: AsyncSession, user_id: int, **kwargs):
+    """ユーザー情報を更新（ユーザーが存在しない場合は None）"""
+    if not column_values(models.User, kwargs):
+        return await get_user_by_id(db, user_id)
+    db_user = await db.scalar(update_returning_statement(models.User, user_id, kwargs))
+    await db.commit()
+    if db_user is not None:
+        # 描画済みプロフィールを破棄（次の生成時に描画し直す）
+        profile_render_cache.invalidate("user", user_id)
+    return db_user
+
+
+async def update_target(db: AsyncSession, target_id: int, **kwargs):
+    """ターゲット情報を更新（ターゲットが存在しない場合は None）"""
+    if not column_values(models.Target, kwargs):
+        return await get_target_by_id(db, target_id)
+    db_target = await db.scalar(update_returning_statement(models.Target, target_id, kwargs))
+    await db.commit()
+    if db_target is not None:
+        # 描画済みプロフィールを破棄（次の生成時に描画し直す）
+        profile_render_cache.invalidate("target", target_id)
+    return db_target
+
+
+async def create_conversation(db: AsyncSession, user_id: int, target_id: int, female_message: str, male_reply: str):
+    """新規会話を作成（関連会話の検索が有効な場合は埋め込みも保存）"""
+    values = {
+        "user_id": user_id,
+        "target_id": target_id,
+        "female_message": female_message,
+        "male_reply": male_reply,
+    }
+    embedding = await embed_conversation(female_message, male_reply)
+    if embedding is not None:
+        values["embedding"] = embedding
+    db_conversation = await db.scalar(insert_returning_statement(models.Conversation, values))
+    await db.commit()
+    return db_conversation
+
+
+async def import_conversations(
+    db: AsyncSession,
+    user_id: int,
+    target_id: int,
+    turns: Sequence[ImportTurn],
+    dedup: bool = True,
+) -> ConversationImportPlan:
+    """
+    会話をまとめて取り込む（1トランザクション・まとめてINSERT）
+
+    関連会話の検索が有効な場合は埋め込みもまとめて計算して保存する。
+    要約済みの位置より古い会話を取り込んだ場合は、次回の返信生成で要約を作り直すよう要約を削除する
+    """
+    existing_rows = None
+    if dedup:
+        existing_rows = (await db.execute(
+            existing_turns_statement(user_id, target_id, [turn.female_message for turn in turns])
+        )).all()
+    plan = plan_conversation_import(user_id, target_id, turns, existing_rows)
+    if plan.rows:
+        embeddings = await embed_conversations(
+            [(row["female_message"], row["male_reply"]) for row in plan.rows]
+        )
+        if any(embedding is not None for embedding in embeddings):
+            # 埋め込みの列は関連会話の検索が有効な場合だけ書き込む（全行で同じ列にそろえる）
+            for row, embedding in zip(plan.rows, embeddings):
+                row["embedding"] = embedding
+        await db.execute(insert(models.Conversation), plan.rows)
+        if summary_table.enabled:
+            db_summary = await db.scalar(conversation_summary_statement(user_id, target_id))
+            if summary_outdated(db_summary, plan.rows):
+                await db.delete(db_summary)
+    await db.commit()
+    return plan
+
+
+async def get_conversation_by_id(db: AsyncSession, conversation_id: int):
+    """会話IDから会話情報を取得"""
+    return await db.scalar(select(models.Conversation).where(models.Conversation.id == conversation_id))
+
+
+async def get_related_conversations(
+    db: AsyncSession,
+    user_id: int,
+    target_id: int,
+    query_embedding: Sequence[float],
+    limit: int,
+    before: Optional[Tuple[datetime, int]] = None,
+) -> List[models.Conversation]:
+    """query_embeddingに近い会話をlimit件取得（近い順）"""
+    if db.bind.dialect.name == "postgresql":
+        result = await db.scalars(
+            related_conversations_statement(user_id, target_id, query_embedding, limit, before)
+        )
+        return list(result.all())
+    rows = (await db.execute(embedding_candidates_statement(user_id, target_id, before))).all()
+    return rank_by_cosine_distance(rows, query_embedding, limit)
+
+
+async def get_conversations_missing_embedding(db: AsyncSession, user_id: int, target_id: int, limit: int):
+    """埋め込みが未計算の会話を古い順に取得"""
+    result = await db.scalars(missing_embeddings_statement(user_id, target_id, limit))
+    return list(result.all())
+
+
+async def update_conversation_embeddings(db: AsyncSession, embeddings: Dict[int, Sequence[float]]) -> None:
+    """会話IDごとの埋め込みをまとめて保存（主キー指定の一括UPDATE）"""
+    if not embeddings:
+        return
+    await db.execute(
+        update(models.Conversation),
+        [{"id": conversation_id, "embedding": embedding} for conversation_id, embedding in embeddings.items()],
+    )
+    await db.commit()
+
+
+async def upsert_conversation_summary(
+    db: AsyncSession,
+    user_id: int,
+    target_id: int,
+    summary: str,
+    last_conversation: models.Conversation,
+):
+    """ユーザー×ターゲットの会話要約を作成・更新（last_conversationまでを取り込み済みとする）"""
+    db_summary = await db.scalar(conversation_summary_statement(user_id, target_id))
+    updated = apply_conversation_summary(db_summary, user_id, target_id, summary, last_conversation)
+    if updated is None:
+        return db_summary
+    db.add(updated)
+    await db.commit()
+    await db.refresh(updated)
+    return updated
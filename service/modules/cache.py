@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def make_cache_key(*parts: Any) -> str:
+    """任意のJSON化可能な値の組からキャッシュキー（SHA-256）を生成"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def content_hash(data: Union[str, bytes]) -> str:
+    """画像などのペイロード本体のSHA-256ハッシュ"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class SQLiteCacheBackend:
+    """
+    ローカルSQLiteファイルに保存する永続キャッシュバックエンド
+
+    ディスクI/Oを伴うため、非同期ルートからは TTLCache.aget / aset 経由でスレッドから呼び出す。
+    読み取りでは書き込みを行わず（最近のアクセス順はメモリ側のLRUで管理）、
+    上限超過分は保存時刻の古い順に、一定件数の保存ごとにまとめて削除する
+    """
+
+    # 上限超過分・期限切れ分の削除を行う保存件数の間隔
+    EVICTION_INTERVAL = 100
+
+    def __init__(self, path: str, max_entries: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._sets_since_eviction = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # accessed_at は保存時刻（読み取り時には更新しない）
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed_at ON cache_entries (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache_entries WHERE key = ?", (key,)
+            ).fetchone()
+        # 期限切れの行は次回の一括削除に任せる
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, payload, expires_at, time.time()),
+            )
+            self._sets_since_eviction += 1
+            if self._sets_since_eviction >= self.EVICTION_INTERVAL:
+                self._sets_since_eviction = 0
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """期限切れ分と上限超過分（保存時刻が古い順）を削除"""
+        self._conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM cache_entries WHERE key IN ("
+            " SELECT key FROM cache_entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            self._conn.commit()
+
+
+# メモリ上にエントリがないことを表す（None をキャッシュ値と区別する）
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    TTLと件数上限（LRU）付きのインメモリキャッシュ
+
+    backendを指定するとメモリのミス時に永続バックエンドも参照する（プロセス再起動・ワーカー間で共有）
+    """
+
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int, backend: Optional[SQLiteCacheBackend] = None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.backend = backend
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.stores = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._get_memory(key)
+        if value is not _MISSING:
+            return value
+        stored = self.backend.get(key) if self.backend is not None else None
+        return self._resolve_backend(key, stored)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """get の非同期版（永続バックエンドの参照はスレッドで行い、イベントループを止めない）"""
+        value = self._get_memory(key)
+        if value is not _MISSING:
+            return value
+        stored = await asyncio.to_thread(self.backend.get, key) if self.backend is not None else None
+        return self._resolve_backend(key, stored)
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = self._store(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value, expires_at)
+
+    async def aset(self, key: str, value: Any) -> None:
+        """set の非同期版（永続バックエンドへの書き込みはスレッドで行う）"""
+        expires_at = self._store(key, value)
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.set, key, value, expires_at)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def record_bypass(self) -> None:
+        """キャッシュを使わずに再生成したリクエストを記録"""
+        with self._lock:
+            self.bypasses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "stores": self.stores,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "maxEntries": self.max_entries,
+                "ttlSeconds": self.ttl_seconds,
+                "backend": "sqlite" if self.backend is not None else "memory",
+            }
+
+    def _get_memory(self, key: str) -> Any:
+        """メモリ上の有効なエントリ（なければ _MISSING）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+        return _MISSING
+
+    def _resolve_backend(self, key: str, stored: Optional[Tuple[Any, float]]) -> Optional[Any]:
+        """永続バックエンドの参照結果をメモリに取り込み、ヒット・ミスを記録"""
+        if stored is not None:
+            value, expires_at = stored
+            self._remember(key, value, expires_at)
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _store(self, key: str, value: Any) -> float:
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, expires_at)
+        with self._lock:
+            self.stores += 1
+        return expires_at
+
+    def _remember(self, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def create_cache_from_env(
+    name: str,
+    env_prefix: str,
+    default_ttl_seconds: float,
+    default_max_entries: int,
+    default_backend: str = "memory",
+) -> TTLCache:
+    """
+    環境変数からキャッシュを構築
+
+    - {env_prefix}_TTL_SECONDS: 有効期限（秒）
+    - {env_prefix}_MAX_ENTRIES: メモリ上の最大件数
+    - {env_prefix}_BACKEND: memory または sqlite
+    - {env_prefix}_PATH: sqliteバックエンドのファイルパス
+    - {env_prefix}_BACKEND_MAX_ENTRIES: sqliteバックエンドの最大件数
+    """
+    ttl_seconds = float(os.getenv(f"{env_prefix}_TTL_SECONDS", str(default_ttl_seconds)))
+    max_entries = int(os.getenv(f"{env_prefix}_MAX_ENTRIES", str(default_max_entries)))
+    backend = None
+    if os.getenv(f"{env_prefix}_BACKEND", default_backend).lower() == "sqlite":
+        path = os.getenv(f"{env_prefix}_PATH", f".cache/{name}.sqlite3")
+        backend_max_entries = int(os.getenv(f"{env_prefix}_BACKEND_MAX_ENTRIES", str(max_entries * 10)))
+        backend = SQLiteCacheBackend(path, backend_max_entries)
+    return TTLCache(name, ttl_seconds, max_entries, backend=backend)
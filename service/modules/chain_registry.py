@@ -0,0 +1,118 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from langchain_core.output_parsers import BaseOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_openai import ChatOpenAI
+from pydantic import SecretStr
+
+from .conversation_history import count_tokens
+from .openai_client import create_async_http_client
+
+
+@dataclass
+class RegisteredChain:
+    """起動時に組み立て済みのプロンプト・パーサー・LLMの組"""
+    name: str
+    prompt: ChatPromptTemplate
+    parser: BaseOutputParser
+    format_instructions: str
+    model: str
+    temperature: float
+    registry: "ChainRegistry" = field(repr=False)
+    _static_tokens: Optional[int] = field(default=None, repr=False)
+
+    @property
+    def llm(self) -> ChatOpenAI:
+        return self.registry.get_llm(self.model, self.temperature)
+
+    @property
+    def static_tokens(self) -> int:
+        """入力値を空にして描画したプロンプト（固定部分）のトークン数（初回のみ計算）"""
+        if self._static_tokens is None:
+            empty = {name: "" for name in self.prompt.input_variables}
+            self._static_tokens = count_tokens(self.prompt.format(**empty), self.model)
+        return self._static_tokens
+
+
+class ChainRegistry:
+    """
+    LLMチェーンの構成要素をアプリ起動時に一度だけ構築して保持するレジストリ
+
+    リクエストごとのプロンプト・パーサー・LLMクライアント生成を避け、
+    モデル/温度の組ごとに1つのLLMクライアント（共有コネクションプール）を使い回す
+    """
+
+    def __init__(self, api_key: Optional[str], timeout: float = 60.0):
+        self.api_key = api_key
+        self._timeout = timeout
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._llms: Dict[Tuple[str, float], ChatOpenAI] = {}
+        self._chains: Dict[str, RegisteredChain] = {}
+
+    def get_llm(self, model: str, temperature: float) -> ChatOpenAI:
+        """モデル/温度の組ごとにLLMクライアントを1つだけ生成して返す"""
+        key = (model, temperature)
+        llm = self._llms.get(key)
+        if llm is None:
+            if self._http_client is None:
+                self._http_client = create_async_http_client(self._timeout)
+            llm = ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                api_key=SecretStr(self.api_key) if self.api_key else None,
+                timeout=self._timeout,
+                http_async_client=self._http_client,
+                # ストリーミング時も最終チャンクでトークン使用量（キャッシュ分を含む）を受け取る
+                stream_usage=True,
+                # 再試行は共有スケジューラ（upstream.py）で行う
+                max_retries=0,
+            )
+            self._llms[key] = llm
+        return llm
+
+    def register(
+        self,
+        name: str,
+        messages: Any,
+        parser: BaseOutputParser,
+        model: str,
+        temperature: float,
+    ) -> RegisteredChain:
+        """プロンプトを組み立て、フォーマット指示を埋め込んだ状態で登録"""
+        format_instructions = parser.get_format_instructions()
+        prompt = ChatPromptTemplate.from_messages(messages)
+        if "format_instructions" in prompt.input_variables:
+            prompt = prompt.partial(format_instructions=format_instructions)
+        registered = RegisteredChain(
+            name=name,
+            prompt=prompt,
+            parser=parser,
+            format_instructions=format_instructions,
+            model=model,
+            temperature=temperature,
+            registry=self,
+        )
+        self._chains[name] = registered
+        return registered
+
+    def get(self, name: str) -> RegisteredChain:
+        return self._chains[name]
+
+    def warm_up(self) -> None:
+        """APIキーが設定されていれば全チェーンのLLMクライアントを事前生成"""
+        if not self.api_key:
+            return
+        for registered in self._chains.values():
+            registered.llm
+
+    def warm_up_tokens(self) -> None:
+        """全チェーンの固定部分のトークン数を計算しておく（トークナイザーの読み込みを伴うため別スレッドで呼ぶ）"""
+        for registered in self._chains.values():
+            registered.static_tokens
+
+    async def aclose(self) -> None:
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
@@ -0,0 +1,137 @@
+import logging
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence
+
+import tiktoken
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# プロンプトに逐語で含める会話履歴のトークン予算
+HISTORY_TOKEN_BUDGET = int(os.getenv("REPLY_HISTORY_TOKEN_BUDGET", "1500"))
+# 予算超過時、逐語で残す履歴を予算のこの割合まで減らす（毎回要約し直さないための余裕）
+HISTORY_KEEP_RATIO = float(os.getenv("REPLY_HISTORY_KEEP_RATIO", "0.5"))
+
+FALLBACK_ENCODING = "o200k_base"
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(FALLBACK_ENCODING)
+    except Exception as e:
+        # 語彙ファイルを取得できない環境では文字数で見積もる
+        logger.warning("トークナイザーの読み込みに失敗（文字数で見積もり）: %s", str(e))
+        return None
+
+
+def warm_up_encodings(models: Iterable[str]) -> None:
+    """モデルのトークナイザーを読み込んでおく（語彙ファイルの読み込み・初回のダウンロードを伴うため別スレッドで呼ぶ）"""
+    for model in models:
+        _get_encoding(model)
+
+
+def count_tokens(text: str, model: str) -> int:
+    """モデルのトークナイザーでテキストのトークン数を数える"""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        # 日本語は概ね1文字1トークン以下のため、文字数を上限側の見積もりとして使う
+        return len(text)
+    return len(encoding.encode(text))
+
+
+def format_turn(conversation: models.Conversation) -> str:
+    return f"彼女: {conversation.female_message}\nあなた: {conversation.male_reply}"
+
+
+def format_turns(conversations: Sequence[models.Conversation]) -> str:
+    return "\n".join(format_turn(c) for c in conversations)
+
+
+@dataclass
+class HistoryWindow:
+    """プロンプトに逐語で含める直近の会話と、要約に取り込む古い会話"""
+    recent: List[models.Conversation]  # 古い順
+    to_summarize: List[models.Conversation]  # 古い順
+    recent_tokens: int
+
+
+def build_history_window(
+    conversations: Sequence[models.Conversation],
+    model: str,
+    budget_tokens: int = HISTORY_TOKEN_BUDGET,
+    keep_ratio: float = HISTORY_KEEP_RATIO,
+) -> HistoryWindow:
+    """
+    要約に未取り込みの会話（古い順）を、トークン予算内の直近の会話と要約対象の古い会話に分ける
+
+    予算内に収まる間は要約対象を作らない。超過した場合は逐語で残す分を
+    budget_tokens * keep_ratio まで減らし、それより古い会話を要約対象とする
+    （最新の1往復は予算を超えても逐語で残す）
+    """
+    turn_tokens = [count_tokens(format_turn(c), model) for c in conversations]
+    if sum(turn_tokens) <= budget_tokens:
+        return HistoryWindow(recent=list(conversations), to_summarize=[], recent_tokens=sum(turn_tokens))
+
+    keep_budget = int(budget_tokens * keep_ratio)
+    kept_tokens = 0
+    split = len(conversations)
+    for index in range(len(conversations) - 1, -1, -1):
+        if split < len(conversations) and kept_tokens + turn_tokens[index] > keep_budget:
+            break
+        kept_tokens += turn_tokens[index]
+        split = index
+    return HistoryWindow(
+        recent=list(conversations[split:]),
+        to_summarize=list(conversations[:split]),
+        recent_tokens=kept_tokens,
+    )
+
+
+def chunk_turns(
+    conversations: Sequence[models.Conversation],
+    model: str,
+    budget_tokens: int = HISTORY_TOKEN_BUDGET,
+) -> List[List[models.Conversation]]:
+    """
+    古い順の会話を、1回の要約に渡す量がトークン予算内に収まるまとまりに分ける
+
+    1往復で予算を超える会話は、その1往復だけのまとまりにする
+    """
+    chunks: List[List[models.Conversation]] = []
+    chunk_tokens = 0
+    for conversation in conversations:
+        tokens = count_tokens(format_turn(conversation), model)
+        if chunks and chunk_tokens + tokens <= budget_tokens:
+            chunks[-1].append(conversation)
+            chunk_tokens += tokens
+        else:
+            chunks.append([conversation])
+            chunk_tokens = tokens
+    return chunks
+
+
+def format_conversation_history(
+    recent: Sequence[models.Conversation],
+    summary: Optional[str],
+    related: Sequence[models.Conversation] = (),
+) -> str:
+    """要約・関連する過去の会話（古い順）・直近の会話をプロンプト用のテキストにまとめる"""
+    if not recent and not summary and not related:
+        return "（これが最初のメッセージです）"
+    parts = []
+    if summary:
+        parts.append(f"（これより前の会話の要約）\n{summary}")
+    if related:
+        parts.append(f"（今回のメッセージに関連する過去の会話）\n{format_turns(related)}")
+        if recent:
+            parts.append("（直近の会話）")
+    if recent:
+        parts.append(format_turns(recent))
+    return "\n".join(parts)
@@ -1,5 +1,11 @@
-from sqlalchemy.orm import Session
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, exists, func, insert, inspect, not_, null, or_, select, true, update
+from sqlalchemy.orm import Session, aliased
 from . import models
+from .profile_render import profile_render_cache
 
 
 def get_user_by_id(db: Session, user_id: int):
@@ -7,6 +13,21 @@ def get_user_by_id(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
 
+def row_by_id_statement(model, entity_id: int, columns: Sequence[str]):
+    """主キーで1行の指定した列だけを取得するクエリ（ORMのエンティティを経由しない読み取り用）"""
+    table = model.__table__
+    return select(*(table.c[name] for name in columns)).where(table.c.id == entity_id)
+
+
+def get_user_row(db: Session, user_id: int, columns: Sequence[str]):
+    """
+    ユーザーの指定した列だけを列名→値のマッピングで取得（存在しない場合は None）
+
+    ORMオブジェクト・identity mapを作らないため、頻繁に呼ばれる読み取り専用のAPIで使う
+    """
+    return db.execute(row_by_id_statement(models.User, user_id, columns)).mappings().first()
+
+
 def get_user_by_auth0_id(db: Session, auth0_id: str):
     """Auth0 IDからユーザー情報を取得"""
     return db.query(models.User).filter(models.User.auth0_id == auth0_id).first()
@@ -29,73 +50,537 @@ def get_conversation(db: Session, user_id: int, target_id: int):
     ).order_by(models.Conversation.created_at.asc()).all()
 
 
+class ReplyContext(NamedTuple):
+    """返信生成に必要なユーザー・ターゲット・直近の会話履歴"""
+    user: Optional[models.User]
+    target: Optional[models.Target]
+    conversations: List[models.Conversation]  # 要約に未取り込みの直近N件（古い順）
+    conversation_count: int  # 会話履歴の総件数
+    summary: Optional[models.ConversationSummary] = None  # 古い会話の要約
+
+
+class SummaryTable:
+    """
+    会話要約のテーブル（conversation_summaries）を使えるかどうか
+
+    スキーマはfront側で管理しているため、テーブルのないDBでは起動時に無効化し、
+    要約なし（トークン予算内の直近の会話のみ）で返信を生成する
+    """
+
+    def __init__(self):
+        self.enabled = True
+
+    def detect(self, connection) -> bool:
+        """DBにテーブルがあるかを確認して有効・無効を切り替える"""
+        self.enabled = inspect(connection).has_table(models.ConversationSummary.__tablename__)
+        return self.enabled
+
+
+summary_table = SummaryTable()
+
+
+def _summarized_clause(user_id: int):
+    """会話が同じユーザー×ターゲットの要約に取り込み済みかどうか（Conversationに相関）"""
+    return exists().where(
+        models.ConversationSummary.user_id == user_id,
+        models.ConversationSummary.target_id == models.Conversation.target_id,
+        or_(
+            models.Conversation.created_at < models.ConversationSummary.last_conversation_created_at,
+            and_(
+                models.Conversation.created_at == models.ConversationSummary.last_conversation_created_at,
+                models.Conversation.id <= models.ConversationSummary.last_conversation_id,
+            ),
+        ),
+    )
+
+
+def _unsummarized_clauses(user_id: int):
+    """要約に未取り込みの会話に絞る条件（要約のテーブルがない場合は絞らない）"""
+    if not summary_table.enabled:
+        return ()
+    return (not_(_summarized_clause(user_id)),)
+
+
+def _summary_column():
+    """会話要約の列（要約のテーブルがない場合はNULL）"""
+    return models.ConversationSummary if summary_table.enabled else null().label("summary")
+
+
+def _outerjoin_summary(statement, user_id: int, target_id):
+    """ユーザー×ターゲットの会話要約を外部結合する（要約のテーブルがない場合は結合しない）"""
+    if not summary_table.enabled:
+        return statement
+    return statement.outerjoin(
+        models.ConversationSummary,
+        and_(
+            models.ConversationSummary.user_id == user_id,
+            models.ConversationSummary.target_id == target_id,
+        ),
+    )
+
+
+def reply_context_statement(user_id: int, target_id: int, limit: int):
+    """
+    ユーザー・ターゲット・会話要約・要約に未取り込みの直近N件の会話履歴・会話総数を
+    1回のSELECTで取得するクエリ
+
+    会話履歴は ORDER BY created_at DESC LIMIT N をDB側で適用し、古い順に並べ直して返す
+    """
+    pair_filter = (
+        models.Conversation.user_id == user_id,
+        models.Conversation.target_id == target_id,
+    )
+    recent = (
+        select(*loaded_columns(models.Conversation))
+        .where(*pair_filter, *_unsummarized_clauses(user_id))
+        .order_by(models.Conversation.created_at.desc(), models.Conversation.id.desc())
+        .limit(limit)
+        .subquery()
+    )
+    recent_conversation = aliased(models.Conversation, recent)
+    conversation_count = (
+        select(func.count(models.Conversation.id)).where(*pair_filter).scalar_subquery()
+    )
+    statement = (
+        select(
+            models.User,
+            models.Target,
+            recent_conversation,
+            conversation_count.label("conversation_count"),
+            _summary_column(),
+        )
+        .select_from(models.User)
+        .outerjoin(models.Target, models.Target.id == target_id)
+    )
+    return (
+        _outerjoin_summary(statement, user_id, target_id)
+        .outerjoin(recent_conversation, true())
+        .where(models.User.id == user_id)
+        .order_by(recent.c.created_at.asc(), recent.c.id.asc())
+    )
+
+
+def build_reply_context(rows) -> ReplyContext:
+    """reply_context_statementの結果行をReplyContextにまとめる"""
+    if not rows:
+        return ReplyContext(user=None, target=None, conversations=[], conversation_count=0)
+    user, target, _, conversation_count, summary = rows[0]
+    conversations = [row[2] for row in rows if row[2] is not None]
+    return ReplyContext(
+        user=user,
+        target=target,
+        conversations=conversations,
+        conversation_count=conversation_count or 0,
+        summary=summary,
+    )
+
+
+def get_reply_context(db: Session, user_id: int, target_id: int, limit: int = 20) -> ReplyContext:
+    """ユーザー・ターゲット・会話要約・直近N件の会話履歴を1往復で取得"""
+    rows = db.execute(reply_context_statement(user_id, target_id, limit)).all()
+    return build_reply_context(rows)
+
+
+def older_unsummarized_statement(
+    user_id: int,
+    target_id: int,
+    before: Tuple[datetime, int],
+    limit: int,
+):
+    """
+    要約に未取り込みで、before（作成日時, ID）より前の会話を古い順にN件取得するクエリ
+
+    直近N件の読み込みから漏れた古い会話を、要約に取り込むために使う
+    """
+    return (
+        select(models.Conversation)
+        .where(
+            models.Conversation.user_id == user_id,
+            models.Conversation.target_id == target_id,
+            *_unsummarized_clauses(user_id),
+            _before_clause(before),
+        )
+        .order_by(models.Conversation.created_at.asc(), models.Conversation.id.asc())
+        .limit(limit)
+    )
+
+
+def get_older_unsummarized_conversations(
+    db: Session,
+    user_id: int,
+    target_id: int,
+    before: Tuple[datetime, int],
+    limit: int,
+) -> List[models.Conversation]:
+    """要約に未取り込みで before より前の会話を古い順にN件取得"""
+    return list(db.scalars(older_unsummarized_statement(user_id, target_id, before, limit)).all())
+
+
+def batch_targets_statement(user_id: int, target_ids: Sequence[int]):
+    """
+    ユーザー・指定したターゲット（ユーザー所有のもののみ）・会話要約・会話総数を1回のSELECTで取得するクエリ
+
+    ユーザーが存在すれば少なくとも1行（ターゲットがなければTarget列がNULL）を返す
+    """
+    conversation_count = (
+        select(func.count(models.Conversation.id))
+        .where(
+            models.Conversation.user_id == user_id,
+            models.Conversation.target_id == models.Target.id,
+        )
+        .scalar_subquery()
+    )
+    statement = (
+        select(models.User, models.Target, _summary_column(), conversation_count.label("conversation_count"))
+        .select_from(models.User)
+        .outerjoin(
+            models.Target,
+            and_(models.Target.user_id == models.User.id, models.Target.id.in_(list(target_ids))),
+        )
+    )
+    return _outerjoin_summary(statement, user_id, models.Target.id).where(models.User.id == user_id)
+
+
+def batch_recent_conversations_statement(user_id: int, target_ids: Sequence[int], limit: int):
+    """
+    複数ターゲットの要約に未取り込みの直近N件の会話履歴を1回のSELECTで取得するクエリ
+
+    ターゲットごとに ROW_NUMBER() で新しい順に番号を振り、N件以内の行をターゲット・古い順に返す
+    """
+    row_number = func.row_number().over(
+        partition_by=models.Conversation.target_id,
+        order_by=(models.Conversation.created_at.desc(), models.Conversation.id.desc()),
+    )
+    ranked = (
+        select(*loaded_columns(models.Conversation), row_number.label("row_number"))
+        .where(
+            models.Conversation.user_id == user_id,
+            models.Conversation.target_id.in_(list(target_ids)),
+            *_unsummarized_clauses(user_id),
+        )
+        .subquery()
+    )
+    ranked_conversation = aliased(models.Conversation, ranked)
+    return (
+        select(ranked_conversation)
+        .where(ranked.c.row_number <= limit)
+        .order_by(ranked.c.target_id, ranked.c.created_at.asc(), ranked.c.id.asc())
+    )
+
+
+def build_batch_reply_contexts(target_rows, conversations) -> Dict[int, ReplyContext]:
+    """batch_targets_statement・batch_recent_conversations_statementの結果をターゲットID別のReplyContextにまとめる"""
+    conversations_by_target: Dict[int, List[models.Conversation]] = {}
+    for conversation in conversations:
+        conversations_by_target.setdefault(conversation.target_id, []).append(conversation)
+    contexts = {}
+    for user, target, summary, conversation_count in target_rows:
+        if target is None:
+            continue
+        contexts[target.id] = ReplyContext(
+            user=user,
+            target=target,
+            conversations=conversations_by_target.get(target.id, []),
+            conversation_count=conversation_count or 0,
+            summary=summary,
+        )
+    return contexts
+
+
+def get_batch_reply_contexts(
+    db: Session,
+    user_id: int,
+    target_ids: Sequence[int],
+    limit: int = 20,
+) -> Tuple[Optional[models.User], Dict[int, ReplyContext]]:
+    """
+    ユーザーと複数ターゲットの返信生成用コンテキストを2往復（プロフィール・会話履歴）で取得
+
+    ユーザーが所有していない・存在しないターゲットは結果のdictに含まれない
+    """
+    target_rows = db.execute(batch_targets_statement(user_id, target_ids)).all()
+    if not target_rows:
+        return None, {}
+    conversations = db.scalars(batch_recent_conversations_statement(user_id, target_ids, limit)).all()
+    return target_rows[0][0], build_batch_reply_contexts(target_rows, conversations)
+
+
+def _before_clause(before: Tuple[datetime, int]):
+    """
+    会話が (created_at, id) より前かどうか
+
+    ORだけでは複合インデックスの範囲にならず、先頭から読み飛ばすため、created_at <= before を先に付ける
+    """
+    before_created_at, before_id = before
+    return and_(
+        models.Conversation.created_at <= before_created_at,
+        or_(
+            models.Conversation.created_at < before_created_at,
+            models.Conversation.id < before_id,
+        ),
+    )
+
+
+def conversation_page_statements(
+    user_id: int,
+    target_id: int,
+    limit: int,
+    before: Optional[Tuple[Optional[datetime], int]] = None,
+):
+    """
+    会話履歴を新しい順にキーセット（created_at, id）でページングするクエリ（先に実行するものから順に）
+
+    created_at が NULL の会話は日時のある会話より古いものとして最後に並べる。
+    複合インデックスの順に読めるよう、日時のある会話と NULL の会話（id順）を別のクエリで取得する。
+    beforeには前ページ最後の行の (created_at, id) を渡す。次ページ有無の判定用にそれぞれlimit+1件取得する
+    """
+    pair = (
+        models.Conversation.user_id == user_id,
+        models.Conversation.target_id == target_id,
+    )
+    statements = []
+    before_created_at = before[0] if before is not None else None
+    if before is None or before_created_at is not None:
+        dated = select(models.Conversation).where(*pair, models.Conversation.created_at.is_not(None))
+        if before is not None and before_created_at is not None:
+            dated = dated.where(_before_clause((before_created_at, before[1])))
+        statements.append(dated.order_by(
+            models.Conversation.created_at.desc(), models.Conversation.id.desc()
+        ).limit(limit + 1))
+    undated = select(models.Conversation).where(*pair, models.Conversation.created_at.is_(None))
+    if before is not None and before[0] is None:
+        undated = undated.where(models.Conversation.id < before[1])
+    statements.append(undated.order_by(models.Conversation.id.desc()).limit(limit + 1))
+    return statements
+
+
+def get_conversation_page(
+    db: Session,
+    user_id: int,
+    target_id: int,
+    limit: int = 20,
+    before: Optional[Tuple[Optional[datetime], int]] = None,
+) -> Tuple[List[models.Conversation], bool]:
+    """会話履歴を新しい順に1ページ分取得し、(会話リスト, 次ページ有無) を返す"""
+    rows: List[models.Conversation] = []
+    for statement in conversation_page_statements(user_id, target_id, limit, before):
+        rows.extend(db.scalars(statement).all())
+        if len(rows) > limit:
+            break
+    return rows[:limit], len(rows) > limit
+
+
+def loaded_columns(model):
+    """
+    モデルの遅延読み込みでない列（ORMのエンティティとして読み込む・RETURNINGで返す列）
+
+    会話の埋め込みの列は関連会話の検索を有効にしたDBにしかないため、明示的に指定した場合だけ参照する
+    """
+    return [prop.columns[0] for prop in inspect(model).column_attrs if not prop.deferred]
+
+
+def column_values(model, values: dict) -> dict:
+    """モデルの列に対応する項目だけを取り出す（列にない項目は無視する）"""
+    columns = model.__table__.columns.keys()
+    return {key: value for key, value in values.items() if key in columns}
+
+
+def insert_returning_statement(model, values: dict):
+    """1行をINSERTし、作成した行をそのまま返すクエリ（INSERT ... RETURNING）"""
+    statement = insert(model).values(**column_values(model, values)).returning(*loaded_columns(model))
+    return select(model).from_statement(statement)
+
+
+def update_returning_statement(model, entity_id: int, values: dict):
+    """
+    主キー指定で1行をUPDATEし、更新後の行を返すクエリ（UPDATE ... RETURNING）
+
+    事前のSELECTは行わず、該当行がなければ0行を返す。セッション内の同じ行も返した値で上書きする
+    """
+    statement = (
+        update(model)
+        .where(model.id == entity_id)
+        .values(**column_values(model, values))
+        .returning(*loaded_columns(model))
+    )
+    return select(model).from_statement(statement).execution_options(populate_existing=True)
+
 
 def create_user(db: Session, auth0_id: str, name: str, email: str, **kwargs):
     """新規ユーザーを作成"""
-    db_user = models.User(auth0_id=auth0_id, name=name, email=email, **kwargs)
-    db.add(db_user)
+    db_user = db.scalar(insert_returning_statement(
+        models.User, dict(kwargs, auth0_id=auth0_id, name=name, email=email)
+    ))
     db.commit()
-    db.refresh(db_user)
     return db_user
 
 
 def create_target(db: Session, user_id: int, name: str, **kwargs):
     """新規ターゲットを作成"""
-    db_target = models.Target(
-        user_id=user_id,
-        name=name,
-        **kwargs
-    )
-    db.add(db_target)
+    db_target = db.scalar(insert_returning_statement(
+        models.Target, dict(kwargs, user_id=user_id, name=name)
+    ))
     db.commit()
-    db.refresh(db_target)
     return db_target
 
 
 def update_user(db: Session, user_id: int, **kwargs):
-    """ユーザー情報を更新"""
-    db_user = get_user_by_id(db, user_id)
-    if not db_user:
-        return None
-    
-    for key, value in kwargs.items():
-        if hasattr(db_user, key):
-            setattr(db_user, key, value)
-    
+    """ユーザー情報を更新（ユーザーが存在しない場合は None）"""
+    if not column_values(models.User, kwargs):
+        return get_user_by_id(db, user_id)
+    db_user = db.scalar(update_returning_statement(models.User, user_id, kwargs))
     db.commit()
-    db.refresh(db_user)
+    if db_user is not None:
+        # 描画済みプロフィールを破棄（次の生成時に描画し直す）
+        profile_render_cache.invalidate("user", user_id)
     return db_user
 
 
 def update_target(db: Session, target_id: int, **kwargs):
-    """ターゲット情報を更新"""
-    db_target = get_target_by_id(db, target_id)
-    if not db_target:
-        return None
-    
-    for key, value in kwargs.items():
-        if hasattr(db_target, key):
-            setattr(db_target, key, value)
-    
+    """ターゲット情報を更新（ターゲットが存在しない場合は None）"""
+    if not column_values(models.Target, kwargs):
+        return get_target_by_id(db, target_id)
+    db_target = db.scalar(update_returning_statement(models.Target, target_id, kwargs))
     db.commit()
-    db.refresh(db_target)
+    if db_target is not None:
+        # 描画済みプロフィールを破棄（次の生成時に描画し直す）
+        profile_render_cache.invalidate("target", target_id)
     return db_target
 
 
-def create_conversation(db: Session, user_id: int, target_id: int, female_message: str, male_reply: str):
-    """新規会話を作成"""
-    db_conversation = models.Conversation(
-        user_id=user_id,
-        target_id=target_id,
-        female_message=female_message,
-        male_reply=male_reply
-    )
-    db.add(db_conversation)
+def create_conversation(
+    db: Session,
+    user_id: int,
+    target_id: int,
+    female_message: str,
+    male_reply: str,
+    embedding: Optional[Sequence[float]] = None,
+):
+    """新規会話を作成（embedding未指定の場合は関連会話の検索時に補完される）"""
+    values = {
+        "user_id": user_id,
+        "target_id": target_id,
+        "female_message": female_message,
+        "male_reply": male_reply,
+    }
+    if embedding is not None:
+        values["embedding"] = embedding
+    db_conversation = db.scalar(insert_returning_statement(models.Conversation, values))
     db.commit()
-    db.refresh(db_conversation)
     return db_conversation
 
 
+class ImportTurn(NamedTuple):
+    """一括取り込みする会話1往復"""
+    female_message: str
+    male_reply: str
+    created_at: Optional[datetime] = None  # 未指定の場合は取り込み時刻（リクエスト内の順序を保つ）
+
+
+class ConversationImportPlan(NamedTuple):
+    rows: List[dict]  # INSERTする行（古い順）
+    skipped: int  # 重複として取り込まなかった件数
+
+
+def existing_turns_statement(user_id: int, target_id: int, female_messages: Sequence[str]):
+    """重複判定用に、同じ女性メッセージを持つ既存の会話の (female_message, male_reply, created_at) を取得するクエリ"""
+    return select(
+        models.Conversation.female_message,
+        models.Conversation.male_reply,
+        models.Conversation.created_at,
+    ).where(
+        models.Conversation.user_id == user_id,
+        models.Conversation.target_id == target_id,
+        models.Conversation.female_message.in_(sorted(set(female_messages))),
+    )
+
+
+def _naive_utc(value: datetime) -> datetime:
+    """タイムゾーン付きの日時をDBの形式（タイムゾーンなしのUTC）に揃える"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def plan_conversation_import(
+    user_id: int,
+    target_id: int,
+    turns: Sequence[ImportTurn],
+    existing_rows: Optional[Sequence[Tuple[str, str, Optional[datetime]]]] = None,
+    now: Optional[datetime] = None,
+) -> ConversationImportPlan:
+    """
+    取り込む会話をINSERT用の行にする
+
+    existing_rowsを渡すと、既存の会話・リクエスト内の先行する会話と重複するものを除く（Noneの場合は重複判定しない）。
+    日時を指定した会話は (女性メッセージ, 返信, 日時)、指定しない会話は (女性メッセージ, 返信) で判定する
+    """
+    now = now or datetime.utcnow()
+    dedup = existing_rows is not None
+    seen_with_time = {(f, m, c) for f, m, c in existing_rows or ()}
+    seen = {(f, m) for f, m, _ in existing_rows or ()}
+    rows: List[dict] = []
+    skipped = 0
+    for index, turn in enumerate(turns):
+        created_at = _naive_utc(turn.created_at) if turn.created_at else None
+        if created_at is not None:
+            duplicate = (turn.female_message, turn.male_reply, created_at) in seen_with_time
+        else:
+            duplicate = (turn.female_message, turn.male_reply) in seen
+        if dedup and duplicate:
+            skipped += 1
+            continue
+        if created_at is None:
+            created_at = now + timedelta(microseconds=index)
+        seen_with_time.add((turn.female_message, turn.male_reply, created_at))
+        seen.add((turn.female_message, turn.male_reply))
+        rows.append({
+            "user_id": user_id,
+            "target_id": target_id,
+            "female_message": turn.female_message,
+            "male_reply": turn.male_reply,
+            "created_at": created_at,
+            "updated_at": now,
+        })
+    rows.sort(key=lambda row: row["created_at"])
+    return ConversationImportPlan(rows=rows, skipped=skipped)
+
+
+def summary_outdated(db_summary: Optional[models.ConversationSummary], rows: Sequence[dict]) -> bool:
+    """要約済みの位置より古い会話を取り込むかどうか（その場合は要約を作り直す）"""
+    if db_summary is None or not rows:
+        return False
+    return rows[0]["created_at"] < db_summary.last_conversation_created_at
+
+
+def import_conversations(
+    db: Session,
+    user_id: int,
+    target_id: int,
+    turns: Sequence[ImportTurn],
+    dedup: bool = True,
+) -> ConversationImportPlan:
+    """
+    会話をまとめて取り込む（1トランザクション・まとめてINSERT）
+
+    要約済みの位置より古い会話を取り込んだ場合は、次回の返信生成で要約を作り直すよう要約を削除する
+    """
+    existing_rows = None
+    if dedup:
+        existing_rows = db.execute(
+            existing_turns_statement(user_id, target_id, [turn.female_message for turn in turns])
+        ).all()
+    plan = plan_conversation_import(user_id, target_id, turns, existing_rows)
+    if plan.rows:
+        db.execute(insert(models.Conversation), plan.rows)
+        if summary_table.enabled:
+            db_summary = db.scalar(conversation_summary_statement(user_id, target_id))
+            if summary_outdated(db_summary, plan.rows):
+                db.delete(db_summary)
+    db.commit()
+    return plan
+
+
 def get_conversations(db: Session, user_id: int, target_id: int):
     """ユーザーとターゲット間の会話履歴を取得"""
     return db.query(models.Conversation).filter(
@@ -106,4 +591,165 @@ def get_conversations(db: Session, user_id: int, target_id: int):
 
 def get_conversation_by_id(db: Session, conversation_id: int):
     """会話IDから会話情報を取得"""
-    return db.query(models.Conversation).filter(models.Conversation.id == conversation_id).first()
\ No newline at end of file
+    return db.query(models.Conversation).filter(models.Conversation.id == conversation_id).first()
+
+
+def related_conversations_statement(
+    user_id: int,
+    target_id: int,
+    query_embedding: Sequence[float],
+    limit: int,
+    before: Optional[Tuple[datetime, int]] = None,
+):
+    """
+    埋め込みのコサイン距離が近い順に会話をlimit件取得するクエリ（pgvector）
+
+    全ユーザー共通の近似インデックス（HNSW等）では、走査した候補からユーザー×ターゲットで絞るため
+    件数の少ない組の会話がほとんど返らない。1組の会話は少ないので、複合インデックスで組の会話を読み、
+    全件の距離を計算して正確な上位limit件を返す（MATERIALIZEDで近似インデックスを使わせない）。
+    beforeには逐語で含める直近の会話のうち最も古いものの (created_at, id) を渡し、それより前の会話に限る
+    """
+    distance = models.Conversation.embedding.cosine_distance(query_embedding).label("distance")
+    query = select(*loaded_columns(models.Conversation), distance).where(
+        models.Conversation.user_id == user_id,
+        models.Conversation.target_id == target_id,
+        models.Conversation.embedding.is_not(None),
+    )
+    if before is not None:
+        query = query.where(_before_clause(before))
+    candidates = query.cte("related_candidates").prefix_with("MATERIALIZED")
+    related = aliased(models.Conversation, candidates)
+    return select(related).order_by(candidates.c.distance, candidates.c.id).limit(limit)
+
+
+def embedding_candidates_statement(
+    user_id: int,
+    target_id: int,
+    before: Optional[Tuple[datetime, int]] = None,
+):
+    """pgvectorを使えないDB（SQLiteでの開発・テスト）向けに、埋め込み済みの会話を埋め込みごと取得するクエリ"""
+    query = select(models.Conversation, models.Conversation.embedding).where(
+        models.Conversation.user_id == user_id,
+        models.Conversation.target_id == target_id,
+        models.Conversation.embedding.is_not(None),
+    )
+    if before is not None:
+        query = query.where(_before_clause(before))
+    return query
+
+
+def rank_by_cosine_distance(rows, query_embedding: Sequence[float], limit: int) -> List[models.Conversation]:
+    """embedding_candidates_statementの結果行をコサイン距離が近い順にlimit件並べる"""
+    query_norm = math.sqrt(sum(value * value for value in query_embedding)) or 1.0
+
+    def distance(embedding) -> float:
+        norm = math.sqrt(sum(float(value) * float(value) for value in embedding)) or 1.0
+        dot = sum(float(a) * b for a, b in zip(embedding, query_embedding))
+        return 1.0 - dot / (norm * query_norm)
+
+    ranked = sorted(rows, key=lambda row: distance(row[1]))
+    return [row[0] for row in ranked[:limit]]
+
+
+def get_related_conversations(
+    db: Session,
+    user_id: int,
+    target_id: int,
+    query_embedding: Sequence[float],
+    limit: int,
+    before: Optional[Tuple[datetime, int]] = None,
+) -> List[models.Conversation]:
+    """query_embeddingに近い会話をlimit件取得（近い順）"""
+    if db.get_bind().dialect.name == "postgresql":
+        return list(db.scalars(
+            related_conversations_statement(user_id, target_id, query_embedding, limit, before)
+        ).all())
+    rows = db.execute(embedding_candidates_statement(user_id, target_id, before)).all()
+    return rank_by_cosine_distance(rows, query_embedding, limit)
+
+
+def missing_embeddings_statement(user_id: int, target_id: int, limit: int):
+    """埋め込みが未計算の会話を古い順にlimit件取得するクエリ（検索対象になる古い会話から補完する）"""
+    return (
+        select(models.Conversation)
+        .where(
+            models.Conversation.user_id == user_id,
+            models.Conversation.target_id == target_id,
+            models.Conversation.embedding.is_(None),
+        )
+        .order_by(models.Conversation.created_at, models.Conversation.id)
+        .limit(limit)
+    )
+
+
+def get_conversations_missing_embedding(db: Session, user_id: int, target_id: int, limit: int):
+    """埋め込みが未計算の会話を古い順に取得"""
+    return list(db.scalars(missing_embeddings_statement(user_id, target_id, limit)).all())
+
+
+def update_conversation_embeddings(db: Session, embeddings: Dict[int, Sequence[float]]) -> None:
+    """会話IDごとの埋め込みをまとめて保存（主キー指定の一括UPDATE）"""
+    if not embeddings:
+        return
+    db.execute(
+        update(models.Conversation),
+        [{"id": conversation_id, "embedding": embedding} for conversation_id, embedding in embeddings.items()],
+    )
+    db.commit()
+
+
+def conversation_summary_statement(user_id: int, target_id: int):
+    return select(models.ConversationSummary).where(
+        models.ConversationSummary.user_id == user_id,
+        models.ConversationSummary.target_id == target_id,
+    )
+
+
+def apply_conversation_summary(
+    db_summary: Optional[models.ConversationSummary],
+    user_id: int,
+    target_id: int,
+    summary: str,
+    last_conversation: models.Conversation,
+) -> Optional[models.ConversationSummary]:
+    """
+    要約と取り込み済み位置を既存行に反映するか新規行を作成する
+
+    既存の取り込み位置より古い会話までの要約（並行リクエストによる巻き戻り）は反映しない
+    """
+    if last_conversation.created_at is None:
+        # 作成日時のない会話は取り込み位置にできないため、要約を保存しない（次回の生成で取り込み直す）
+        return None
+    watermark = (last_conversation.created_at, last_conversation.id)
+    if db_summary is None:
+        return models.ConversationSummary(
+            user_id=user_id,
+            target_id=target_id,
+            summary=summary,
+            last_conversation_created_at=watermark[0],
+            last_conversation_id=watermark[1],
+        )
+    if watermark <= (db_summary.last_conversation_created_at, db_summary.last_conversation_id):
+        return None
+    db_summary.summary = summary
+    db_summary.last_conversation_created_at = watermark[0]
+    db_summary.last_conversation_id = watermark[1]
+    return db_summary
+
+
+def upsert_conversation_summary(
+    db: Session,
+    user_id: int,
+    target_id: int,
+    summary: str,
+    last_conversation: models.Conversation,
+):
+    """ユーザー×ターゲットの会話要約を作成・更新（last_conversationまでを取り込み済みとする）"""
+    db_summary = db.scalar(conversation_summary_statement(user_id, target_id))
+    updated = apply_conversation_summary(db_summary, user_id, target_id, summary, last_conversation)
+    if updated is None:
+        return db_summary
+    db.add(updated)
+    db.commit()
+    db.refresh(updated)
+    return updated
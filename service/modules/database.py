@@ -1,20 +1,157 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from pgvector.asyncpg import register_vector  # type: ignore[import-untyped]
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://localhost/motemesse")
 
+
+def to_async_database_url(url: str) -> str:
+    """同期ドライバのDB URLを非同期ドライバ（asyncpg / aiosqlite）のURLに変換"""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+
+# 非同期エンジン用URL（未指定の場合はDATABASE_URLから導出）
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_database_url(DATABASE_URL))
+
 # テスト用フラグ
 MOCK_DB = os.getenv("MOCK_DB", "false").lower() == "true"
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# コネクションプール設定（ワーカー数×(POOL_SIZE+MAX_OVERFLOW) がDBの接続上限を超えないよう調整する）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+
+class PoolMetrics:
+    """コネクション取得の待ち時間・タイムアウト回数の集計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """コネクション取得の待ち時間を計測するQueuePool"""
+
+    metrics = pool_metrics
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """非同期エンジン用の計測付きQueuePool"""
 
-Base = declarative_base()
+    metrics = async_pool_metrics
+
+
+if DATABASE_URL.startswith("sqlite"):
+    engine = create_engine(DATABASE_URL)
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+# コミット後に属性を失効させない（書き込み後の再読み込みのSELECTを省く。書き込みはRETURNINGで最新の値を受け取る）
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
+
+# 非同期ルート用のエンジン（同期エンジンはスクリプト等から引き続き利用する）
+if ASYNC_DATABASE_URL.startswith("sqlite"):
+    async_engine = create_async_engine(ASYNC_DATABASE_URL)
+else:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _register_vector_type(dbapi_connection, connection_record):
+        """asyncpgにpgvectorのvector型を登録（拡張が未導入のDBでは関連会話の検索以外はそのまま使える）"""
+        try:
+            dbapi_connection.run_async(register_vector)
+        except Exception as e:
+            logger.warning("pgvectorの型登録に失敗: %s", str(e))
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+def _pool_stats(pool, metrics: PoolMetrics) -> dict:
+    stats = {
+        "poolClass": type(pool).__name__,
+        "checkouts": metrics.checkouts,
+        "timeouts": metrics.timeouts,
+        "waitSecondsTotal": metrics.wait_seconds_total,
+        "waitSecondsMax": metrics.wait_seconds_max,
+    }
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checkedIn": pool.checkedin(),
+            "checkedOut": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "maxOverflow": DB_MAX_OVERFLOW,
+            "timeoutSeconds": DB_POOL_TIMEOUT,
+        })
+    return stats
+
+
+def get_pool_stats() -> dict:
+    """同期・非同期エンジンのコネクションプールの状態と取得待ち時間の統計"""
+    return {
+        "sync": _pool_stats(engine.pool, pool_metrics),
+        "async": _pool_stats(async_engine.pool, async_pool_metrics),
+    }
 
 
 def get_db():
@@ -26,4 +163,13 @@ def get_db():
         try:
             yield db
         finally:
-            db.close()
\ No newline at end of file
+            db.close()
+
+
+async def get_async_db():
+    if MOCK_DB:
+        # モックDB（実際には何も返さない）
+        yield None
+    else:
+        async with AsyncSessionLocal() as db:
+            yield db
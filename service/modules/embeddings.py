@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import math
+import os
+from typing import List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+from .conversation_history import count_tokens
+from .models import EMBEDDING_DIMENSIONS
+from .openai_client import create_async_http_client
+from .upstream import upstream
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 埋め込みの計算方法: none（関連会話の検索を行わない）/ openai / local（外部APIを使わない開発・テスト用）
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "none").lower()
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_TIMEOUT_SECONDS", "10"))
+
+
+def embedding_text(female_message: str, male_reply: str) -> str:
+    """1往復の会話を埋め込み対象のテキストにする（プロンプトの会話履歴と同じ形式）"""
+    return f"彼女: {female_message}\nあなた: {male_reply}"
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm else vector
+
+
+class LocalHashEmbedder:
+    """
+    外部APIを使わない決定的な埋め込み（開発・テスト用）
+
+    文字bigramをハッシュして次元に割り振るため、文字列が似ていれば近いベクトルになる
+    """
+
+    name = "local"
+    model = "local-hash"
+
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def _embed_one(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for i in range(max(len(text) - 1, 1)):
+            digest = hashlib.blake2b(text[i:i + 2].encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dimensions] += 1.0 if value & (1 << 63) else -1.0
+        return _normalize(vector)
+
+    async def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        return [self._embed_one(text) for text in texts]
+
+    async def aclose(self) -> None:
+        pass
+
+
+class OpenAIEmbedder:
+    """OpenAIのEmbeddings API（共有スケジューラの実行枠内で、複数テキストを1回で計算）"""
+
+    name = "openai"
+    model = EMBEDDING_MODEL
+
+    def __init__(self, api_key: Optional[str], dimensions: int = EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            http_client=create_async_http_client(EMBEDDING_TIMEOUT_SECONDS),
+            # 再試行は共有スケジューラ（upstream.py）で行う
+            max_retries=0,
+        )
+
+    async def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        estimated_tokens = sum(count_tokens(text, self.model) for text in texts)
+
+        async def create():
+            return await self.client.embeddings.create(
+                model=self.model, input=list(texts), dimensions=self.dimensions
+            )
+
+        response = await upstream.run(self.model, estimated_tokens, create)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    async def aclose(self) -> None:
+        await self.client.close()
+
+
+def create_embedder_from_env():
+    """EMBEDDING_BACKEND に応じた埋め込みの計算器（none の場合は None）"""
+    if EMBEDDING_BACKEND == "openai":
+        return OpenAIEmbedder(os.getenv("OPENAI_API_KEY"))
+    if EMBEDDING_BACKEND == "local":
+        return LocalHashEmbedder()
+    if EMBEDDING_BACKEND != "none":
+        logger.warning("未知のEMBEDDING_BACKEND=%s のため関連会話の検索を無効化", EMBEDDING_BACKEND)
+    return None
+
+
+embedder = create_embedder_from_env()
+
+
+async def close_embedder() -> None:
+    if embedder is not None:
+        await embedder.aclose()
+
+
+# 1回の埋め込み計算にまとめるテキストの件数
+EMBEDDING_BATCH_SIZE = 256
+
+
+async def embed_conversations(turns: Sequence[Tuple[str, str]]) -> List[Optional[List[float]]]:
+    """
+    (女性メッセージ, 返信) ごとの埋め込みを計算する（無効化されている場合・失敗した場合は None）
+
+    Noneの会話は関連会話の検索時に少しずつ補完される
+    """
+    if embedder is None:
+        return [None] * len(turns)
+    texts = [embedding_text(female_message, male_reply) for female_message, male_reply in turns]
+    embeddings: List[Optional[List[float]]] = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+        try:
+            embeddings.extend(await embedder.embed(batch))
+        except Exception as e:
+            logger.warning("会話の埋め込みの計算に失敗（検索時に補完）: %s", str(e))
+            embeddings.extend([None] * len(batch))
+    return embeddings
+
+
+async def embed_conversation(female_message: str, male_reply: str) -> Optional[List[float]]:
+    """会話1往復の埋め込みを計算する（無効化されている場合・失敗した場合は None）"""
+    [embedding] = await embed_conversations([(female_message, male_reply)])
+    return embedding
@@ -0,0 +1,245 @@
+import asyncio
+import base64
+import binascii
+import io
+import logging
+import math
+import os
+import threading
+from dataclasses import dataclass
+from typing import BinaryIO, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# OpenAI Visionの画像トークン計算ルール（detail=high）
+# 2048x2048に収まるよう縮小 → 短辺768pxに縮小 → 512pxタイル数 × 170 + 85トークン
+VISION_MAX_SIDE = 2048
+VISION_SHORT_SIDE = 768
+VISION_TILE_SIZE = 512
+VISION_BASE_TOKENS = 85
+VISION_TILE_TOKENS = 170
+
+# 1画像あたりのタイル数上限（トークンコストの上限）と再圧縮品質
+VISION_MAX_TILES = int(os.getenv("VISION_MAX_TILES", "6"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+
+
+@dataclass
+class PreprocessedImage:
+    """Vision APIに渡す前処理済み画像と、前処理による削減量"""
+    data_url: str
+    detail: str
+    width: int
+    height: int
+    original_bytes: int
+    processed_bytes: int
+    original_tokens: int
+    processed_tokens: int
+
+
+class PreprocessStats:
+    """前処理で削減したバイト数・推定トークン数の累計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.original_bytes = 0
+        self.processed_bytes = 0
+        self.original_tokens = 0
+        self.processed_tokens = 0
+
+    def record(self, image: PreprocessedImage) -> None:
+        with self._lock:
+            self.images += 1
+            self.original_bytes += image.original_bytes
+            self.processed_bytes += image.processed_bytes
+            self.original_tokens += image.original_tokens
+            self.processed_tokens += image.processed_tokens
+
+
+preprocess_stats = PreprocessStats()
+
+
+def _model_resize(width: int, height: int) -> Tuple[float, float]:
+    """detail=high時にモデル側で行われる縮小後のサイズ"""
+    scale = min(1.0, VISION_MAX_SIDE / max(width, height))
+    scaled_width, scaled_height = width * scale, height * scale
+    scale = min(1.0, VISION_SHORT_SIDE / min(scaled_width, scaled_height))
+    return scaled_width * scale, scaled_height * scale
+
+
+def _tiles(width: float, height: float) -> int:
+    return math.ceil(width / VISION_TILE_SIZE) * math.ceil(height / VISION_TILE_SIZE)
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """画像サイズとdetailから入力トークン数を見積もる"""
+    if detail == "low":
+        return VISION_BASE_TOKENS
+    return VISION_BASE_TOKENS + VISION_TILE_TOKENS * _tiles(*_model_resize(width, height))
+
+
+def target_size(width: int, height: int, max_tiles: int = VISION_MAX_TILES) -> Tuple[int, int]:
+    """
+    モデル側の縮小ルールを先に適用し、さらにタイル数がmax_tiles以下になるまで縮小したサイズ
+
+    縮小幅が最小になるよう、列数・行数のどちらか一方を1つ減らす候補のうち大きい方の倍率を選ぶ
+    """
+    w, h = _model_resize(width, height)
+    while _tiles(w, h) > max_tiles:
+        columns = math.ceil(w / VISION_TILE_SIZE)
+        rows = math.ceil(h / VISION_TILE_SIZE)
+        candidates = []
+        if columns > 1:
+            candidates.append((columns - 1) * VISION_TILE_SIZE / w)
+        if rows > 1:
+            candidates.append((rows - 1) * VISION_TILE_SIZE / h)
+        if not candidates:
+            break
+        scale = max(candidates)
+        w, h = w * scale, h * scale
+    return max(1, int(w)), max(1, int(h))
+
+
+def choose_detail(width: int, height: int) -> str:
+    """512px以下の画像はlowでも情報が落ちないためlowを選ぶ"""
+    if max(width, height) <= VISION_TILE_SIZE:
+        return "low"
+    return "high"
+
+
+def decode_image_payload(payload: str) -> bytes:
+    """data URL（data:image/...;base64,...）または素のBase64文字列をバイト列に変換"""
+    if payload.startswith("data:"):
+        payload = payload.split(",", 1)[1]
+    return base64.b64decode(payload)
+
+
+def _to_data_url(data: bytes, mime_type: str) -> str:
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def _encode(image: Image.Image, image_format: str, **params) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **params)
+    return buffer.getvalue()
+
+
+def preprocess_image_file(file: BinaryIO, max_tiles: int = VISION_MAX_TILES) -> PreprocessedImage:
+    """
+    画像をデコードし、Visionのタイル予算に合わせて縮小・JPEG再圧縮する
+
+    縮小不要かつ再圧縮で小さくならない場合は元の画像をそのまま使う
+    """
+    file.seek(0, os.SEEK_END)
+    original_size = file.tell()
+    file.seek(0)
+    image: Image.Image = Image.open(file)
+    original_format = image.format
+    image = ImageOps.exif_transpose(image)
+    original_width, original_height = image.size
+    width, height = target_size(original_width, original_height, max_tiles)
+    resized = (width, height) != (original_width, original_height)
+
+    if resized:
+        image = image.resize((width, height), Image.Resampling.LANCZOS)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    processed = _encode(image, "JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    mime_type = "image/jpeg"
+    if original_format == "PNG" and resized:
+        # 文字主体のスクリーンショットはPNGの方が小さくなる場合がある
+        png = _encode(image, "PNG", optimize=True)
+        if len(png) < len(processed):
+            processed, mime_type = png, "image/png"
+
+    if not resized and len(processed) >= original_size:
+        file.seek(0)
+        processed = file.read()
+        mime_type = Image.MIME.get(original_format or "", "image/jpeg")
+
+    detail = choose_detail(width, height)
+    return PreprocessedImage(
+        data_url=_to_data_url(processed, mime_type),
+        detail=detail,
+        width=width,
+        height=height,
+        original_bytes=original_size,
+        processed_bytes=len(processed),
+        original_tokens=estimate_image_tokens(original_width, original_height),
+        processed_tokens=estimate_image_tokens(width, height, detail),
+    )
+
+
+def preprocess_image_bytes(raw: bytes, max_tiles: int = VISION_MAX_TILES) -> PreprocessedImage:
+    """バイト列の画像を前処理する"""
+    return preprocess_image_file(io.BytesIO(raw), max_tiles)
+
+
+def preprocess_image(payload: str, max_tiles: int = VISION_MAX_TILES) -> PreprocessedImage:
+    """Base64画像を前処理する（デコードできない画像は元のまま返す）"""
+    try:
+        raw = decode_image_payload(payload)
+        processed = preprocess_image_bytes(raw, max_tiles)
+    except (binascii.Error, ValueError, UnidentifiedImageError, OSError) as e:
+        logger.warning("画像の前処理をスキップしました: %s", str(e))
+        size = len(payload)
+        processed = PreprocessedImage(
+            data_url=payload, detail="high", width=0, height=0,
+            original_bytes=size, processed_bytes=size, original_tokens=0, processed_tokens=0,
+        )
+    preprocess_stats.record(processed)
+    return processed
+
+
+async def preprocess_images(payloads: List[str], max_tiles: int = VISION_MAX_TILES) -> List[PreprocessedImage]:
+    """複数画像の前処理をスレッドプールで並列実行（CPU処理でイベントループを止めない）"""
+    return list(await asyncio.gather(
+        *(asyncio.to_thread(preprocess_image, payload, max_tiles) for payload in payloads)
+    ))
+
+
+def preprocess_upload(file: BinaryIO, content_type: Optional[str], max_tiles: int = VISION_MAX_TILES) -> PreprocessedImage:
+    """
+    アップロードされた画像ファイルをBase64を経由せずに前処理する（デコードできない画像は元のまま返す）
+    """
+    try:
+        processed = preprocess_image_file(file, max_tiles)
+    except (ValueError, UnidentifiedImageError, OSError) as e:
+        logger.warning("画像の前処理をスキップしました: %s", str(e))
+        file.seek(0)
+        raw = file.read()
+        processed = PreprocessedImage(
+            data_url=_to_data_url(raw, content_type or "image/jpeg"), detail="high", width=0, height=0,
+            original_bytes=len(raw), processed_bytes=len(raw), original_tokens=0, processed_tokens=0,
+        )
+    preprocess_stats.record(processed)
+    return processed
+
+
+async def preprocess_uploads(
+    files: List[Tuple[BinaryIO, Optional[str]]], max_tiles: int = VISION_MAX_TILES
+) -> List[PreprocessedImage]:
+    """アップロード画像 (ファイル, Content-Type) の前処理をスレッドプールで並列実行"""
+    return list(await asyncio.gather(
+        *(asyncio.to_thread(preprocess_upload, file, content_type, max_tiles) for file, content_type in files)
+    ))
+
+
+def summarize(images: List[PreprocessedImage]) -> str:
+    """前処理による削減量のログ用サマリ"""
+    original_bytes = sum(image.original_bytes for image in images)
+    processed_bytes = sum(image.processed_bytes for image in images)
+    original_tokens = sum(image.original_tokens for image in images)
+    processed_tokens = sum(image.processed_tokens for image in images)
+    return (
+        f"{len(images)}枚 bytes {original_bytes} -> {processed_bytes} "
+        f"({processed_bytes - original_bytes:+d}), "
+        f"推定画像トークン {original_tokens} -> {processed_tokens} "
+        f"({processed_tokens - original_tokens:+d})"
+    )
@@ -0,0 +1,66 @@
+import json
+from typing import Any, Dict, List
+
+# 取り出す配列要素の親（トップレベルオブジェクト直下の配列・トップレベルの配列）
+_ITEM_PARENTS = (["{", "["], ["["])
+
+
+class IncrementalJsonArrayParser:
+    """
+    LLMのトークンストリームとして届くJSONテキストを逐次走査し、
+    トップレベルオブジェクト直下の配列要素（例: {"replies": [{...}, {...}]} の各要素）、
+    またはトップレベルの配列の要素（例: [{...}, {...}]）が閉じた時点で1件ずつ取り出すパーサー
+
+    JSON開始前の前置き（```json など）は読み飛ばす
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._item_start = None
+
+    @property
+    def text(self) -> str:
+        """これまでに受け取ったテキスト全体"""
+        return self._text
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """チャンクを追加し、新たに完成した配列要素を返す"""
+        self._text += chunk
+        items: List[Dict[str, Any]] = []
+        text = self._text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if not self._stack and ch not in "{[":
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if ch == "{" and self._stack in _ITEM_PARENTS:
+                    self._item_start = i
+                self._stack.append(ch)
+            elif ch in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if ch == "}" and self._stack in _ITEM_PARENTS and self._item_start is not None:
+                    try:
+                        item = json.loads(text[self._item_start:i + 1])
+                    except ValueError:
+                        item = None
+                    if isinstance(item, dict):
+                        items.append(item)
+                    self._item_start = None
+        self._pos = len(text)
+        return items
@@ -0,0 +1,39 @@
+import logging
+import os
+import random
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# WARNING未満のログを出力する割合（0.0〜1.0）。高負荷時にINFO/DEBUGログの量を抑える
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+
+class SamplingFilter(logging.Filter):
+    """WARNING以上は常に通し、それ未満は sample_rate の割合だけ通す"""
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.sample_rate >= 1.0:
+            return True
+        return random.random() < self.sample_rate
+
+
+class ServiceLogHandler(logging.StreamHandler):
+    """setup_logging が追加するハンドラ（複数回呼ばれたときの重複追加の判定に使う）"""
+
+
+def setup_logging(level: str = LOG_LEVEL, sample_rate: float = LOG_SAMPLE_RATE) -> None:
+    """service パッケージのロガーにレベル・サンプリング付きのハンドラを設定（複数回呼んでも1つだけ）"""
+    logger = logging.getLogger("service")
+    logger.setLevel(level)
+    logger.propagate = False
+    if any(isinstance(handler, ServiceLogHandler) for handler in logger.handlers):
+        return
+    handler = ServiceLogHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(SamplingFilter(sample_rate))
+    logger.addHandler(handler)
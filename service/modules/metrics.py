@@ -0,0 +1,357 @@
+import bisect
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# フェーズ所要時間のヒストグラムのバケット（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+# (ラベル, 値) の組。/metrics 出力時に外部の統計を変換するのに使う
+Sample = Tuple[Dict[str, str], float]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """ラベルごとに単調増加する値（Prometheusのcounter）"""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """ラベルごとの観測値の分布（Prometheusのhistogram）"""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # ラベルごとに [バケット別件数..., +Inf件数], 合計, 件数
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, totals = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+            counts[index] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(counts), list(totals))) for key, (counts, totals) in self._values.items())
+        for key, (counts, (total, count)) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {int(count)}")
+        return lines
+
+
+def render_gauge(name: str, help_text: str, samples: Iterable[Sample]) -> List[str]:
+    """外部の統計値をgaugeとして出力する"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+    return lines
+
+
+def render_stats(prefix: str, help_text: str, label_name: str, stats: Dict[str, Dict[str, Any]]) -> List[str]:
+    """
+    /cache/stats 等の統計dict（{ラベル値: {項目: 値}}）の数値項目をgaugeとして出力する
+
+    項目名はcamelCaseからsnake_caseに変換して {prefix}_{項目} とする
+    """
+    metrics: Dict[str, List[Sample]] = {}
+    for label_value, values in stats.items():
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{prefix}_{re.sub(r'(?<!^)(?=[A-Z])', '_', key).lower()}"
+            metrics.setdefault(name, []).append(({label_name: label_value}, value))
+    lines = []
+    for name, samples in sorted(metrics.items()):
+        lines.extend(render_gauge(name, help_text, samples))
+    return lines
+
+
+class LLMUsageMetrics:
+    """
+    チェーン・モデルごとのLLMトークン使用量の集計
+
+    プロンプトトークンのうちプロバイダ側のプロンプトキャッシュに載った分（cached）と
+    載らなかった分（uncached）を分けて記録し、プロンプトの先頭共通化の効果を確認できるようにする
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage: Dict[Tuple[str, str], Dict[str, int]] = {}
+
+    def record(self, chain: str, model: str, usage_metadata: Optional[Mapping[str, Any]]) -> None:
+        """AIMessage.usage_metadata を集計に加える（使用量が返らなかった呼び出しは回数のみ記録）"""
+        usage_metadata = usage_metadata or {}
+        self.record_tokens(
+            chain,
+            model,
+            prompt_tokens=usage_metadata.get("input_tokens") or 0,
+            cached_tokens=(usage_metadata.get("input_token_details") or {}).get("cache_read") or 0,
+            completion_tokens=usage_metadata.get("output_tokens") or 0,
+        )
+
+    def record_openai_usage(self, chain: str, model: str, usage: Any) -> None:
+        """OpenAI SDKのCompletionUsageを集計に加える"""
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.record_tokens(
+            chain,
+            model,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            cached_tokens=getattr(details, "cached_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        )
+
+    def record_tokens(self, chain: str, model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> None:
+        with self._lock:
+            usage = self._usage.setdefault(
+                (chain, model),
+                {"calls": 0, "promptTokens": 0, "cachedPromptTokens": 0, "completionTokens": 0},
+            )
+            usage["calls"] += 1
+            usage["promptTokens"] += prompt_tokens
+            usage["cachedPromptTokens"] += cached_tokens
+            usage["completionTokens"] += completion_tokens
+        logger.debug(
+            "llm_usage chain=%s model=%s prompt_tokens=%d cached_tokens=%d completion_tokens=%d",
+            chain, model, prompt_tokens, cached_tokens, completion_tokens,
+        )
+
+    def stats(self) -> list:
+        with self._lock:
+            items = sorted(self._usage.items())
+        stats = []
+        for (chain, model), usage in items:
+            prompt_tokens = usage["promptTokens"]
+            cached_tokens = usage["cachedPromptTokens"]
+            stats.append({
+                "chain": chain,
+                "model": model,
+                "calls": usage["calls"],
+                "promptTokens": prompt_tokens,
+                "cachedPromptTokens": cached_tokens,
+                "uncachedPromptTokens": prompt_tokens - cached_tokens,
+                "completionTokens": usage["completionTokens"],
+                "cacheHitRate": round(cached_tokens / prompt_tokens, 4) if prompt_tokens else 0.0,
+            })
+        return stats
+
+    def render(self) -> List[str]:
+        stats = self.stats()
+        lines = []
+        for name, key, help_text in (
+            ("motemesse_llm_calls_total", "calls", "LLM calls"),
+            ("motemesse_llm_prompt_tokens_total", "promptTokens", "LLM prompt tokens"),
+            ("motemesse_llm_cached_prompt_tokens_total", "cachedPromptTokens", "LLM prompt tokens served from the provider prompt cache"),
+            ("motemesse_llm_completion_tokens_total", "completionTokens", "LLM completion tokens"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for item in stats:
+                labels = _format_labels(("chain", "model"), (item["chain"], item["model"]))
+                lines.append(f"{name}{labels} {item[key]}")
+        return lines
+
+
+llm_usage_metrics = LLMUsageMetrics()
+
+phase_duration = Histogram(
+    "motemesse_phase_duration_seconds",
+    "Time spent per request in each phase (db_load, prompt_build, llm_ttft, llm_total, parse, total)",
+    ("endpoint", "phase"),
+)
+requests_total = Counter("motemesse_requests_total", "Instrumented requests by outcome", ("endpoint", "status"))
+# LLM出力のパース経路（strict / repaired / salvaged / reask / failed、ストリーミングで逐次取り出せた場合は streamed）
+output_parse_total = Counter(
+    "motemesse_llm_output_parse_total", "LLM output parse outcomes by recovery path", ("chain", "path")
+)
+
+
+class RequestSpans:
+    """
+    1リクエスト分のフェーズ所要時間の記録
+
+    同じフェーズが複数回（並列のVision呼び出し等）記録された場合は合計し、
+    リクエスト終了時にフェーズごとに1回ヒストグラムへ反映してログに出力する
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started_at = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self._finished = False
+
+    def observe(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def observe_first(self, phase: str, seconds: float) -> None:
+        """リクエスト内で最初の1回だけ記録（TTFT用）"""
+        self.phases.setdefault(phase, seconds)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def finish(self, status: str) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        self.phases["total"] = time.perf_counter() - self.started_at
+        for name, seconds in self.phases.items():
+            phase_duration.observe(seconds, endpoint=self.endpoint, phase=name)
+        requests_total.inc(endpoint=self.endpoint, status=status)
+        phases = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.phases.items())
+        logger.info("request_spans endpoint=%s status=%s %s", self.endpoint, status, phases)
+
+
+_current_spans: ContextVar[Optional[RequestSpans]] = ContextVar("request_spans", default=None)
+
+
+@contextmanager
+def activate_spans(spans: RequestSpans):
+    """phase() / observe_phase() の記録先を spans にする（ストリーミング応答の生成中など）"""
+    token = _current_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_spans.reset(token)
+
+
+def error_status(e: BaseException) -> str:
+    """例外を status ラベルに変換（HTTPExceptionはステータスコード）"""
+    return str(getattr(e, "status_code", "error"))
+
+
+@contextmanager
+def request_spans(endpoint: str):
+    """リクエスト全体を計測し、内部で呼ばれる phase() / observe_phase() の記録先にする"""
+    spans = RequestSpans(endpoint)
+    status = "success"
+    try:
+        with activate_spans(spans):
+            yield spans
+    except Exception as e:
+        status = error_status(e)
+        raise
+    finally:
+        spans.finish(status)
+
+
+def observe_phase(name: str, seconds: float, first_only: bool = False) -> None:
+    """実行中のリクエストにフェーズ所要時間を記録（計測対象外の呼び出しでは何もしない）"""
+    spans = _current_spans.get()
+    if spans is None:
+        return
+    if first_only:
+        spans.observe_first(name, seconds)
+    else:
+        spans.observe(name, seconds)
+
+
+@contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(name, time.perf_counter() - start)
+
+
+class FirstTokenTimer:
+    """LLMのストリーミング応答の最初のチャンクまでの時間（TTFT）と全体の時間を記録する"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_token_seconds: Optional[float] = None
+
+    def chunk(self) -> None:
+        if self.first_token_seconds is None:
+            self.first_token_seconds = time.perf_counter() - self.started_at
+            observe_phase("llm_ttft", self.first_token_seconds, first_only=True)
+
+    def done(self) -> None:
+        observe_phase("llm_total", time.perf_counter() - self.started_at)
+
+
+_collectors: List[Callable[[], List[str]]] = []
+
+
+def register_collector(collector: Callable[[], List[str]]) -> None:
+    """/metrics 出力時に呼び出す追加の収集関数（DBプールやキャッシュの統計など）を登録"""
+    _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    """Prometheusのテキスト形式で全メトリクスを出力"""
+    lines = phase_duration.render() + requests_total.render() + output_parse_total.render() + llm_usage_metrics.render()
+    for collector in _collectors:
+        try:
+            lines.extend(collector())
+        except Exception:
+            logger.exception("metrics collector failed")
+    return "\n".join(lines) + "\n"
@@ -1,81 +1,112 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from typing import List, Optional
+
+from sqlalchemy import Integer, String, DateTime, ForeignKey, Text, Index, UniqueConstraint
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from pgvector.sqlalchemy import Vector  # type: ignore[import-untyped]
 from datetime import datetime
 
-Base = declarative_base()
+
+class Base(DeclarativeBase):
+    pass
+
+# 会話の埋め込みベクトルの次元数（text-embedding-3-small を dimensions 指定で縮めて使う）
+EMBEDDING_DIMENSIONS = 256
 
 
 class User(Base):
     __tablename__ = "users"
     
-    id = Column(Integer, primary_key=True, index=True)
-    auth0_id = Column(String, unique=True, index=True)
-    name = Column(String)
-    email = Column(String, unique=True, index=True)
-    age = Column(Integer, nullable=True)
-    job = Column(String, nullable=True)
-    hobby = Column(String, nullable=True)
-    residence = Column(String, nullable=True)
-    work_place = Column(String, nullable=True)
-    blood_type = Column(String, nullable=True)
-    education = Column(String, nullable=True)
-    work_type = Column(String, nullable=True)
-    holiday = Column(String, nullable=True)
-    marriage_history = Column(String, nullable=True)
-    has_children = Column(String, nullable=True)
-    smoking = Column(String, nullable=True)
-    drinking = Column(String, nullable=True)
-    living_with = Column(String, nullable=True)
-    marriage_intention = Column(String, nullable=True)
-    self_introduction = Column(Text, nullable=True)
-    tone = Column(Integer, default=0, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    auth0_id: Mapped[Optional[str]] = mapped_column(String, unique=True, index=True)
+    name: Mapped[Optional[str]] = mapped_column(String)
+    email: Mapped[Optional[str]] = mapped_column(String, unique=True, index=True)
+    age: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    job: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    hobby: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    residence: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    work_place: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    blood_type: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    education: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    work_type: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    holiday: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    marriage_history: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    has_children: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    smoking: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    drinking: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    living_with: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    marriage_intention: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    self_introduction: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    tone: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    targets = relationship("Target", back_populates="user")
-    conversations = relationship("Conversation", back_populates="user")
+    targets: Mapped[List["Target"]] = relationship("Target", back_populates="user")
+    conversations: Mapped[List["Conversation"]] = relationship("Conversation", back_populates="user")
 
 
 class Target(Base):
     __tablename__ = "targets"
     
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    age = Column(Integer, nullable=True)
-    job = Column(String, nullable=True)
-    hobby = Column(String, nullable=True)
-    residence = Column(String, nullable=True)
-    work_place = Column(String, nullable=True)
-    blood_type = Column(String, nullable=True)
-    education = Column(String, nullable=True)
-    work_type = Column(String, nullable=True)
-    holiday = Column(String, nullable=True)
-    marriage_history = Column(String, nullable=True)
-    has_children = Column(String, nullable=True)
-    smoking = Column(String, nullable=True)
-    drinking = Column(String, nullable=True)
-    living_with = Column(String, nullable=True)
-    marriage_intention = Column(String, nullable=True)
-    self_introduction = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    name: Mapped[str] = mapped_column(String, nullable=False)
+    user_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("users.id"))
+    age: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    job: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    hobby: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    residence: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    work_place: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    blood_type: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    education: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    work_type: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    holiday: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    marriage_history: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    has_children: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    smoking: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    drinking: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    living_with: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    marriage_intention: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    self_introduction: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    user = relationship("User", back_populates="targets")
-    conversations = relationship("Conversation", back_populates="target")
+    user: Mapped[Optional["User"]] = relationship("User", back_populates="targets")
+    conversations: Mapped[List["Conversation"]] = relationship("Conversation", back_populates="target")
 
 
 class Conversation(Base):
     __tablename__ = "conversations"
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    target_id = Column(Integer, ForeignKey("targets.id"))
-    female_message = Column(Text, nullable=False)
-    male_reply = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    user_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("users.id"))
+    target_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("targets.id"))
+    female_message: Mapped[str] = mapped_column(Text, nullable=False)
+    male_reply: Mapped[str] = mapped_column(Text, nullable=False)
+    # 関連する過去の会話の検索用（未計算はNULL）。関連会話の検索を有効にしたDBにだけある列のため、明示的に指定した場合だけ参照する
+    embedding: Mapped[Optional[List[float]]] = mapped_column(Vector(EMBEDDING_DIMENSIONS), nullable=True, deferred=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    user: Mapped[Optional["User"]] = relationship("User", back_populates="conversations")
+    target: Mapped[Optional["Target"]] = relationship("Target", back_populates="conversations")
+    
+    __table_args__ = (
+        # ユーザー×ターゲット単位の履歴取得（created_at順・キーセットページング）用
+        Index("ix_conversations_user_id_target_id_created_at_id", "user_id", "target_id", "created_at", "id"),
+    )
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False)
+    target_id: Mapped[int] = mapped_column(Integer, ForeignKey("targets.id"), nullable=False)
+    summary: Mapped[str] = mapped_column(Text, nullable=False)
+    # 要約に取り込み済みの最後の会話（created_at, id）。これ以前の会話は要約でのみプロンプトに含める
+    last_conversation_created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    last_conversation_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    user = relationship("User", back_populates="conversations")
-    target = relationship("Target", back_populates="conversations")
\ No newline at end of file
+    __table_args__ = (
+        UniqueConstraint("user_id", "target_id", name="uq_conversation_summaries_user_id_target_id"),
+    )
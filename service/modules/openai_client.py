@@ -0,0 +1,22 @@
+import os
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# OpenAI呼び出しで共有するHTTPコネクションプールの設定
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+
+
+def create_async_http_client(timeout: float) -> httpx.AsyncClient:
+    """OpenAI向けのコネクションプール付き非同期HTTPクライアントを生成"""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=30.0,
+        ),
+        timeout=httpx.Timeout(timeout, connect=OPENAI_CONNECT_TIMEOUT_SECONDS),
+    )
@@ -0,0 +1,152 @@
+import json
+import re
+from typing import Any, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+from .json_stream import IncrementalJsonArrayParser
+
+# パース結果の経路（メトリクスのラベル）
+PARSE_STRICT = "strict"  # そのままパースできた
+PARSE_REPAIRED = "repaired"  # JSONの崩れを修復してパースできた
+PARSE_SALVAGED = "salvaged"  # 完成している配列要素だけを回収した
+
+# 出力全体が ```json ... ``` で囲まれている場合だけに一致する（閉じフェンスは途中で切れた出力では省略可）
+_FENCE_RE = re.compile(r"\s*```[\w-]*[ \t]*\n?(.*?)(?:\n?```\s*)?", re.DOTALL)
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+class OutputRepairError(ValueError):
+    """修復・部分回収でもLLM出力から結果を取り出せなかった"""
+
+
+def strip_code_fences(text: str) -> str:
+    """
+    出力全体が ```json ... ``` で囲まれていれば中身だけを返す（閉じフェンスがない場合は末尾まで）
+
+    文字列の値の中などにあるフェンスはそのまま残す
+    """
+    match = _FENCE_RE.fullmatch(text)
+    return match.group(1) if match else text
+
+
+def repair_json(text: str) -> Optional[str]:
+    """
+    LLM出力によくあるJSONの崩れを修復する
+
+    - 先頭の前置き・最上位の値より後ろの説明文を取り除く
+    - 文字列中の生の改行・タブをエスケープする
+    - 閉じ括弧直前の余分なカンマを取り除く
+    JSONの開始が見つからない場合と、途中で切れている場合は None
+    （切れた出力を閉じると未完成の要素が混ざるため、完成した要素だけを部分回収で取り出す）
+    """
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        return None
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    for ch in text[start:]:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            elif ch == "\n":
+                ch = "\\n"
+            elif ch == "\t":
+                ch = "\\t"
+            out.append(ch)
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack or stack[-1] != ch:
+                continue
+            _strip_trailing_comma(out)
+            stack.pop()
+            out.append(ch)
+            if not stack:
+                break
+            continue
+        out.append(ch)
+    if stack:
+        return None
+    return "".join(out)
+
+
+def _strip_trailing_comma(out: List[str]) -> None:
+    end = len(out)
+    while end and out[end - 1].isspace():
+        end -= 1
+    if end and out[end - 1] == ",":
+        del out[end - 1:]
+
+
+def _loads(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def _salvage_items(text: str, data: Any, list_field: str) -> List[Any]:
+    """配列要素の候補を取り出す（修復後のJSONが読めればそこから、読めなければ閉じた要素だけを逐次走査で）"""
+    if isinstance(data, dict) and isinstance(data.get(list_field), list):
+        return data[list_field]
+    if isinstance(data, list):
+        return data
+    return IncrementalJsonArrayParser().feed(text)
+
+
+def parse_with_repair(
+    text: str,
+    response_model: Type[ModelT],
+    item_model: Type[BaseModel],
+    list_field: str,
+) -> Tuple[ModelT, str]:
+    """
+    LLM出力を段階的にパースし、(結果, 経路) を返す
+
+    1. そのまま、または出力全体を囲むコードフェンスを除いてパース（strict）
+    2. JSONとして読めない場合は崩れを修復してパース（repaired）。最上位が配列の場合は list_field の値とみなす
+    3. 完成している list_field の要素（最上位が配列の場合はその要素）だけを回収（salvaged）
+    いずれも失敗した場合は OutputRepairError
+    """
+    body = strip_code_fences(text)
+    for candidate in dict.fromkeys((text.strip(), body.strip())):
+        try:
+            return response_model.model_validate_json(candidate), PARSE_STRICT
+        except ValidationError:
+            pass
+
+    data = _loads(body)
+    if data is None:
+        repaired = repair_json(body)
+        data = _loads(repaired) if repaired is not None else None
+    if isinstance(data, list):
+        data = {list_field: data}
+    if isinstance(data, dict):
+        try:
+            return response_model.model_validate(data), PARSE_REPAIRED
+        except ValidationError:
+            pass
+
+    items = []
+    for item in _salvage_items(body, data, list_field):
+        try:
+            items.append(item_model.model_validate(item))
+        except ValidationError:
+            continue
+    if items:
+        try:
+            return response_model.model_validate({list_field: items}), PARSE_SALVAGED
+        except ValidationError:
+            pass
+    raise OutputRepairError(f"Could not recover {list_field} from LLM output")
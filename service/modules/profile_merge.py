@@ -0,0 +1,63 @@
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+def _normalize_text(value: Any) -> str:
+    """比較用に空白を除去した文字列"""
+    return re.sub(r"\s+", "", str(value))
+
+
+def _as_int(value: Any) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    match = re.search(r"\d+", str(value))
+    return int(match.group()) if match else None
+
+
+def _is_present(value: Any) -> bool:
+    return value is not None and _normalize_text(value) != ""
+
+
+def merge_extractions(
+    extractions: Sequence[Dict[str, Any]],
+    fields: Sequence[str],
+    numeric_fields: Sequence[str] = (),
+) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    画像ごとの抽出結果を項目単位で決定的に統合する
+
+    - nullでない値を優先する
+    - 数値項目は最も多く出現した値（同数なら先の画像の値）
+    - 文字列項目は最も詳細な（空白除去後に最長の）値（同長なら先の画像の値）
+    - 項目ごとの信頼度は、値を返した画像のうち採用値と一致（または採用値に包含）する割合。値なしは0.0
+    """
+    merged: Dict[str, Any] = {}
+    confidence: Dict[str, float] = {}
+    for field in fields:
+        if field in numeric_fields:
+            values: List[Any] = [
+                number for number in (_as_int(e.get(field)) for e in extractions if _is_present(e.get(field)))
+                if number is not None
+            ]
+        else:
+            values = [e.get(field) for e in extractions if _is_present(e.get(field))]
+        if not values:
+            merged[field] = None
+            confidence[field] = 0.0
+            continue
+
+        if field in numeric_fields:
+            counts = Counter(values)
+            chosen = max(values, key=lambda v: (counts[v], -values.index(v)))
+            agreeing = counts[chosen]
+        else:
+            normalized = [_normalize_text(v) for v in values]
+            index = max(range(len(values)), key=lambda i: (len(normalized[i]), -i))
+            chosen = values[index]
+            agreeing = sum(1 for text in normalized if text in normalized[index])
+        merged[field] = chosen
+        confidence[field] = agreeing / len(values)
+    return merged, confidence
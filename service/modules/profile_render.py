@@ -0,0 +1,141 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Literal, Optional, Tuple
+
+from .conversation_history import count_tokens
+
+Entity = Literal["user", "target"]
+
+# 描画済みプロフィールを保持する最大件数（ユーザー・ターゲットの合計）
+PROFILE_RENDER_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_RENDER_CACHE_MAX_ENTRIES", "10000"))
+
+
+def format_user_profile(user) -> str:
+    """ユーザープロフィール情報を整形"""
+    return f"""- 名前: {user.name or "ユーザー"}
+- 年齢: {f"{user.age}歳" if user.age else "不明"}
+- 職業: {user.job or "不明"}
+- 趣味: {user.hobby or "不明"}
+- 居住地: {user.residence or "不明"}
+- 勤務地: {user.work_place or "不明"}
+- 血液型: {user.blood_type or "不明"}
+- 学歴: {user.education or "不明"}
+- 仕事の種類: {user.work_type or "不明"}
+- 休日: {user.holiday or "不明"}
+- 結婚歴: {user.marriage_history or "不明"}
+- 子供の有無: {user.has_children or "不明"}
+- 煙草: {user.smoking or "不明"}
+- お酒: {user.drinking or "不明"}
+- 一緒に住んでいる人: {user.living_with or "不明"}
+- 結婚に対する意思: {user.marriage_intention or "不明"}
+- 自己紹介: {getattr(user, 'self_introduction', None) or "情報なし"}"""
+
+
+def format_target_profile(target) -> str:
+    """ターゲットプロフィール情報を整形"""
+    return f"""- 名前: {target.name}
+- 年齢: {f"{target.age}歳" if target.age else "不明"}
+- 職業: {target.job or "不明"}
+- 趣味: {target.hobby or "不明"}
+- 居住地: {target.residence or "不明"}
+- 勤務地: {target.work_place or "不明"}
+- 血液型: {target.blood_type or "不明"}
+- 学歴: {target.education or "不明"}
+- 仕事の種類: {target.work_type or "不明"}
+- 休日: {target.holiday or "不明"}
+- 結婚歴: {target.marriage_history or "不明"}
+- 子供の有無: {target.has_children or "不明"}
+- 煙草: {target.smoking or "不明"}
+- お酒: {target.drinking or "不明"}
+- 一緒に住んでいる人: {target.living_with or "不明"}
+- 結婚に対する意思: {target.marriage_intention or "不明"}
+- 自己紹介: {getattr(target, 'self_introduction', None) or "情報なし"}"""
+
+
+_FORMATTERS = {"user": format_user_profile, "target": format_target_profile}
+
+
+class RenderedProfile(str):
+    """
+    描画済みのプロフィールテキスト（トークン数付き）
+
+    strのサブクラスなので、そのままプロンプト入力・キャッシュキーに使える
+    """
+
+    tokens: int
+    model: str
+
+    def __new__(cls, text: str, tokens: int, model: str):
+        rendered = super().__new__(cls, text)
+        rendered.tokens = tokens
+        rendered.model = model
+        return rendered
+
+
+class ProfileRenderCache:
+    """
+    (entity, id, updated_at) ごとに描画済みプロフィールとトークン数を保持するキャッシュ
+
+    updated_atが変わった行は別バージョンとして描画し直すため、他のワーカーや
+    API以外からの更新でも古いテキストは使われない。自ワーカーでの更新時は invalidate で即座に破棄する
+    """
+
+    def __init__(self, max_entries: int = PROFILE_RENDER_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[Optional[datetime], RenderedProfile]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, entity: Entity, row, model: str) -> RenderedProfile:
+        """行のプロフィールを描画済みならそのまま、なければ描画・トークン数計算して返す"""
+        key = (entity, row.id)
+        version = row.updated_at
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and version is not None and entry[0] == version and entry[1].model == model:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        text = _FORMATTERS[entity](row)
+        rendered = RenderedProfile(text, count_tokens(text, model), model)
+        if version is not None:
+            with self._lock:
+                self._entries[key] = (version, rendered)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return rendered
+
+    def invalidate(self, entity: Entity, entity_id: int) -> None:
+        with self._lock:
+            if self._entries.pop((entity, entity_id), None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": "profile_render",
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "maxEntries": self.max_entries,
+            }
+
+
+profile_render_cache = ProfileRenderCache()
+
+
+def render_user_profile(user, model: str) -> RenderedProfile:
+    return profile_render_cache.get("user", user, model)
+
+
+def render_target_profile(target, model: str) -> RenderedProfile:
+    return profile_render_cache.get("target", target, model)
@@ -0,0 +1,46 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    同一キーで同時に届いたリクエストの上流呼び出しを1回にまとめる（single-flight）
+
+    最初のリクエストが上流呼び出しを開始し、実行中に届いた同一キーのリクエストは
+    その結果（または例外）を共有する。呼び出し完了後はキーを解放する
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, "asyncio.Future[Any]"] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._release(key, done))
+            self.leaders += 1
+        else:
+            self.followers += 1
+        # 待機側がキャンセルされても共有中の上流呼び出しは継続させる
+        return await asyncio.shield(future)
+
+    def _release(self, key: str, future: "asyncio.Future[Any]") -> None:
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled():
+            # 全待機者がキャンセル済みの場合に未取得例外の警告を出さない
+            future.exception()
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "inflight": len(self._inflight),
+        }
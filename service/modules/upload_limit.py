@@ -0,0 +1,50 @@
+from typing import Sequence
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class RequestSizeLimitMiddleware:
+    """
+    対象パスへのリクエストボディサイズを上限で打ち切るASGIミドルウェア
+
+    Content-Lengthが上限を超える場合はボディを読む前に413を返し、
+    Content-Lengthがない（chunked）場合も受信済みバイト数が上限を超えた時点で413にする
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int, path_suffixes: Sequence[str] = ("/upload",)):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_suffixes = tuple(path_suffixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].endswith(self.path_suffixes):
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request body exceeds {self.max_bytes} bytes"
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    break
+                if content_length > self.max_bytes:
+                    response = JSONResponse({"detail": detail}, status_code=413)
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
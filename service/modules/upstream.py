@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+
+import openai
+from fastapi import HTTPException
+
+from .metrics import observe_phase
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 全モデル合計・モデルごとの同時実行数の上限
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "32"))
+UPSTREAM_MODEL_CONCURRENCY = int(os.getenv("UPSTREAM_MODEL_CONCURRENCY", "16"))
+# モデルごとの推定トークン数の上限（1分あたり）。UPSTREAM_TOKENS_PER_MINUTE_<モデル名> で個別に上書きできる
+UPSTREAM_TOKENS_PER_MINUTE = int(os.getenv("UPSTREAM_TOKENS_PER_MINUTE", "200000"))
+# 実行待ちの上限件数と待ち時間。超えた場合は待たずに503を返す
+UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", "100"))
+UPSTREAM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT_SECONDS", "10"))
+# 429・5xx・接続エラー時の再試行
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_RETRY_BASE_SECONDS = float(os.getenv("UPSTREAM_RETRY_BASE_SECONDS", "0.5"))
+UPSTREAM_RETRY_MAX_SECONDS = float(os.getenv("UPSTREAM_RETRY_MAX_SECONDS", "8"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _model_env(name: str, model: str, default: int) -> int:
+    """UPSTREAM_xxx_<モデル名>（英数字以外は_、大文字）の設定値"""
+    suffix = re.sub(r"[^0-9A-Za-z]", "_", model).upper()
+    return int(os.getenv(f"{name}_{suffix}", str(default)))
+
+
+class UpstreamUnavailableError(Exception):
+    """上流（OpenAI）を呼び出せなかった。retry_after秒後の再試行をクライアントに促す"""
+
+    status_code = 503
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class UpstreamRateLimitedError(UpstreamUnavailableError):
+    """再試行しても上流のレート制限（429）が解消しなかった"""
+
+    status_code = 429
+
+
+def upstream_http_exception(e: UpstreamUnavailableError) -> HTTPException:
+    """Retry-Afterヘッダー付きのHTTPExceptionに変換"""
+    return HTTPException(
+        status_code=e.status_code,
+        detail=e.detail,
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+    )
+
+
+def retry_after_seconds(e: BaseException) -> Optional[float]:
+    """上流エラーのレスポンスヘッダー（retry-after-ms / retry-after）から待機秒数を取得"""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(e: BaseException) -> bool:
+    if isinstance(e, openai.APIConnectionError):  # APITimeoutErrorを含む
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+class TokenBucket:
+    """推定トークン数によるレート制限（1分あたりの上限を秒単位で補充）"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_seconds(self, tokens: float) -> float:
+        """tokens分が補充されるまでの秒数の見積もり"""
+        self._refill()
+        return max(0.0, (min(tokens, self.capacity) - self.tokens) / self.rate)
+
+    async def take(self, tokens: float) -> None:
+        # 上限を超える要求は満杯になるまで待てば通す。ロックで到着順に処理する
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class _ModelLimits:
+    def __init__(self, model: str):
+        self.semaphore = asyncio.Semaphore(_model_env("UPSTREAM_MODEL_CONCURRENCY", model, UPSTREAM_MODEL_CONCURRENCY))
+        self.bucket = TokenBucket(_model_env("UPSTREAM_TOKENS_PER_MINUTE", model, UPSTREAM_TOKENS_PER_MINUTE))
+
+
+class UpstreamScheduler:
+    """
+    OpenAI呼び出しの共有スケジューラ
+
+    - 全体・モデルごとの同時実行数の上限と、推定トークン数によるレート制限
+    - 実行待ちが上限件数・上限時間を超えたら待たずに UpstreamUnavailableError（503）
+    - 429・5xx・接続エラーは Retry-After を尊重したジッター付き指数バックオフで再試行し、
+      解消しなければ UpstreamRateLimitedError（429）/ UpstreamUnavailableError（503）
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = UPSTREAM_MAX_CONCURRENCY,
+        max_queue: int = UPSTREAM_MAX_QUEUE,
+        queue_timeout: float = UPSTREAM_QUEUE_TIMEOUT_SECONDS,
+        max_retries: int = UPSTREAM_MAX_RETRIES,
+        retry_base: float = UPSTREAM_RETRY_BASE_SECONDS,
+        retry_max: float = UPSTREAM_RETRY_MAX_SECONDS,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._models: Dict[str, _ModelLimits] = {}
+        self.queued = 0
+        self.inflight = 0
+        self.calls = 0
+        self.retries = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    def _limits(self, model: str) -> _ModelLimits:
+        limits = self._models.get(model)
+        if limits is None:
+            limits = self._models[model] = _ModelLimits(model)
+        return limits
+
+    async def _admit(self, limits: _ModelLimits, tokens: float) -> None:
+        # モデルごとの枠・レート制限を待ってから全体の枠を取る
+        # （全体の枠を持ったまま待つと、混雑したモデルが他のモデルの呼び出しまで止めてしまう）
+        acquired = []
+        try:
+            await limits.semaphore.acquire()
+            acquired.append(limits.semaphore)
+            await limits.bucket.take(tokens)
+            await self._global.acquire()
+            acquired.append(self._global)
+        except BaseException:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+            raise
+
+    @asynccontextmanager
+    async def _slot(self, model: str, tokens: float):
+        """実行枠を確保する（待ちが上限を超えたら即座に503）"""
+        limits = self._limits(model)
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise UpstreamUnavailableError(
+                "Upstream queue is full", retry_after=max(1.0, limits.bucket.wait_seconds(tokens))
+            )
+        self.queued += 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._admit(limits, tokens), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise UpstreamUnavailableError(
+                "Timed out waiting for upstream capacity",
+                retry_after=max(1.0, limits.bucket.wait_seconds(tokens)),
+            )
+        finally:
+            self.queued -= 1
+            observe_phase("upstream_wait", time.perf_counter() - start)
+        self.inflight += 1
+        self.calls += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            limits.semaphore.release()
+            self._global.release()
+
+    def _retry_delay(self, e: BaseException, attempt: int, model: str) -> float:
+        """再試行までの待機秒数を返す。再試行しない場合は例外を送出する"""
+        if not _is_retryable(e):
+            raise e
+        rate_limited = isinstance(e, openai.APIStatusError) and e.status_code == 429
+        if rate_limited:
+            self.rate_limited += 1
+        hinted = retry_after_seconds(e)
+        # Retry-Afterがあればそれに小さなジッターを加え、なければ full jitter の指数バックオフ
+        if hinted is not None:
+            delay = hinted + random.uniform(0, self.retry_base)
+        else:
+            delay = random.uniform(0, min(self.retry_max, self.retry_base * (2 ** attempt)))
+        if attempt >= self.max_retries or delay > self.retry_max:
+            retry_after = max(delay, self.retry_base)
+            logger.warning(
+                "upstream call failed model=%s status=%s attempts=%d retry_after=%.1fs",
+                model, getattr(e, "status_code", type(e).__name__), attempt + 1, retry_after,
+            )
+            if rate_limited:
+                raise UpstreamRateLimitedError("Upstream rate limit exceeded", retry_after=retry_after) from e
+            raise UpstreamUnavailableError("Upstream temporarily unavailable", retry_after=retry_after) from e
+        self.retries += 1
+        logger.info(
+            "upstream retry model=%s status=%s attempt=%d delay=%.2fs",
+            model, getattr(e, "status_code", type(e).__name__), attempt + 1, delay,
+        )
+        return delay
+
+    async def run(self, model: str, estimated_tokens: float, fn: Callable[[], Awaitable[T]]) -> T:
+        """fnを実行枠内で呼び出し、再試行可能なエラーは枠を解放して待ってから再実行する"""
+        attempt = 0
+        while True:
+            async with self._slot(model, estimated_tokens):
+                try:
+                    return await fn()
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt, model)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def stream(
+        self,
+        model: str,
+        estimated_tokens: float,
+        open_stream: Callable[[], AsyncIterator[T]],
+    ) -> AsyncIterator[T]:
+        """
+        ストリーミング呼び出し版の run
+
+        最初の要素を受け取る前のエラーのみ再試行する（途中まで送った出力は取り消せないため）
+        """
+        attempt = 0
+        while True:
+            started = False
+            async with self._slot(model, estimated_tokens):
+                try:
+                    async for item in open_stream():
+                        started = True
+                        yield item
+                    return
+                except Exception as e:
+                    if started:
+                        raise
+                    delay = self._retry_delay(e, attempt, model)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "maxConcurrency": self.max_concurrency,
+            "maxQueue": self.max_queue,
+            "queued": self.queued,
+            "inflight": self.inflight,
+            "calls": self.calls,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "rateLimited": self.rate_limited,
+        }
+
+
+# langchain_routes・vision_routes で共有するスケジューラ
+upstream = UpstreamScheduler()
@@ -0,0 +1,134 @@
+"""
+テスト共通の設定
+
+アプリのモジュールは起動時に環境変数を読むため、importより前に一時ディレクトリのSQLiteと
+テスト用のOpenAI互換サーバー（fake_openai.py）を向くように設定する
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+from tests.fake_openai import FakeOpenAIServer
+
+_TMP_DIR = tempfile.mkdtemp(prefix="motemesse-tests-")
+_fake_server = FakeOpenAIServer()
+_fake_server.start()
+
+os.environ.update({
+    "OPENAI_API_KEY": "sk-test",
+    "OPENAI_BASE_URL": _fake_server.base_url,
+    "DATABASE_URL": f"sqlite:///{_TMP_DIR}/test.db",
+    "VISION_CACHE_BACKEND": "memory",
+    "GENERATION_CACHE_BACKEND": "memory",
+    "EMBEDDING_BACKEND": "none",
+    "UPSTREAM_RETRY_BASE_SECONDS": "0.01",
+})
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from service.modules import conversation_history, models  # noqa: E402
+from service.modules.database import engine, SessionLocal  # noqa: E402
+from service.modules.profile_render import profile_render_cache  # noqa: E402
+from service.app.api.langchain_routes import generation_cache  # noqa: E402
+from service.app.api.vision_routes import vision_cache  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def loop():
+    """
+    全テストで1つのイベントループを使う
+
+    OpenAIクライアントのコネクションプールやスケジューラのセマフォはループに紐づくため、
+    テストごとに asyncio.run で新しいループを作らない
+    """
+    loop = asyncio.new_event_loop()
+    # 本番と同じくスキーマのあるDBで起動する（起動時に会話要約のテーブルの有無を確認するため）
+    models.Base.metadata.create_all(engine)
+    # 本番と同じく起動時にチェーンを構築し、終了時にクライアント・エンジンを閉じる
+    lifespan = main.lifespan(main.app)
+    with pytest.MonkeyPatch.context() as patch:
+        # 起動時のトークナイザーの読み込みでも語彙ファイルを取得しない
+        patch.setattr(conversation_history, "_get_encoding", lambda model: None)
+        loop.run_until_complete(lifespan.__aenter__())
+    yield loop
+    loop.run_until_complete(lifespan.__aexit__(None, None, None))
+    loop.close()
+    _fake_server.stop()
+    engine.dispose()
+    shutil.rmtree(_TMP_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def run(loop):
+    """コルーチンを共有のイベントループで実行する"""
+    return loop.run_until_complete
+
+
+@pytest.fixture
+def fake_openai():
+    _fake_server.state.reset()
+    yield _fake_server.state
+    _fake_server.state.reset()
+
+
+@pytest.fixture(autouse=True)
+def _isolate(monkeypatch):
+    # tiktokenの語彙ファイルを取得しない（文字数でトークン数を見積もる）
+    monkeypatch.setattr(conversation_history, "_get_encoding", lambda model: None)
+    for cache in (generation_cache, vision_cache):
+        cache._entries.clear()
+    profile_render_cache._entries.clear()
+    _fake_server.state.reset()
+
+
+@pytest.fixture
+def db_session():
+    """テーブルを作り直し、ユーザー1人とターゲット1人を登録したDB（同期セッション）"""
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        user = models.User(auth0_id="auth0|1", name="太郎", email="taro@example.com", age=30, tone=0)
+        db.add(user)
+        db.flush()
+        db.add(models.Target(name="花子", user_id=user.id, age=28))
+        db.commit()
+        yield db
+
+
+@pytest.fixture
+def user_id(db_session):
+    return db_session.query(models.User.id).scalar()
+
+
+@pytest.fixture
+def target_id(db_session):
+    return db_session.query(models.Target.id).scalar()
+
+
+@pytest.fixture
+def client(run):
+    """アプリをASGIで直接呼び出すHTTPクライアント"""
+    http = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://testserver", timeout=30)
+    yield http
+    run(http.aclose())
+
+
+@pytest.fixture
+def add_conversations(db_session, user_id, target_id):
+    """f{i} / m{i} の会話を1秒ずつずらした作成日時で登録する関数"""
+    base = datetime(2025, 1, 1)
+
+    def add(count: int, start: int = 0) -> None:
+        for i in range(start, start + count):
+            db_session.add(models.Conversation(
+                user_id=user_id, target_id=target_id, female_message=f"f{i}", male_reply=f"m{i}",
+                created_at=base + timedelta(seconds=i),
+            ))
+        db_session.commit()
+
+    return add
@@ -0,0 +1,182 @@
+"""
+テスト用のOpenAI互換サーバー
+
+別スレッドのuvicornで起動し、応答の遅延・429の注入・応答内容をテストごとに差し替えられる。
+既定の応答はシステムプロンプトから呼び出し元を判別して返す（返信候補・会話要約・Vision）
+"""
+import asyncio
+import json
+import re
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLY_JSON = json.dumps(
+    {"replies": [{"id": 1, "text": "こんにちは"}, {"id": 2, "text": "はじめまして"}, {"id": 3, "text": "よろしく"}]},
+    ensure_ascii=False,
+)
+PROFILE_JSON = json.dumps({"name": "花子", "age": 28, "job": "看護師"}, ensure_ascii=False)
+CHAT_JSON = json.dumps({"latestFemaleMessage": "今度ごはん行きませんか？"}, ensure_ascii=False)
+
+Content = Union[str, Callable[[dict], str]]
+# 応答までの秒数（リクエストごとに変える場合はリクエストボディを受け取る関数）
+Delay = Union[float, Callable[[dict], float]]
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+def _has_image(body: dict) -> bool:
+    return any(
+        isinstance(message["content"], list)
+        and any(part.get("type") == "image_url" for part in message["content"])
+        for message in body["messages"]
+    )
+
+
+def summary_content(body: dict) -> str:
+    """これまでの要約に、新しい会話の女性メッセージをそのまま書き足した要約を返す"""
+    human = _text(body["messages"][-1]["content"])
+    previous, _, new_turns = human.partition("\n\n新しい会話:\n")
+    previous = previous.removeprefix("これまでの要約:\n")
+    lines = [] if previous == "（なし）" else previous.split("\n")
+    lines += re.findall(r"^彼女: (.*)$", new_turns, re.MULTILINE)
+    return json.dumps({"summary": "\n".join(lines)}, ensure_ascii=False)
+
+
+def default_content(body: dict) -> str:
+    system = _text(body["messages"][0]["content"])
+    if "会話履歴を要約" in system:
+        return summary_content(body)
+    if _has_image(body):
+        return CHAT_JSON if "latestFemaleMessage" in system else PROFILE_JSON
+    return REPLY_JSON
+
+
+class FakeOpenAIState:
+    """テストから操作するサーバーの状態"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.requests: List[dict] = []
+        self.delay: Delay = 0.0
+        self.content: Optional[Content] = None
+        # 先頭から何回の呼び出しを429で失敗させるか
+        self.fail_429 = 0
+        self.retry_after: Optional[str] = "0.05"
+        self.inflight = 0
+        self.max_inflight = 0
+
+    def chat_calls(self, predicate: Callable[[dict], bool] = lambda body: True) -> int:
+        return sum(1 for body in self.requests if "messages" in body and predicate(body))
+
+    def respond(self, body: dict) -> str:
+        content = self.content if self.content is not None else default_content
+        return content(body) if callable(content) else content
+
+
+def _usage() -> Dict[str, Any]:
+    return {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120,
+            "prompt_tokens_details": {"cached_tokens": 0}}
+
+
+def create_app(state: FakeOpenAIState) -> FastAPI:
+    app = FastAPI()
+
+    def rate_limited() -> Optional[JSONResponse]:
+        if state.fail_429 <= 0:
+            return None
+        state.fail_429 -= 1
+        headers = {"retry-after": state.retry_after} if state.retry_after is not None else {}
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            status_code=429,
+            headers=headers,
+        )
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        state.requests.append(body)
+        limited = rate_limited()
+        if limited is not None:
+            return limited
+        state.inflight += 1
+        state.max_inflight = max(state.max_inflight, state.inflight)
+        try:
+            await asyncio.sleep(state.delay(body) if callable(state.delay) else state.delay)
+        finally:
+            state.inflight -= 1
+        content = state.respond(body)
+        if not body.get("stream"):
+            return {
+                "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": _usage(),
+            }
+
+        def chunk(delta: dict, choices: bool = True) -> str:
+            data = {"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}] if choices else []}
+            if not choices:
+                data["usage"] = _usage()
+            return "data: " + json.dumps(data, ensure_ascii=False) + "\n\n"
+
+        async def events():
+            for start in range(0, len(content), 16):
+                yield chunk({"content": content[start:start + 16]})
+            yield chunk({}, choices=False)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        state.requests.append(body)
+        limited = rate_limited()
+        if limited is not None:
+            return limited
+        dimensions = body.get("dimensions", 8)
+        data = [
+            {"object": "embedding", "index": index, "embedding": [float(len(text) % 7 + 1)] * dimensions}
+            for index, text in enumerate(body["input"])
+        ]
+        return {"object": "list", "data": data, "model": body["model"],
+                "usage": {"prompt_tokens": 1, "total_tokens": 1}}
+
+    return app
+
+
+class FakeOpenAIServer:
+    def __init__(self):
+        self.state = FakeOpenAIState()
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{self.port}/v1"
+        config = uvicorn.Config(create_app(self.state), host="127.0.0.1", port=self.port, log_level="error")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("fake OpenAI server did not start")
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
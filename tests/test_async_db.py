@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import event
+
+from service.modules.database import async_engine
+
+DB_LATENCY = 0.2
+CONCURRENCY = 10
+
+
+@pytest.fixture
+def slow_async_db(run):
+    """
+    非同期エンジンの各SQL文の実行に DB_LATENCY 秒の待ちを加える
+
+    待ちはSQLiteのプログレスハンドラ（aiosqliteの接続スレッド内）で行うため、
+    遅いDBサーバーへの問い合わせと同じくイベントループの外で時間がかかる
+    """
+    # 前のテストの接続を使わない（プログレスハンドラのない新しい接続で始める）
+    run(async_engine.dispose())
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        adapted = conn.connection.dbapi_connection
+        pending = {"sleep": True}
+
+        def handler():
+            if pending["sleep"]:
+                pending["sleep"] = False
+                time.sleep(DB_LATENCY)
+            return 0
+
+        adapted.await_(adapted.driver_connection.set_progress_handler(handler, 1))
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    # プログレスハンドラを設定した接続を破棄する
+    run(async_engine.dispose())
+
+
+def test_db_waits_do_not_serialize_requests(run, client, user_id, target_id, add_conversations, slow_async_db):
+    add_conversations(25)
+
+    async def fetch():
+        response = await client.get("/api/conversations", params={"userId": user_id, "targetId": target_id})
+        assert response.status_code == 200
+        return response
+
+    async def scenario():
+        started = time.perf_counter()
+        await fetch()
+        single = time.perf_counter() - started
+        started = time.perf_counter()
+        await asyncio.gather(*(fetch() for _ in range(CONCURRENCY)))
+        return single, time.perf_counter() - started
+
+    single, concurrent = run(scenario())
+
+    # 1リクエストは1文（DB_LATENCY秒）。同時リクエストのDB待ちは重なり、件数倍にならない
+    assert len(slow_async_db) == 1 + CONCURRENCY
+    assert single >= DB_LATENCY
+    assert concurrent < DB_LATENCY * 3
+
+
+def test_event_loop_keeps_running_during_db_wait(run, client, user_id, target_id, add_conversations, slow_async_db):
+    add_conversations(3)
+
+    async def scenario():
+        finished = []
+
+        async def fetch():
+            response = await client.get("/api/conversations", params={"userId": user_id, "targetId": target_id})
+            finished.append("conversations")
+            return response
+
+        request = asyncio.create_task(fetch())
+        # 会話履歴のSQLがDBで待ちに入ってからヘルスチェックを送る
+        while not slow_async_db:
+            await asyncio.sleep(0.001)
+        health = await client.get("/health")
+        finished.append("health")
+        return (await request).status_code, health.status_code, finished
+
+    status, health_status, finished = run(scenario())
+
+    assert (status, health_status) == (200, 200)
+    # DBの待ち中もイベントループは止まらず、後から送ったヘルスチェックが先に返る
+    assert finished == ["health", "conversations"]
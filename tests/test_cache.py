@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+from service.modules.cache import SQLiteCacheBackend, TTLCache
+
+
+def _backend(tmp_path, max_entries=100) -> SQLiteCacheBackend:
+    return SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"), max_entries)
+
+
+def test_backend_read_does_not_write(tmp_path):
+    backend = _backend(tmp_path)
+    backend.set("key", {"message": "こんにちは"}, time.time() + 60)
+    changes = backend._conn.total_changes
+
+    assert backend.get("key")[0] == {"message": "こんにちは"}
+    assert backend.get("missing") is None
+    assert backend._conn.total_changes == changes
+
+
+def test_backend_ignores_expired_entries(tmp_path):
+    backend = _backend(tmp_path)
+    backend.set("key", "value", time.time() - 1)
+
+    assert backend.get("key") is None
+
+
+def test_backend_evicts_oldest_entries_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(SQLiteCacheBackend, "EVICTION_INTERVAL", 10)
+    backend = _backend(tmp_path, max_entries=5)
+    for i in range(9):
+        backend.set(f"key{i}", i, time.time() + 60)
+    # 一括削除の間隔に達するまでは上限を超えて保持する
+    assert backend._conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0] == 9
+
+    backend.set("key9", 9, time.time() + 60)
+
+    keys = {row[0] for row in backend._conn.execute("SELECT key FROM cache_entries")}
+    assert keys == {f"key{i}" for i in range(5, 10)}
+
+
+def test_memory_miss_falls_back_to_backend(run, tmp_path):
+    backend = _backend(tmp_path)
+    run(TTLCache("test", 60, 10, backend=backend).aset("key", [1, 2]))
+    cache = TTLCache("test", 60, 10, backend=backend)
+
+    assert run(cache.aget("key")) == [1, 2]
+    assert cache.stats()["hits"] == 1
+    assert run(cache.aget("missing")) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_async_access_does_not_block_event_loop(run, tmp_path, monkeypatch):
+    """永続バックエンドが遅くても、aget / aset の間に他のコルーチンが動ける"""
+    backend = _backend(tmp_path)
+    cache = TTLCache("test", 60, 10, backend=backend)
+    original_get, original_set = backend.get, backend.set
+
+    def slow_get(key):
+        time.sleep(0.2)
+        return original_get(key)
+
+    def slow_set(key, value, expires_at):
+        time.sleep(0.2)
+        original_set(key, value, expires_at)
+
+    monkeypatch.setattr(backend, "get", slow_get)
+    monkeypatch.setattr(backend, "set", slow_set)
+
+    async def ticker(ticks):
+        while True:
+            await asyncio.sleep(0.01)
+            ticks.append(1)
+
+    async def scenario():
+        ticks: list = []
+        task = asyncio.create_task(ticker(ticks))
+        await cache.aset("key", "value")
+        cache._entries.clear()
+        value = await cache.aget("key")
+        task.cancel()
+        return value, len(ticks)
+
+    value, ticks = run(scenario())
+
+    assert value == "value"
+    assert ticks >= 20
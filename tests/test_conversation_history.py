@@ -0,0 +1,139 @@
+import re
+import threading
+
+from tests.fake_openai import _text
+
+from service.app.api import langchain_routes
+from service.modules import conversation_history, models
+from service.modules.conversation_history import build_history_window, chunk_turns, format_turn
+
+MODEL = langchain_routes.LLM_MODEL
+
+
+def _turn(i: int, text: str = "") -> models.Conversation:
+    return models.Conversation(id=i + 1, female_message=f"f{i}{text}", male_reply=f"m{i}")
+
+
+def _female_lines(text: str):
+    return re.findall(r"^彼女: (.*)$", text, re.MULTILINE)
+
+
+def _generate(run, client, user_id, target_id):
+    response = run(client.post("/api/langchain/generate-reply", json={
+        "userId": user_id, "selectedTargetId": target_id, "message": "こんにちは",
+    }))
+    assert response.status_code == 200
+
+
+def _reply_prompt_turns(fake_openai):
+    """最後の返信生成の呼び出しで、プロンプトに逐語で含めた会話（女性メッセージ）"""
+    body = [b for b in fake_openai.requests
+            if "messages" in b and "会話履歴を要約" not in _text(b["messages"][0]["content"])][-1]
+    return [line for message in body["messages"] for line in _female_lines(_text(message["content"]))]
+
+
+def _summary(db_session):
+    db_session.expire_all()
+    return db_session.query(models.ConversationSummary).one_or_none()
+
+
+def test_window_keeps_everything_within_budget():
+    turns = [_turn(i) for i in range(5)]
+
+    window = build_history_window(turns, MODEL, budget_tokens=1000)
+
+    assert window.recent == turns
+    assert window.to_summarize == []
+
+
+def test_window_summarizes_oldest_turns_over_budget():
+    turns = [_turn(i, "あ" * 40) for i in range(10)]
+    turn_tokens = len(format_turn(turns[0]))
+
+    window = build_history_window(turns, MODEL, budget_tokens=turn_tokens * 6, keep_ratio=0.5)
+
+    assert window.to_summarize + window.recent == turns
+    assert len(window.recent) == 3
+    assert window.recent_tokens == turn_tokens * 3
+
+
+def test_window_keeps_latest_turn_even_over_budget():
+    turns = [_turn(0), _turn(1, "あ" * 100)]
+
+    window = build_history_window(turns, MODEL, budget_tokens=10)
+
+    assert window.recent == [turns[1]]
+    assert window.to_summarize == [turns[0]]
+
+
+def test_chunk_turns_stays_within_budget_in_order():
+    turns = [_turn(i, "あ" * (i % 4) * 10) for i in range(20)]
+
+    chunks = chunk_turns(turns, MODEL, budget_tokens=100)
+
+    assert [turn for chunk in chunks for turn in chunk] == turns
+    for chunk in chunks:
+        assert len(chunk) == 1 or sum(len(format_turn(t)) for t in chunk) <= 100
+
+
+def test_turns_beyond_fetch_limit_are_summarized(run, client, user_id, target_id, add_conversations,
+                                                fake_openai, db_session):
+    # 逐語の直近50件はトークン予算内に収まるが、それより前の70件も要約に取り込まれる
+    add_conversations(120)
+
+    _generate(run, client, user_id, target_id)
+
+    summary = _summary(db_session)
+    assert summary is not None
+    summarized = summary.summary.split("\n")
+    in_prompt = _reply_prompt_turns(fake_openai)
+    assert summarized == [f"f{i}" for i in range(70)]
+    assert in_prompt == [f"f{i}" for i in range(70, 120)]
+    assert summary.last_conversation_id == db_session.query(models.Conversation.id).filter(
+        models.Conversation.female_message == "f69").scalar()
+
+
+def test_summary_catches_up_across_requests(run, client, user_id, target_id, add_conversations,
+                                            fake_openai, db_session, monkeypatch):
+    monkeypatch.setattr(langchain_routes, "REPLY_HISTORY_LIMIT", 20)
+    monkeypatch.setattr(langchain_routes, "REPLY_SUMMARY_CATCHUP_LIMIT", 30)
+    add_conversations(100)
+
+    watermarks = []
+    for _ in range(3):
+        _generate(run, client, user_id, target_id)
+        summary = _summary(db_session)
+        watermarks.append(summary.summary.split("\n")[-1])
+        # 取り込み済みの会話は古い順に途切れず並ぶ
+        assert summary.summary.split("\n") == [f"f{i}" for i in range(len(summary.summary.split("\n")))]
+
+    assert watermarks == ["f29", "f59", "f79"]
+    assert _reply_prompt_turns(fake_openai) == [f"f{i}" for i in range(80, 100)]
+
+    # 取り込みが追いついた後は、直近の会話が予算内に収まる限り要約を更新しない
+    summary_calls = fake_openai.chat_calls(lambda b: "会話履歴を要約" in _text(b["messages"][0]["content"]))
+    _generate(run, client, user_id, target_id)
+    assert fake_openai.chat_calls(lambda b: "会話履歴を要約" in _text(b["messages"][0]["content"])) == summary_calls
+    assert _summary(db_session).summary.split("\n")[-1] == "f79"
+
+
+def test_token_counting_warms_up_off_the_event_loop(run, monkeypatch):
+    loaded = []
+
+    def get_encoding(model):
+        loaded.append((model, threading.current_thread()))
+        return None
+
+    monkeypatch.setattr(conversation_history, "_get_encoding", get_encoding)
+    registry = langchain_routes.build_chain_registry()
+
+    run(langchain_routes.warm_up_token_counting(registry))
+
+    # 語彙の読み込みはイベントループのスレッドの外で行う
+    assert {model for model, _ in loaded} == {MODEL}
+    assert all(thread is not threading.main_thread() for _, thread in loaded)
+    # 固定部分のトークン数は計算済みのため、リクエスト中にトークナイザーを読み込まない
+    loaded.clear()
+    for name in ("reply", "initial_greeting", "reply_repair", "conversation_summary"):
+        registry.get(name).static_tokens
+    assert loaded == []
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from service.modules import models
+
+
+def _pages(run, client, user_id, target_id, limit):
+    pages, cursor = [], None
+    while True:
+        params = {"userId": user_id, "targetId": target_id, "limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = run(client.get("/api/conversations", params=params))
+        assert response.status_code == 200
+        body = response.json()
+        pages.append(body["conversations"])
+        cursor = body["nextCursor"]
+        if cursor is None:
+            return pages
+
+
+def test_pages_walk_history_newest_first_without_gaps(run, client, user_id, target_id, add_conversations):
+    add_conversations(7)
+
+    pages = _pages(run, client, user_id, target_id, limit=3)
+
+    assert [[item["femaleMessage"] for item in page] for page in pages] == [
+        ["f6", "f5", "f4"], ["f3", "f2", "f1"], ["f0"],
+    ]
+
+
+def test_rows_without_created_at_are_paged_last(run, client, db_session, user_id, target_id, add_conversations):
+    add_conversations(3)
+    for i in range(3):
+        db_session.add(models.Conversation(
+            user_id=user_id, target_id=target_id, female_message=f"undated{i}", male_reply="m",
+        ))
+    db_session.flush()
+    db_session.query(models.Conversation).filter(
+        models.Conversation.female_message.like("undated%")
+    ).update({"created_at": None}, synchronize_session=False)
+    db_session.commit()
+
+    pages = _pages(run, client, user_id, target_id, limit=2)
+
+    messages = [item["femaleMessage"] for page in pages for item in page]
+    assert messages == ["f2", "f1", "f0", "undated2", "undated1", "undated0"]
+    assert [len(page) for page in pages] == [2, 2, 2]
+    assert pages[-1][-1]["createdAt"] is None
+
+
+def test_invalid_cursor_is_rejected(run, client, user_id, target_id):
+    response = run(client.get("/api/conversations", params={
+        "userId": user_id, "targetId": target_id, "cursor": "not-a-cursor",
+    }))
+
+    assert response.status_code == 400
+
+
+def test_rows_sharing_created_at_are_split_across_pages(run, client, db_session, user_id, target_id):
+    created_at = datetime(2024, 1, 1)
+    db_session.add_all([
+        models.Conversation(
+            user_id=user_id, target_id=target_id, female_message=f"f{i}", male_reply="m",
+            created_at=created_at if i < 4 else created_at + timedelta(seconds=1),
+        )
+        for i in range(6)
+    ])
+    db_session.commit()
+
+    pages = _pages(run, client, user_id, target_id, limit=3)
+
+    assert [[item["femaleMessage"] for item in page] for page in pages] == [
+        ["f5", "f4", "f3"], ["f2", "f1", "f0"],
+    ]
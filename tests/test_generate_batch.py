@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from service.app.api import langchain_routes
+from service.modules.metrics import requests_total
+
+
+def _count(endpoint: str, status: str) -> float:
+    return requests_total._values.get((endpoint, status), 0)
+
+
+def _payload(user_id, target_id):
+    return {"userId": user_id, "items": [
+        {"selectedTargetId": target_id, "message": "こんにちは"},
+        {"selectedTargetId": target_id},
+        {"selectedTargetId": target_id + 100, "message": "こんにちは"},
+    ]}
+
+
+def test_batch_stream_reports_items_and_success_span(run, client, user_id, target_id, fake_openai):
+    before = _count("generate_batch_stream", "success")
+
+    response = run(client.post("/api/langchain/generate-batch/stream", json=_payload(user_id, target_id)))
+
+    blocks = [dict(line.split(": ", 1) for line in block.split("\n")) for block in response.text.strip().split("\n\n")]
+    results = sorted((json.loads(b["data"]) for b in blocks if b["event"] == "result"), key=lambda r: r["index"])
+    assert [(r["messageType"], r["status"]) for r in results] == [
+        ("reply", "success"), ("initial_greeting", "success"), ("reply", "error"),
+    ]
+    assert results[2]["statusCode"] == 404
+    assert json.loads(blocks[-1]["data"]) == {"status": "success", "succeeded": 2, "failed": 1}
+    assert _count("generate_batch_stream", "success") == before + 1
+
+
+def test_batch_stream_span_records_failure(run, client, user_id, target_id, monkeypatch):
+    async def broken(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(langchain_routes, "_generate_batch_item", broken)
+    success, error = _count("generate_batch_stream", "success"), _count("generate_batch_stream", "error")
+
+    with pytest.raises(RuntimeError):
+        run(client.post("/api/langchain/generate-batch/stream", json=_payload(user_id, target_id)))
+
+    assert _count("generate_batch_stream", "error") == error + 1
+    assert _count("generate_batch_stream", "success") == success
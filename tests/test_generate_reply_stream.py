@@ -0,0 +1,85 @@
+import json
+
+from tests.fake_openai import REPLY_JSON
+
+from service.app.api.langchain_routes import ReplyRequest, _load_reply_inputs, generation_cache, get_chain_registry
+from service.modules.database import AsyncSessionLocal
+
+# 2件目の途中で切れた出力（完成している1件目だけが逐次パースで送信される）
+TRUNCATED_REPLY_JSON = REPLY_JSON[:REPLY_JSON.index('"はじめまして"') + 4]
+
+
+def _events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def _stream(run, client, user_id, target_id, message="こんにちは"):
+    response = run(client.post("/api/langchain/generate-reply/stream", json={
+        "userId": user_id, "selectedTargetId": target_id, "message": message,
+    }))
+    assert response.status_code == 200
+    return _events(response.text)
+
+
+def _generate(run, client, user_id, target_id, message="こんにちは"):
+    response = run(client.post("/api/langchain/generate-reply", json={
+        "userId": user_id, "selectedTargetId": target_id, "message": message,
+    }))
+    assert response.status_code == 200
+    return response.json()["replies"]
+
+
+def test_stream_sends_replies_and_caches_complete_output(run, client, user_id, target_id, fake_openai):
+    stores = generation_cache.stores
+    events = _stream(run, client, user_id, target_id)
+
+    assert [name for name, _ in events] == ["reply", "reply", "reply", "done"]
+    assert [data["text"] for _, data in events[:3]] == ["こんにちは", "はじめまして", "よろしく"]
+    assert generation_cache.stores == stores + 1
+    # 同じ入力の通常の生成はキャッシュから返る
+    assert len(_generate(run, client, user_id, target_id)) == 3
+    assert fake_openai.chat_calls() == 1
+
+
+def test_stream_does_not_cache_truncated_output(run, client, user_id, target_id, fake_openai):
+    fake_openai.content = TRUNCATED_REPLY_JSON
+    stores = generation_cache.stores
+
+    events = _stream(run, client, user_id, target_id)
+
+    assert [name for name, _ in events] == ["reply", "done"]
+    assert generation_cache.stores == stores
+
+    fake_openai.content = REPLY_JSON
+    assert len(_generate(run, client, user_id, target_id)) == 3
+    assert fake_openai.chat_calls() == 2
+
+
+def test_generate_does_not_cache_salvaged_replies(run, client, user_id, target_id, fake_openai):
+    fake_openai.content = TRUNCATED_REPLY_JSON
+    stores = generation_cache.stores
+
+    assert [reply["text"] for reply in _generate(run, client, user_id, target_id)] == ["こんにちは"]
+    assert generation_cache.stores == stores
+
+    fake_openai.content = REPLY_JSON
+    assert len(_generate(run, client, user_id, target_id)) == 3
+    assert fake_openai.chat_calls() == 2
+
+
+def test_reply_inputs_are_exactly_the_prompt_variables(run, user_id, target_id, add_conversations):
+    # テンプレートで使わない入力はキャッシュキー・トークン数の見積もりに混ぜない
+    add_conversations(3)
+
+    async def load():
+        async with AsyncSessionLocal() as db:
+            request = ReplyRequest(userId=user_id, selectedTargetId=target_id, message="こんにちは")
+            return await _load_reply_inputs(request, db)
+
+    inputs, _ = run(load())
+
+    assert set(inputs) == set(get_chain_registry().get("reply").prompt.input_variables)
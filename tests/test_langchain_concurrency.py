@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+LLM_LATENCY = 0.3
+CONCURRENCY = 10
+
+
+def test_concurrent_generate_reply_finishes_in_about_one_llm_latency(run, client, user_id, target_id, fake_openai):
+    """LLM呼び出し中もイベントループを止めないため、N件の同時リクエストがN倍ではなく約1回分の時間で終わる"""
+    fake_openai.delay = LLM_LATENCY
+
+    async def scenario():
+        # チェーン構築・DB接続などの初回のみのコストを計測から除く
+        await client.post("/api/langchain/generate-reply", json={
+            "userId": user_id, "selectedTargetId": target_id, "message": "ウォームアップ",
+        })
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.post("/api/langchain/generate-reply", json={
+                "userId": user_id, "selectedTargetId": target_id, "message": f"メッセージ{i}",
+            })
+            for i in range(CONCURRENCY)
+        ))
+        return responses, time.perf_counter() - started
+
+    responses, elapsed = run(scenario())
+
+    assert [response.status_code for response in responses] == [200] * CONCURRENCY
+    assert all(len(response.json()["replies"]) == 3 for response in responses)
+    assert fake_openai.chat_calls() == CONCURRENCY + 1
+    assert fake_openai.max_inflight > 1
+    assert elapsed < LLM_LATENCY * 3
+
+
+def test_health_check_responds_while_llm_calls_are_in_flight(run, client, user_id, target_id, fake_openai):
+    fake_openai.delay = 1.0
+
+    async def scenario():
+        generations = [
+            asyncio.create_task(client.post("/api/langchain/generate-reply", json={
+                "userId": user_id, "selectedTargetId": target_id, "message": f"メッセージ{i}",
+            }))
+            for i in range(5)
+        ]
+        await asyncio.sleep(0.2)
+        started = time.perf_counter()
+        health = await client.get("/health")
+        health_elapsed = time.perf_counter() - started
+        pending = sum(1 for task in generations if not task.done())
+        await asyncio.gather(*generations)
+        return health, health_elapsed, pending
+
+    health, health_elapsed, pending = run(scenario())
+
+    assert health.status_code == 200
+    assert pending == 5
+    assert health_elapsed < 0.5
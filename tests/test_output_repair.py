@@ -0,0 +1,61 @@
+import pytest
+
+from service.app.api.langchain_routes import Reply, ReplyResponse
+from service.modules.json_stream import IncrementalJsonArrayParser
+from service.modules.output_repair import (
+    PARSE_REPAIRED,
+    PARSE_SALVAGED,
+    PARSE_STRICT,
+    OutputRepairError,
+    parse_with_repair,
+)
+
+AB = '{"replies":[{"id":1,"text":"a"},{"id":2,"text":"b"}]}'
+
+# (LLM出力, 期待する経路, 期待する (id, text) の一覧)
+CORPUS = [
+    (AB, PARSE_STRICT, [(1, "a"), (2, "b")]),
+    ('{"replies":[{"id":1,"text":"use ```code``` here"}]}', PARSE_STRICT, [(1, "use ```code``` here")]),
+    (f"```json\n{AB}\n```", PARSE_STRICT, [(1, "a"), (2, "b")]),
+    (f"  ```\n{AB}```  \n", PARSE_STRICT, [(1, "a"), (2, "b")]),
+    ('```json\n{"replies":[{"id":1,"text":"a ``` b"}]}\n```', PARSE_STRICT, [(1, "a ``` b")]),
+    (f"以下が返信候補です。\n{AB}\n以上です。", PARSE_REPAIRED, [(1, "a"), (2, "b")]),
+    ('{"replies":[{"id":1,"text":"a"},{"id":2,"text":"b"},]}', PARSE_REPAIRED, [(1, "a"), (2, "b")]),
+    ('{"replies":[{"id":1,"text":"1行目\n2行目"}]}', PARSE_REPAIRED, [(1, "1行目\n2行目")]),
+    ('[{"id":1,"text":"a"},{"id":2,"text":"b"}]', PARSE_REPAIRED, [(1, "a"), (2, "b")]),
+    ('{"replies":[{"id":1,"text":"a"},{"id":2,"te', PARSE_SALVAGED, [(1, "a")]),
+    ('[{"id":1,"text":"a"},{"id":2,"te', PARSE_SALVAGED, [(1, "a")]),
+    ('```json\n{"replies":[{"id":1,"text":"a"},{"id":2', PARSE_SALVAGED, [(1, "a")]),
+    ('{"replies":[{"id":1,"text":"a"},{"id":"x","text":"b"}]}', PARSE_SALVAGED, [(1, "a")]),
+]
+
+UNRECOVERABLE = [
+    "申し訳ありませんが、その依頼にはお応えできません。",
+    '{"replies":[{"id":1,"te',
+    '[{"id":1,"te',
+    '{"replies":[]',
+    "",
+]
+
+
+@pytest.mark.parametrize("text,path,expected", CORPUS)
+def test_corpus(text, path, expected):
+    result, actual_path = parse_with_repair(text, ReplyResponse, Reply, "replies")
+
+    assert actual_path == path
+    assert [(r.id, r.text) for r in result.replies] == expected
+
+
+@pytest.mark.parametrize("text", UNRECOVERABLE)
+def test_unrecoverable_output_raises(text):
+    with pytest.raises(OutputRepairError):
+        parse_with_repair(text, ReplyResponse, Reply, "replies")
+
+
+@pytest.mark.parametrize("text", [AB, '[{"id":1,"text":"a"},{"id":2,"text":"b"}]'])
+def test_stream_parser_yields_items_for_both_root_shapes(text):
+    parser = IncrementalJsonArrayParser()
+
+    items = [item for start in range(0, len(text), 5) for item in parser.feed(text[start:start + 5])]
+
+    assert items == [{"id": 1, "text": "a"}, {"id": 2, "text": "b"}]
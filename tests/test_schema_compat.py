@@ -0,0 +1,81 @@
+"""
+スキーマはmotemesse-front側で管理しているため、このAPIで追加した列がまだないDBでも動くこと
+"""
+import pytest
+from sqlalchemy import text
+
+from tests.fake_openai import _text
+
+from service.modules import async_crud, crud
+from service.modules.database import AsyncSessionLocal, engine
+
+
+@pytest.fixture
+def without_embedding_column(db_session, add_conversations):
+    """pgvectorのマイグレーション前のDB（conversations.embedding 列がない）に会話を3件登録する"""
+    add_conversations(3)
+    db_session.close()
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE conversations DROP COLUMN embedding"))
+
+
+def test_reply_and_writes_work_without_embedding_column(
+    run, client, db_session, user_id, target_id, without_embedding_column
+):
+    response = run(client.post("/api/langchain/generate-reply", json={
+        "userId": user_id, "selectedTargetId": target_id, "message": "こんにちは",
+    }))
+    assert response.status_code == 200
+
+    response = run(client.post("/api/conversations/import", json={
+        "userId": user_id, "targetId": target_id, "turns": [{"femaleMessage": "f", "maleReply": "m"}],
+    }))
+    assert response.status_code == 200
+    assert response.json()["imported"] == 1
+
+    assert crud.create_conversation(db_session, user_id, target_id, "f1", "m1").id is not None
+
+    async def create():
+        async with AsyncSessionLocal() as db:
+            return await async_crud.create_conversation(db, user_id, target_id, "f2", "m2")
+
+    assert run(create()).id is not None
+
+
+@pytest.fixture
+def without_summary_table(run, db_session, monkeypatch):
+    """会話要約のテーブルがないDBで起動した状態（テスト後は有効に戻す）"""
+    db_session.close()
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE conversation_summaries"))
+    monkeypatch.setattr(crud.summary_table, "enabled", True)
+
+    async def detect():
+        async with AsyncSessionLocal() as db:
+            return await async_crud.detect_summary_table(db)
+
+    assert run(detect()) is False
+
+
+def test_reply_works_without_summary_table(run, client, db_session, user_id, target_id, add_conversations,
+                                           fake_openai, without_summary_table):
+    # 直近N件の読み込みから漏れる古い会話があっても、要約せず直近の会話だけで生成する
+    add_conversations(120)
+
+    response = run(client.post("/api/langchain/generate-reply", json={
+        "userId": user_id, "selectedTargetId": target_id, "message": "こんにちは",
+    }))
+    assert response.status_code == 200
+    assert not fake_openai.chat_calls(lambda b: "会話履歴を要約" in _text(b["messages"][0]["content"]))
+
+    response = run(client.post("/api/langchain/generate-batch", json={
+        "userId": user_id, "items": [{"selectedTargetId": target_id, "message": "こんにちは"}],
+    }))
+    assert response.status_code == 200
+    assert response.json()["results"][0]["status"] == "success"
+
+    response = run(client.post("/api/conversations/import", json={
+        "userId": user_id, "targetId": target_id,
+        "turns": [{"femaleMessage": "f", "maleReply": "m", "createdAt": "2020-01-01T00:00:00"}],
+    }))
+    assert response.status_code == 200
@@ -0,0 +1,120 @@
+import asyncio
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from service.modules.singleflight import SingleFlight
+
+CONCURRENCY = 20
+
+
+def _png_base64(color) -> str:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def test_concurrent_calls_with_same_key_share_one_call(run):
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("key", fetch) for _ in range(CONCURRENCY)))
+
+    assert run(scenario()) == ["result"] * CONCURRENCY
+    assert len(calls) == 1
+    assert flight.stats() == {"name": "test", "leaders": 1, "followers": CONCURRENCY - 1, "inflight": 0}
+    # 完了後はキーを解放し、次の呼び出しは上流を呼び直す
+    assert run(flight.do("key", fetch)) == "result"
+    assert len(calls) == 2
+
+
+def test_exception_is_shared_by_all_waiters(run):
+    flight = SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise ValueError("upstream failed")
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("key", fail) for _ in range(5)), return_exceptions=True)
+
+    results = run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats()["inflight"] == 0
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call(run):
+    flight = SingleFlight("test")
+
+    async def fetch():
+        await asyncio.sleep(0.1)
+        return "result"
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.do("key", fetch))
+        second = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert run(scenario()) == ("result", True)
+
+
+@pytest.mark.parametrize("path, payload", [
+    ("/api/vision/analyze-profile", {"images": [_png_base64("red"), _png_base64("blue")]}),
+    ("/api/vision/analyze-profile", {"images": [_png_base64("red"), _png_base64("blue")], "mode": "parallel"}),
+])
+def test_duplicate_profile_uploads_share_vision_calls(run, client, fake_openai, path, payload):
+    fake_openai.delay = 0.2
+
+    async def scenario():
+        return await asyncio.gather(*(client.post(path, json=payload) for _ in range(CONCURRENCY)))
+
+    responses = run(scenario())
+
+    assert {response.status_code for response in responses} == {200}
+    assert {response.json()["profile"]["name"] for response in responses} == {"花子"}
+    # single は全画像で1回、parallel は画像ごとに1回
+    assert fake_openai.chat_calls() == (2 if payload.get("mode") == "parallel" else 1)
+
+
+def test_duplicate_chat_screenshots_share_one_vision_call(run, client, user_id, target_id, fake_openai):
+    fake_openai.delay = 0.2
+    image = _png_base64("green")
+
+    async def scenario():
+        return await asyncio.gather(*(
+            client.post("/api/vision/analyze-chat", json={"image": image, "userId": user_id, "targetId": target_id})
+            for _ in range(CONCURRENCY)
+        ))
+
+    responses = run(scenario())
+
+    assert {response.status_code for response in responses} == {200}
+    assert {response.json()["message"] for response in responses} == {"今度ごはん行きませんか？"}
+    assert fake_openai.chat_calls() == 1
+
+
+def test_duplicate_generate_reply_requests_share_one_llm_call(run, client, user_id, target_id, fake_openai):
+    fake_openai.delay = 0.2
+    payload = {"userId": user_id, "selectedTargetId": target_id, "message": "今日は何してた？", "regenerate": True}
+
+    # 各リクエストは応答までDB接続を保持するため、コネクションプールの上限（5+10）内の件数で送る
+    async def scenario():
+        return await asyncio.gather(*(
+            client.post("/api/langchain/generate-reply", json=payload) for _ in range(10)
+        ))
+
+    responses = run(scenario())
+
+    assert {response.status_code for response in responses} == {200}
+    assert len({tuple(r["text"] for r in response.json()["replies"]) for response in responses}) == 1
+    assert fake_openai.chat_calls() == 1
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import time
+
+import pytest
+from openai import AsyncOpenAI
+
+from service.modules.upstream import UpstreamRateLimitedError, UpstreamScheduler, UpstreamUnavailableError
+
+
+@pytest.fixture
+def openai_client(run, fake_openai):
+    client = AsyncOpenAI(api_key="sk-test", base_url=os.environ["OPENAI_BASE_URL"], max_retries=0)
+    yield client
+    run(client.close())
+
+
+def _chat(client):
+    return lambda: client.chat.completions.create(
+        model="gpt-4.1-mini", messages=[{"role": "user", "content": "hi"}]
+    )
+
+
+def test_429_is_retried_after_retry_after(run, fake_openai, openai_client):
+    scheduler = UpstreamScheduler(retry_base=0.01)
+    fake_openai.fail_429 = 2
+    fake_openai.retry_after = "0.1"
+
+    started = time.perf_counter()
+    response = run(scheduler.run("gpt-4.1-mini", 10, _chat(openai_client)))
+    elapsed = time.perf_counter() - started
+
+    assert response.choices[0].message.content
+    assert len(fake_openai.requests) == 3
+    assert scheduler.stats()["retries"] == 2
+    assert scheduler.stats()["rateLimited"] == 2
+    assert elapsed >= 0.2
+
+
+def test_429_that_persists_surfaces_retry_after(run, fake_openai, openai_client):
+    scheduler = UpstreamScheduler(max_retries=1, retry_base=0.01)
+    fake_openai.fail_429 = 10
+
+    with pytest.raises(UpstreamRateLimitedError) as e:
+        run(scheduler.run("gpt-4.1-mini", 10, _chat(openai_client)))
+
+    assert e.value.status_code == 429
+    assert e.value.retry_after >= 0.05
+    assert len(fake_openai.requests) == 2
+
+
+def test_retry_after_beyond_limit_is_not_waited_for(run, fake_openai, openai_client):
+    scheduler = UpstreamScheduler(retry_base=0.01, retry_max=1)
+    fake_openai.fail_429 = 10
+    fake_openai.retry_after = "30"
+
+    started = time.perf_counter()
+    with pytest.raises(UpstreamRateLimitedError) as e:
+        run(scheduler.run("gpt-4.1-mini", 10, _chat(openai_client)))
+
+    assert time.perf_counter() - started < 1
+    assert e.value.retry_after >= 30
+    assert len(fake_openai.requests) == 1
+
+
+def test_endpoint_returns_429_with_retry_after_header(run, client, user_id, target_id, fake_openai):
+    fake_openai.fail_429 = 100
+
+    response = run(client.post("/api/langchain/generate-reply", json={
+        "userId": user_id, "selectedTargetId": target_id, "message": "こんにちは",
+    }))
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    # SDKの再試行は無効で、スケジューラの再試行回数だけ呼び出す
+    assert fake_openai.chat_calls() == 1 + 3
+
+
+def test_full_queue_rejects_with_503(run):
+    scheduler = UpstreamScheduler(max_concurrency=1, max_queue=1, queue_timeout=5)
+    release = asyncio.Event()
+
+    async def hold():
+        await release.wait()
+        return "done"
+
+    async def scenario():
+        running = asyncio.create_task(scheduler.run("m", 1, hold))
+        await asyncio.sleep(0.01)
+        queued = asyncio.create_task(scheduler.run("m", 1, hold))
+        await asyncio.sleep(0.01)
+        with pytest.raises(UpstreamUnavailableError) as e:
+            await scheduler.run("m", 1, hold)
+        release.set()
+        return e.value, await running, await queued
+
+    error, first, second = run(scenario())
+
+    assert error.status_code == 503
+    assert error.retry_after >= 1
+    assert (first, second) == ("done", "done")
+    assert scheduler.stats()["rejected"] == 1
+
+
+def test_queue_timeout_rejects_with_503(run):
+    scheduler = UpstreamScheduler(max_concurrency=1, queue_timeout=0.05)
+    release = asyncio.Event()
+
+    async def scenario():
+        running = asyncio.create_task(scheduler.run("m", 1, release.wait))
+        await asyncio.sleep(0.01)
+        with pytest.raises(UpstreamUnavailableError) as e:
+            await scheduler.run("m", 1, release.wait)
+        release.set()
+        await running
+        return e.value
+
+    assert run(scenario()).status_code == 503
+
+
+def test_rate_limited_model_does_not_starve_other_models(run, monkeypatch):
+    # slowは1分あたり60トークン（満杯の60トークンを使い切ると次は約60秒後）
+    monkeypatch.setenv("UPSTREAM_TOKENS_PER_MINUTE_SLOW", "60")
+    scheduler = UpstreamScheduler(max_concurrency=2, queue_timeout=5)
+
+    async def call():
+        return "done"
+
+    async def scenario():
+        await scheduler.run("slow", 60, call)
+        waiting = [asyncio.create_task(scheduler.run("slow", 60, call)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        result = await scheduler.run("fast", 60, call)
+        elapsed = time.perf_counter() - started
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+        return result, elapsed
+
+    result, elapsed = run(scenario())
+
+    assert result == "done"
+    assert elapsed < 0.5
+    assert scheduler.stats()["inflight"] == 0
@@ -0,0 +1,71 @@
+import asyncio
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from service.app.api.vision_routes import vision_cache
+
+
+def _png(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _png_base64(color) -> str:
+    return "data:image/png;base64," + base64.b64encode(_png(color)).decode("ascii")
+
+
+@pytest.mark.parametrize("mode", ["single", "parallel"])
+def test_empty_profile_images_are_rejected(run, client, fake_openai, mode):
+    response = run(client.post("/api/vision/analyze-profile", json={"images": [], "mode": mode}))
+
+    assert response.status_code == 422
+    assert fake_openai.chat_calls() == 0
+
+
+def test_profile_upload_without_images_is_rejected(run, client, fake_openai):
+    response = run(client.post("/api/vision/analyze-profile/upload", data={"mode": "parallel"}))
+
+    assert response.status_code == 422
+    assert fake_openai.chat_calls() == 0
+
+
+def test_parallel_profile_merges_per_image_extractions(run, client, fake_openai):
+    response = run(client.post("/api/vision/analyze-profile", json={
+        "images": [_png_base64("red"), _png_base64("blue")], "mode": "parallel",
+    }))
+
+    assert response.status_code == 200
+    assert response.json()["profile"]["name"] == "花子"
+    assert response.json()["fieldConfidence"]["name"] == 1.0
+    assert fake_openai.chat_calls() == 2
+
+
+def test_upload_followers_survive_leader_disconnect(run, client, fake_openai, monkeypatch):
+    aget = vision_cache.aget
+
+    async def slow_aget(key):
+        # 共有の解析が画像を読む前に、先行リクエストを切断する
+        await asyncio.sleep(0.1)
+        return await aget(key)
+
+    monkeypatch.setattr(vision_cache, "aget", slow_aget)
+    files = [("images", ("profile.png", _png("purple"), "image/png"))]
+    data = {"mode": "single"}
+
+    async def scenario():
+        leader = asyncio.ensure_future(client.post("/api/vision/analyze-profile/upload", files=files, data=data))
+        await asyncio.sleep(0.02)
+        follower = asyncio.ensure_future(client.post("/api/vision/analyze-profile/upload", files=files, data=data))
+        await asyncio.sleep(0.02)
+        leader.cancel()
+        return await follower
+
+    response = run(scenario())
+
+    assert response.status_code == 200
+    assert response.json()["profile"]["name"] == "花子"
+    assert fake_openai.chat_calls() == 1
@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import event
+
+from service.modules import async_crud, crud
+from service.modules.database import AsyncSessionLocal, SessionLocal, async_engine, engine
+
+
+class StatementLog:
+    """エンジンで実行されたSQL文の種類（SELECT / INSERT / UPDATE ...）とCOMMITを実行順に記録する"""
+
+    def __init__(self, sync_engine):
+        self.sync_engine = sync_engine
+        self.kinds = []
+
+    def _execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.kinds.append(statement.split(None, 1)[0].upper())
+
+    def _commit(self, conn):
+        self.kinds.append("COMMIT")
+
+    def __enter__(self):
+        event.listen(self.sync_engine, "before_cursor_execute", self._execute)
+        event.listen(self.sync_engine, "commit", self._commit)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.sync_engine, "before_cursor_execute", self._execute)
+        event.remove(self.sync_engine, "commit", self._commit)
+
+
+@pytest.fixture
+def sync_statements(db_session):
+    with StatementLog(engine) as log:
+        yield log
+
+
+@pytest.fixture
+def async_statements(db_session):
+    with StatementLog(async_engine.sync_engine) as log:
+        yield log
+
+
+def test_update_tone_is_one_update(run, client, user_id, sync_statements):
+    response = run(client.put("/api/users/tone", json={"user_id": user_id, "tone": 2}))
+
+    assert response.status_code == 200
+    assert response.json()["tone"] == 2
+    assert sync_statements.kinds == ["UPDATE", "COMMIT"]
+
+
+def test_update_tone_for_missing_user_is_one_update(run, client, user_id, sync_statements):
+    response = run(client.put("/api/users/tone", json={"user_id": user_id + 100, "tone": 2}))
+
+    assert response.status_code == 404
+    assert sync_statements.kinds == ["UPDATE", "COMMIT"]
+
+
+def test_get_user_is_one_select(run, client, user_id, sync_statements):
+    response = run(client.get(f"/api/users/{user_id}"))
+
+    assert response.status_code == 200
+    assert response.json()["name"] == "太郎"
+    assert sync_statements.kinds == ["SELECT"]
+
+
+def test_sync_writes_are_one_statement_each(user_id, target_id, sync_statements):
+    with SessionLocal() as db:
+        cases = [
+            (lambda: crud.create_user(db, "auth0|2", "次郎", "jiro@example.com", age=25), ["INSERT", "COMMIT"]),
+            (lambda: crud.create_target(db, user_id, "桜", age=26), ["INSERT", "COMMIT"]),
+            (lambda: crud.create_conversation(db, user_id, target_id, "f", "m"), ["INSERT", "COMMIT"]),
+            (lambda: crud.update_user(db, user_id, job="エンジニア"), ["UPDATE", "COMMIT"]),
+            (lambda: crud.update_target(db, target_id, job="看護師"), ["UPDATE", "COMMIT"]),
+        ]
+        for write, expected in cases:
+            sync_statements.kinds.clear()
+            entity = write()
+            assert sync_statements.kinds == expected
+            # RETURNINGで受け取った値は、コミット後に読んでもSELECTを発行しない
+            assert entity.id is not None
+            assert sync_statements.kinds == expected
+
+        sync_statements.kinds.clear()
+        assert crud.update_target(db, target_id + 100, job="看護師") is None
+        assert sync_statements.kinds == ["UPDATE", "COMMIT"]
+
+
+def test_async_writes_are_one_statement_each(run, user_id, target_id, async_statements):
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            cases = [
+                (async_crud.create_user(db, "auth0|2", "次郎", "jiro@example.com"), ["INSERT", "COMMIT"]),
+                (async_crud.create_target(db, user_id, "桜"), ["INSERT", "COMMIT"]),
+                (async_crud.create_conversation(db, user_id, target_id, "f", "m"), ["INSERT", "COMMIT"]),
+                (async_crud.update_user(db, user_id, tone=3), ["UPDATE", "COMMIT"]),
+                (async_crud.update_target(db, target_id, age=29), ["UPDATE", "COMMIT"]),
+            ]
+            for write, expected in cases:
+                async_statements.kinds.clear()
+                entity = await write
+                assert async_statements.kinds == expected
+                assert entity.id is not None
+                assert async_statements.kinds == expected
+
+    run(scenario())